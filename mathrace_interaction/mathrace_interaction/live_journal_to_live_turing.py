@@ -159,9 +159,7 @@ def live_journal_to_live_turing(
                     event_obj = Jolly(gara=turing_race, **event_dict_copy)
                 elif event_subclass == "Bonus":
                     event_obj = Bonus(gara=turing_race, **event_dict_copy)
-                event_obj.save()
-                # Django requires to explicitly set the datetime field after saving, see Gara.create_from_dict
-                event_obj.orario = event_dict_copy["orario"]
+                # The explicit datetime is preserved when saving, so that the event is written only once
                 event_obj.save()
                 assert event_obj.orario == event_dict_copy["orario"]
         # Update the previous turing dictionary
@@ -404,7 +404,7 @@ document.client.timer.now = function mock_timer() {{
             # Force an update of the race time, and wait for the updated event to be triggered
             # in order to be sure that the classification has been updated
             self._browser.execute_script("""\
-    document.client.gara.time = document.client.timer.now()
+    document.client.progress = document.client.timer.now()
     document.updated = false;""")  # type: ignore[no-untyped-call]
             self._wait_for_classification_computed()
 
@@ -422,7 +422,7 @@ delete document.client.timer_backup;""")  # type: ignore[no-untyped-call]
             # Force an update of the race time, and wait for the updated event to be triggered
             # in order to be sure that the classification has been updated
             self._browser.execute_script("""\
-    document.client.gara.time = document.client.timer.now()
+    document.client.progress = document.client.timer.now()
     document.updated = false;""")  # type: ignore[no-untyped-call]
             self._wait_for_classification_computed()
 
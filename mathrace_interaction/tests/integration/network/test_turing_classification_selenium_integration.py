@@ -258,6 +258,80 @@ def test_classification_browser_get_teams_score_integration_over_time(  # type:
     browser3.quit()
 
 
+def test_classification_browser_replay_slider_integration(  # type: ignore[no-any-unimported]
+    live_server: pytest_django.live_server_helper.LiveServer, simple_turing_race: engine.models.Gara,
+    admin_user: engine.models.User
+) -> None:
+    """Test that moving the replay slider updates the scores when the race is computed in a web worker."""
+    simple_turing_race.admin = admin_user
+    simple_turing_race.save()
+    browser = Browser(live_server, simple_turing_race.pk)
+    browser.login(admin_user)
+    browser.go_to_classification_page("squadre", {"ended": "true"})
+    assert browser._browser.execute_script(  # type: ignore[no-untyped-call]
+        "return document.client._worker !== null;")
+
+    # Move the slider just after the first answer submission
+    browser._browser.execute_script("""\
+document.updated = false;
+$('#myRange').val(335).trigger('input');""")  # type: ignore[no-untyped-call]
+    browser._wait_for_classification_computed()
+    browser.lock()
+    assert browser.get_teams_score() == [70, 70, 70, 70, 115, 70, 70, 70, 70, 70]
+    browser.unlock()
+
+    # Move the slider back, before the first answer submission
+    browser._browser.execute_script("""\
+document.updated = false;
+$('#myRange').val(300).trigger('input');""")  # type: ignore[no-untyped-call]
+    browser._wait_for_classification_computed()
+    browser.lock()
+    assert browser.get_teams_score() == [70, 70, 70, 70, 70, 70, 70, 70, 70, 70]
+    browser.unlock()
+
+    browser.quit()
+
+
+def test_classification_browser_freeze_unfreeze_time_integration(  # type: ignore[no-any-unimported]
+    live_server: pytest_django.live_server_helper.LiveServer, simple_turing_race: engine.models.Gara,
+    admin_user: engine.models.User
+) -> None:
+    """Test freeze/unfreeze time with classification update when the race is computed in a web worker."""
+    simple_turing_race.admin = admin_user
+    simple_turing_race.save()
+    race_date = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+    browser = Browser(live_server, simple_turing_race.pk)
+    browser.login(admin_user)
+    browser.go_to_classification_page(
+        "squadre", {"race_time": "00:05:28", "ended": "false", "computation_rate": "1"})
+    assert browser._browser.execute_script(  # type: ignore[no-untyped-call]
+        "return document.client._worker !== null;")
+    timer_to_int = mathrace_interaction.time.convert_timestamp_to_number_of_seconds
+
+    # Freeze time just after the first answer submission
+    browser.freeze_time(race_date + datetime.timedelta(minutes=5, seconds=35))
+    browser.lock()
+    assert timer_to_int(browser.page_soup.find(id="orologio").text) == 335  # type: ignore[union-attr]
+    assert browser.get_teams_score() == [70, 70, 70, 70, 115, 70, 70, 70, 70, 70]
+    browser.unlock()
+
+    # Freeze time again, before the first answer submission
+    browser.freeze_time(race_date + datetime.timedelta(minutes=5))
+    browser.lock()
+    assert timer_to_int(browser.page_soup.find(id="orologio").text) == 300  # type: ignore[union-attr]
+    assert browser.get_teams_score() == [70, 70, 70, 70, 70, 70, 70, 70, 70, 70]
+    browser.unlock()
+
+    # Once time is unfrozen, the race goes on from 00:05:28
+    browser.unfreeze_time()
+    browser._wait_for_classification_timer("00:05:31")
+    browser.lock()
+    assert browser.get_teams_score()[4] == 115
+    browser.unlock()
+
+    browser.quit()
+
+
 def test_classification_browser_get_teams_position_integration(  # type: ignore[no-any-unimported]
     live_server: pytest_django.live_server_helper.LiveServer, simple_turing_race: engine.models.Gara,
     any_user: engine.models.User
@@ -11,6 +11,7 @@ import os
 import pathlib
 import typing
 
+import engine.classifica
 import engine.models
 import pytest
 import pytest_django.live_server_helper
@@ -67,13 +68,53 @@ def test_json_scores(
     browser.quit()
 
 
+@pytest.mark.django_db
+def test_journal_scores_server_side(
+    journal: typing.TextIO, journal_name: str, data_dir: pathlib.Path,
+    read_score_file: mathrace_interaction.typing.ReadScoreFileFixtureType
+) -> None:
+    """Test that the final race scores computed by turing server-side engine are equal to the expected ones."""
+    # Import the journal into turing via journal_reader
+    journal_year, _ = journal_name.split(os.sep, maxsplit=1)
+    journal_date = datetime.datetime(int(journal_year), 1, 1, tzinfo=datetime.UTC)
+    with mathrace_interaction.journal_reader(journal) as journal_stream:
+        turing_dict = journal_stream.read(journal_name, journal_date)
+    mathrace_interaction.filter.strip_mathrace_only_attributes_from_imported_turing(turing_dict)
+    mathrace_interaction.filter.strip_trailing_zero_bonus_superbonus_from_imported_turing(turing_dict)
+    gara = engine.models.Gara.create_from_dict(turing_dict)
+    # Compute the scores on the server, and sort them by team number
+    classification = engine.classifica.calcola_classifica(gara)
+    actual = [team["punteggio"] for team in sorted(classification["squadre"], key=lambda team: team["num"])]
+    # Compare the computed scores to the expected ones
+    expected = read_score_file(data_dir, journal_name)
+    assert actual == expected
+
+
+@pytest.mark.django_db
+def test_json_scores_server_side(
+    json_name: str, data_dir: pathlib.Path,
+    read_score_file: mathrace_interaction.typing.ReadScoreFileFixtureType
+) -> None:
+    """Test that the final race scores computed by turing server-side engine are equal to the expected ones."""
+    # Import the json file into turing
+    with open(data_dir / json_name) as json_stream:
+        turing_dict = json.load(json_stream)
+    gara = engine.models.Gara.create_from_dict(turing_dict)
+    # Compute the scores on the server, and sort them by team number
+    classification = engine.classifica.calcola_classifica(gara)
+    actual = [team["punteggio"] for team in sorted(classification["squadre"], key=lambda team: team["num"])]
+    # Compare the computed scores to the expected ones
+    expected = read_score_file(data_dir, json_name)
+    assert actual == expected
+
+
 @pytest.mark.parametrize("order_attribute_in_json,order_attribute_in_score,ended", [
     # These cases give the correct classification
     ("correct", "correct", True),
     ("correct", "correct", False),
     ("wrong", "correct", True), # purposely using the other score file
-    # This case gives the wrong classification
-    ("wrong", "wrong", False)
+    # This case used to give the wrong classification (i.e., the one in the other score file)
+    ("wrong", "correct", False) # purposely using the other score file
 ])
 def test_smartematica_2024_short_wrong_order_bug(  # type: ignore[no-any-unimported]
     data_dir: pathlib.Path, live_server: pytest_django.live_server_helper.LiveServer,
@@ -81,7 +122,7 @@ def test_smartematica_2024_short_wrong_order_bug(  # type: ignore[no-any-unimpor
     order_attribute_in_json: str, order_attribute_in_score: str, ended: bool
 ) -> None:
     """
-    Test to show that storing event in an incorrect order can cause wrong classification results.
+    Test that storing event in an incorrect order does not cause wrong classification results anymore.
 
     The file bugs/smartematica_2024_short_wrong_order.json contains a shorter version of the Smartematica 2024.
     The file contains the first 01h:01min:28sec of 01h:40min:00sec race.
@@ -93,7 +134,9 @@ def test_smartematica_2024_short_wrong_order_bug(  # type: ignore[no-any-unimpor
       Hence, the second block contains some events that should have been stored before the first block.
       In particular, 46 events out of 63 in the second block are of type "Consegna".
 
-    The results of the classification are not consistent during (?ended=false) and after (?ended=true) the race.
+    The results of the classification used not to be consistent during (?ended=false) and after (?ended=true)
+    the race. The backtraces below refer to the implementation with separate last_consegna_id, last_jolly_id and
+    last_bonus_id cursors, which were the ID of the last event in chronological order, rather than the largest ID.
 
     === Backtrace of client.js with ?ended=false ===
     0) The events are stored in the database as follows
@@ -163,6 +206,11 @@ def test_smartematica_2024_short_wrong_order_bug(  # type: ignore[no-any-unimpor
     steps 0), 1) and 2), resulting in the correct classification.
     Even upon moving the replay controller, step 3) is never queried (i.e., the database is never interrogated again),
     and already existing and correctly sorted events are just moved between the passato and futuro arrays.
+
+    === Fix ===
+    The server now returns last_evento_id, the largest ID of any event sent to the client, and client.update()
+    queries Gara.get_eventi_successivi(last=last_evento_id). In step 3) the query is Gara.get_eventi_successivi(369),
+    which returns no events, hence no extra copies are ever added to the futuro array.
     """
     # Import the json files into turing
     with open(data_dir / f"bugs/smartematica_2024_short_{order_attribute_in_json}_order.json") as json_stream:
@@ -186,7 +234,7 @@ def test_smartematica_2024_short_wrong_order_bug(  # type: ignore[no-any-unimpor
         browser.find_element(selenium.webdriver.common.by.By.ID, "elapsedTimeText").send_keys("01:30:05")
         browser._browser.execute_script("$('#elapsedTimeText').blur()")  # type: ignore[no-untyped-call]
     browser._wait_for_classification_timer("01:30:05")
-    # Ensure that scores after the first recomputation are affected by the bug
+    # Ensure that scores after the first recomputation are not affected by the bug
     browser.lock()
     assert browser.get_teams_score() == read_score_file(
         data_dir, f"bugs/smartematica_2024_short_{order_attribute_in_score}_order.json")
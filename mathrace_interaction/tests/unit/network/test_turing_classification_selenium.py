@@ -593,12 +593,6 @@ setInterval(function(){
     document.updated = true;
 }, 1000);
 
-class Gara {
-    constructor() {
-        this.time = 0;
-    }
-}
-
 class Timer {
     constructor() {
         this.called = 0;
@@ -611,17 +605,21 @@ class Timer {
 
 class Client {
     constructor() {
-        this.gara = new Gara();
+        this.time = 0;
         this.timer = new Timer();
     }
+
+    set progress(value) {
+        this.time = value;
+    }
 }
 
 document.client = new Client();
 
 function incrementTime() {
     document.client.timer.called += 1;
-    document.client.gara.time = document.client.timer.now();
-    document.getElementById("orologio").textContent = "Current time is " + document.client.gara.time.toString();
+    document.client.progress = document.client.timer.now();
+    document.getElementById("orologio").textContent = "Current time is " + document.client.time.toString();
 };
 </script>
 <span id="orologio">Current time is 0</span>
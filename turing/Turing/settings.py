@@ -37,6 +37,13 @@ EMAIL_PORT = config('EMAIL_PORT', default=587, cast=int)
 
 REGISTRATION_OPEN = config('REGISTRATION_OPEN', default=False, cast=bool)
 
+# Long polling delle classifiche: le richieste di aggiornamento restano in attesa di nuovi eventi per al più
+# LONG_POLLING_ATTESA secondi, anziché essere ripetute ad intervalli regolari. Ogni richiesta in attesa occupa
+# un thread del server, e le notifiche raggiungono gli altri processi solo con una cache condivisa (vedi
+# CACHE_BACKEND): va abilitato solo con un server che gestisce molte connessioni e una cache condivisa.
+LONG_POLLING = config('LONG_POLLING', default=False, cast=bool)
+LONG_POLLING_ATTESA = config('LONG_POLLING_ATTESA', default=5, cast=float)
+
 
 # Application definition
 
@@ -129,6 +136,17 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/ref/settings/#caches
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class EngineConfig(AppConfig):
     name = 'engine'
+
+    def ready(self):
+        # Registra i receiver che mantengono aggiornata la classifica in cache
+        import engine.signals  # noqa: F401
+        import engine.checks  # noqa: F401
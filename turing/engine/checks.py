@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+
+@register()
+def controlla_long_polling(app_configs, **kwargs):
+    """Il long polling richiede una cache condivisa tra i processi del server, vedi LONG_POLLING"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if getattr(settings, 'LONG_POLLING', False) and backend.endswith('LocMemCache'):
+        return [Warning(
+            "LONG_POLLING è abilitato con una cache locale al processo",
+            hint="Le notifiche non raggiungono gli altri processi del server: impostare CACHE_BACKEND "
+                 "e CACHE_LOCATION con una cache condivisa, oppure disabilitare LONG_POLLING.",
+            id="engine.W001",
+        )]
+    return []
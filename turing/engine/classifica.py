@@ -0,0 +1,713 @@
+"""
+Calcolo della classifica lato server.
+
+Replica fedelmente il modello (Gara, Problema, Risposta, Squadra) implementato in
+static/engine/js/client.js, in modo che la classifica possa essere calcolata una sola
+volta sul server invece che su ogni client. Qualsiasi modifica alle regole di calcolo
+del punteggio deve essere riportata in entrambe le implementazioni.
+"""
+
+from datetime import datetime, timedelta
+from itertools import groupby
+import time
+import uuid
+
+from django.core.cache import cache
+from django.utils import dateparse, timezone
+
+
+def converti_orario(orario):
+    """
+    Converte un orario (datetime o stringa ISO) in un datetime troncato al millisecondo,
+    che è la precisione degli oggetti Date usati dal client.
+    """
+    if orario is None:
+        return None
+    if not isinstance(orario, datetime):
+        orario = dateparse.parse_datetime(orario)
+    return orario.replace(microsecond=orario.microsecond // 1000 * 1000)
+
+
+class StatoGara:
+    """
+    Stato di una gara ad un dato orario, equivalente alla classe Gara di client.js
+    """
+    penalita_errore = 10
+    coefficiente_derivata = 1
+    coefficiente_bonus_errori = 2
+    coefficiente_jolly = 2
+    durata_scadenza_jolly = timedelta(minutes=12)
+
+    def __init__(self, data):
+        # Costruisce la gara a partire dai dati nel formato restituito da StatusView
+        self.inizio = converti_orario(data["inizio"])
+        self._time = None
+
+        self.n_prob = data["n_prob"]
+        self.fixed_bonus = list(data["fixed_bonus"])
+        self.super_mega_bonus = list(data["super_mega_bonus"])
+        self.n_blocco = data["n_blocco"]
+        self.k_blocco = data["k_blocco"]
+        self.punteggio_iniziale_squadre = data["punteggio_iniziale_squadre"]
+        self.jolly_enabled = data["jolly_enabled"]
+
+        self.problemi = {}
+        for i in sorted(data["problemi"], key=int):
+            self.problemi[int(i)] = StatoProblema(self, int(i), data["problemi"][i]["nome"], data["problemi"][i]["punteggio"])
+
+        self.squadre = {}
+        for i in sorted(data["squadre"], key=int):
+            self.squadre[int(i)] = StatoSquadra(self, int(i), data["squadre"][i]["nome"], data["squadre"][i]["ospite"])
+
+        self.consegne = []
+        self.bonus = []
+        # Numero di consegne e bonus già processati, nell'ordine in cui sono stati ricevuti
+        self._consegne_processate = 0
+        self._bonus_processati = 0
+        # Se True, gli eventi già processati sono stati scartati e non si può tornare indietro nel tempo
+        self._compattato = False
+        # Identificativo dell'ultimo evento ricevuto, e orario dell'ultima consegna ricevuta
+        self.ultimo_evento = 0
+        # Numero di eventi ricevuti, per controllare che non ne manchi nessuno rispetto al database
+        self.num_eventi = 0
+        self._orario_ultima_consegna = None
+
+        if self.inizio is None:
+            return
+
+        self._time = self.inizio  # Parte a calcolare dall'inizio della gara
+        self.fine = converti_orario(data["fine"])
+        self.tempo_blocco = converti_orario(data["tempo_blocco"])
+        self.en_plein = 0
+
+        for evento in data["jolly"]:
+            # Imposta quali risposte valgono doppio
+            self.add_jolly(evento)
+        for evento in data["bonus"]:
+            self.add_bonus(evento)
+        for evento in data["consegne"]:
+            self.add_consegna(evento)
+
+    @classmethod
+    def from_gara(cls, gara):
+        """Costruisce lo stato di gara leggendo i dati dal database"""
+        data = {
+            'inizio': gara.inizio,
+            'n_prob': gara.num_problemi,
+            'problemi': gara.get_problemi(),
+            'squadre': gara.get_squadre(),
+            'fixed_bonus': gara.fixed_bonus_array,
+            'super_mega_bonus': gara.super_mega_bonus_array,
+            'n_blocco': gara.n_blocco,
+            'k_blocco': gara.k_blocco,
+            'punteggio_iniziale_squadre': gara.punteggio_iniziale_squadre,
+            'jolly_enabled': gara.jolly,
+        }
+        if gara.inizio is not None:
+            data.update({
+                # Non si usano get_ora_fine e get_ora_blocco, che restituiscono None se la gara è sospesa
+                'fine': gara.inizio + gara.durata,
+                'tempo_blocco': gara.inizio + gara.durata - gara.durata_blocco,
+                'consegne': gara.get_consegne(),
+                'jolly': gara.get_jolly(),
+                'bonus': gara.get_bonus(),
+            })
+        return cls(data)
+
+    def _orario_evento(self, orario):
+        # Se l'evento è avvenuto dopo la fine, fallo accadere alla fine.
+        return min(converti_orario(orario), self.fine)
+
+    def add_jolly(self, evento):
+        squadra = self.squadre[int(evento["squadra"])]
+        squadra.jolly = squadra.risposte[int(evento["problema"])]
+        squadra.jolly.is_jolly = True
+        self.ultimo_evento = max(self.ultimo_evento, evento["id"])
+        self.num_eventi += 1
+
+    def add_consegna(self, evento):
+        orario = self._orario_evento(evento["orario"])
+        self.consegne.append(StatoConsegna(
+            evento["id"], orario, self.squadre[int(evento["squadra"])], self.problemi[int(evento["problema"])], evento["giusta"]))
+        self.ultimo_evento = max(self.ultimo_evento, evento["id"])
+        self.num_eventi += 1
+        self._orario_ultima_consegna = orario
+
+    def add_bonus(self, evento):
+        self.bonus.append(StatoBonus(
+            evento["id"], self._orario_evento(evento["orario"]), self.squadre[int(evento["squadra"])], evento["punteggio"]))
+        self.ultimo_evento = max(self.ultimo_evento, evento["id"])
+        self.num_eventi += 1
+
+    def accetta_consegne(self, consegne):
+        """
+        Controlla che le consegne possano essere aggiunte in coda senza alterare l'ordine cronologico,
+        cioè che il risultato sia lo stesso che si otterrebbe ricalcolando la gara da zero.
+        """
+        if self._orario_ultima_consegna is None:
+            return True
+        return all(self._orario_evento(c["orario"]) >= self._orario_ultima_consegna for c in consegne)
+
+    def compatta(self):
+        """
+        Scarta gli eventi già processati. Lo stato risultante ha una dimensione proporzionale al numero
+        di squadre e di problemi (e non al numero di eventi), ma non può più tornare indietro nel tempo.
+        """
+        self.consegne = self.consegne[self._consegne_processate:]
+        self.bonus = self.bonus[self._bonus_processati:]
+        self._consegne_processate = 0
+        self._bonus_processati = 0
+        self._compattato = True
+
+    @property
+    def time(self):
+        return self._time
+
+    @time.setter
+    def time(self, value):
+        if self.inizio is None:
+            return
+        value = converti_orario(value)
+        nel_futuro = (value >= self._time)  # necessario memorizzare perchè gli aggiornamenti cambiano internamente self._time
+        if not nel_futuro and self._compattato:
+            raise ValueError("Uno stato di gara compattato non può tornare indietro nel tempo")
+        self._consegne_processate = self._update_events(value, nel_futuro, self.consegne, self._consegne_processate)
+        self._bonus_processati = self._update_events(value, nel_futuro, self.bonus, self._bonus_processati)
+        # Finalmente, setta il tempo della gara
+        self._time = value
+
+    def _update_events(self, new_time, nel_futuro, eventi, processati):
+        # Si sposta al tempo specificato, calcolando gli eventi in mezzo
+        if nel_futuro:
+            while processati < len(eventi) and eventi[processati].orario <= new_time:
+                e = eventi[processati]
+                self._time = e.orario  # Porta la gara all'ora dell'evento
+                e.applica()
+                processati += 1
+        else:
+            while processati > 0 and eventi[processati - 1].orario > new_time:
+                e = eventi[processati - 1]
+                self._time = e.orario  # Porta la gara all'ora dell'evento
+                e.annulla()
+                processati -= 1
+        return processati
+
+    def avanza_per_consegna(self):
+        """
+        Porta la gara avanti una consegna alla volta fino all'ultima ricevuta, restituendo ogni volta la consegna
+        appena processata, come fa client.js quando memorizza le posizioni in classifica dopo ogni consegna.
+        Come in client.js, consegne e bonus vengono processati in ordine di orario, e a parità di orario
+        di identificativo.
+        """
+        while self._consegne_processate < len(self.consegne):
+            e = self.consegne[self._consegne_processate]
+            while (self._bonus_processati < len(self.bonus)
+                   and (self.bonus[self._bonus_processati].orario, self.bonus[self._bonus_processati].id) < (e.orario, e.id)):
+                b = self.bonus[self._bonus_processati]
+                self._time = b.orario  # Porta la gara all'ora del bonus
+                b.applica()
+                self._bonus_processati += 1
+            self._time = e.orario  # Porta la gara all'ora della consegna
+            e.applica()
+            self._consegne_processate += 1
+            yield e
+
+    @property
+    def soglia_blocco(self):
+        # Il momento in cui i problemi smettono di salire
+        return self.tempo_blocco
+
+    @property
+    def scadenza_jolly(self):
+        # Il momento dopo il quale mostrare i jolly
+        return self.inizio + self.durata_scadenza_jolly
+
+    @property
+    def en_plein_bonus(self):
+        return self.super_mega_bonus[self.en_plein] if self.en_plein < len(self.super_mega_bonus) else 0
+
+    def punteggio_tempo_iniziale(self):
+        if self.punteggio_iniziale_squadre is not None:
+            return self.punteggio_iniziale_squadre
+        return self.n_prob * self.penalita_errore
+
+    def _chiave_spareggio(self, squadra):
+        """
+        Chiave per lo spareggio tra squadre a pari punteggio totale, come Gara.chiave_spareggio in client.js:
+        - punteggio (compresi bonus e penalizzazioni) del problema jolly;
+        - in caso di ulteriore parità, il maggior punteggio per un singolo problema, poi il secondo maggiore, e così via;
+        - infine l'ID della squadra, assegnato in un sorteggio precedente.
+        """
+        if self.jolly_enabled:
+            jolly = squadra.jolly if squadra.jolly is not None else squadra.risposte[1]
+            punteggio_jolly = jolly.punteggio
+        else:
+            punteggio_jolly = 0
+        punteggi = sorted((r.punteggio for r in squadra.risposte.values()), reverse=True)
+        return (-punteggio_jolly, [-p for p in punteggi], squadra.id)
+
+    @property
+    def classifica(self):
+        """Lista di coppie (squadra, punteggio), ordinata secondo il regolamento"""
+        ret = []
+        # Le chiavi di spareggio vengono calcolate solo per le squadre a pari punteggio totale
+        for (_, pari) in groupby(sorted(((s, s.punteggio) for s in self.squadre.values()), key=lambda x: -x[1]), key=lambda x: x[1]):
+            pari = list(pari)
+            if len(pari) > 1:
+                pari.sort(key=lambda x: self._chiave_spareggio(x[0]))
+            ret.extend(pari)
+        return ret
+
+    @staticmethod
+    def get_classifica_posizioni(classifica):
+        """Dizionario che associa ad ogni numero di squadra la sua posizione in classifica"""
+        return {s.id: i + 1 for (i, (s, _)) in enumerate(classifica)}
+
+    @property
+    def punti_problemi(self):
+        return [{"id": p.id, "base": p.punti_base, "bonus": p.bonus} for p in self.problemi.values()]
+
+    def to_dict(self):
+        """Classifica, punteggi dei problemi e punteggi di ogni cella all'orario corrente"""
+        classifica = self.classifica
+        squadre = []
+        for (posizione, (s, pts)) in enumerate(classifica, start=1):
+            squadre.append({
+                "num": s.id,
+                "nome": s.nome,
+                "ospite": s.ospite,
+                "posizione": posizione,
+                "punteggio": pts,
+                "bonus": s.bonus_manuale + s._en_plein_bonus,
+                "risposte": {
+                    p: {"punteggio": r.punteggio, "risolto": r.risolto, "errori": r.errori, "jolly": r.is_jolly}
+                    for (p, r) in s.risposte.items()},
+            })
+        problemi = []
+        for p in self.problemi.values():
+            problemi.append({
+                "problema": p.id,
+                "nome": p.nome,
+                "base": p.punti_base,
+                "bonus": p.bonus,
+                "bloccato": p.bloccato,
+                "risposte_corrette": p._risposte_corrette,
+            })
+        return {"orario": self.time, "squadre": squadre, "problemi": problemi}
+
+
+class StatoProblema:
+    """
+    Stato di un problema, equivalente alla classe Problema di client.js
+    """
+
+    def __init__(self, gara, id, nome, punteggio):
+        self.id = id
+        self.gara = gara
+        self.nome = nome
+        self.punteggio = punteggio
+        self.lock_time = gara.inizio if gara.n_blocco == 0 else None  # Tempo a cui il problema si è bloccato
+        self._risposte_corrette = 0  # Contatore del numero di risposte corrette
+        self._risposte_sbagliate = 0  # Contatore delle risposte sbagliate prima della prima soluzione
+
+    # Segnala al problema una nuova risposta, per adeguare il suo valore
+    # NON deve essere chiamata dalla risposta di una squadra ospite
+    def aggiungi_risposta(self, giusta):
+        if giusta:
+            self._risposte_corrette += 1
+            if self._risposte_corrette == self.gara.n_blocco and self.gara.time <= self.gara.soglia_blocco:
+                self.lock_time = self.gara.time
+        else:
+            if self._risposte_corrette == 0 and self.gara.time <= self.gara.soglia_blocco:
+                self._risposte_sbagliate += 1
+
+    def rimuovi_risposta(self, giusta):
+        # Annulla l'effetto di aggiungi_risposta
+        if giusta:
+            self._risposte_corrette -= 1
+            if self.gara.n_blocco is not None and self._risposte_corrette == self.gara.n_blocco - 1 and self.gara.time <= self.gara.soglia_blocco:
+                self.lock_time = None
+        else:
+            if self._risposte_corrette == 0 and self.gara.time <= self.gara.soglia_blocco:
+                self._risposte_sbagliate -= 1
+
+    @property
+    def bloccato(self):
+        if self.gara.inizio is None:
+            return self.lock_time is not None
+        return self.lock_time is not None or self.gara.time > self.gara.soglia_blocco
+
+    @property
+    def punti_base(self):
+        # Restituisce il valore base del problema
+        if self.gara.inizio is None:
+            derivata = 0
+        else:
+            if self.lock_time is not None:
+                t = self.lock_time
+            elif self.gara.time > self.gara.soglia_blocco:
+                t = self.gara.soglia_blocco
+            else:
+                t = self.gara.time
+            derivata = ((t - self.gara.inizio) // timedelta(minutes=1)) * self.gara.coefficiente_derivata
+        bonus_errori = self._risposte_sbagliate * self.gara.coefficiente_bonus_errori
+        return self.punteggio + derivata + bonus_errori
+
+    @property
+    def bonus(self):
+        # Restituisce il bonus corrente
+        if self._risposte_corrette < len(self.gara.fixed_bonus):
+            return self.gara.fixed_bonus[self._risposte_corrette]
+        return 0
+
+
+class StatoRisposta:
+    """
+    Stato di un problema per una squadra, equivalente alla classe Risposta di client.js
+    """
+
+    def __init__(self, squadra, problema):
+        self.squadra = squadra
+        self.gara = squadra.gara
+        self.problema = problema
+        self.risolto = 0
+        self.errori = 0
+        self._is_jolly = False
+        self._bonus = 0
+
+    @property
+    def is_jolly(self):
+        if not self.gara.jolly_enabled:
+            return False
+
+        if self.gara.time is None or self.gara.time < self.gara.scadenza_jolly:
+            return False
+        elif self.squadra.jolly is None:
+            return self.problema.id == 1
+        else:
+            return self._is_jolly
+
+    @is_jolly.setter
+    def is_jolly(self, value):
+        self._is_jolly = value
+
+    def consegna(self, giusta):
+        if giusta:
+            self.risolto += 1
+            if self.risolto == 1:
+                self._bonus = self.problema.bonus
+                self.squadra.aggiungi_risposta(True)
+                if not self.squadra.ospite:
+                    self.problema.aggiungi_risposta(True)
+        else:
+            self.errori += 1
+            self.squadra.aggiungi_risposta(False)
+            if not self.squadra.ospite and (self.gara.k_blocco is None or self.errori <= self.gara.k_blocco):
+                # Dice al problema che c'è un errore solo se non supera k.
+                self.problema.aggiungi_risposta(False)
+
+    def undo_consegna(self, giusta):
+        # Annulla una consegna al tempo corrente
+        if giusta:
+            self.risolto -= 1
+            if self.risolto == 0:
+                self._bonus = self.problema.bonus
+                self.squadra.rimuovi_risposta(True)
+                if not self.squadra.ospite:
+                    self.problema.rimuovi_risposta(True)
+        else:
+            self.errori -= 1
+            self.squadra.rimuovi_risposta(False)
+            if not self.squadra.ospite and (self.gara.k_blocco is None or self.errori < self.gara.k_blocco):
+                self.problema.rimuovi_risposta(False)
+
+    @property
+    def punteggio(self):
+        pts = 0
+        if self.risolto:
+            pts += self.problema.punti_base + self._bonus
+
+        pts -= self.errori * self.gara.penalita_errore
+
+        if self.is_jolly:
+            pts = pts * self.gara.coefficiente_jolly
+
+        return pts
+
+    @property
+    def punteggio_per_premio(self):
+        # Come il calcolo del punteggio, ma ignora le risposte errate
+        ignora_errori = self.errori * self.gara.penalita_errore
+        if self.is_jolly:
+            ignora_errori = ignora_errori * self.gara.coefficiente_jolly
+        return self.punteggio + ignora_errori
+
+
+class StatoSquadra:
+    """
+    Stato di una squadra, equivalente alla classe Squadra di client.js
+    """
+
+    def __init__(self, gara, id, nome, ospite=False):
+        self.id = id
+        self.nome = nome
+        self.gara = gara
+        self.ospite = ospite
+        self.jolly = None  # Indica il problema jolly scelto dalla squadra
+        self.risposte = {i: StatoRisposta(self, p) for (i, p) in gara.problemi.items()}
+        self.bonus_manuale = 0
+        self._risposte_corrette = 0
+        self._en_plein_bonus = 0
+
+    def aggiungi_risposta(self, giusta):
+        # Dice alla squadra che è stata data una nuova risposta, per calcolare i bonus en plein
+        if giusta:
+            self._risposte_corrette += 1
+            if self._risposte_corrette == self.gara.n_prob:
+                self._en_plein_bonus = self.gara.en_plein_bonus
+                if not self.ospite:
+                    # Se la squadra non è ospite, shifta l'array dei bonus en plein
+                    self.gara.en_plein += 1
+
+    def rimuovi_risposta(self, giusta):
+        # Annulla l'effetto di aggiungi_risposta
+        if giusta:
+            self._risposte_corrette -= 1
+            if self._risposte_corrette == self.gara.n_prob - 1:
+                self._en_plein_bonus = 0
+                if not self.ospite:
+                    self.gara.en_plein -= 1
+
+    @property
+    def punteggio(self):
+        # Calcola il punteggio della squadra
+        pts = self.gara.punteggio_tempo_iniziale()
+        pts += self._en_plein_bonus
+        for r in self.risposte.values():
+            pts += r.punteggio
+        pts += self.bonus_manuale
+        return pts
+
+
+class StatoConsegna:
+    """Consegna di una risposta, già associata alla squadra e al problema"""
+
+    def __init__(self, id, orario, squadra, problema, giusta):
+        self.id = id
+        self.orario = orario
+        self.squadra = squadra
+        self.problema = problema
+        self.giusta = giusta
+
+    def applica(self):
+        self.squadra.risposte[self.problema.id].consegna(self.giusta)
+
+    def annulla(self):
+        self.squadra.risposte[self.problema.id].undo_consegna(self.giusta)
+
+
+class StatoBonus:
+    """Bonus manuale assegnato ad una squadra"""
+
+    def __init__(self, id, orario, squadra, punteggio):
+        self.id = id
+        self.orario = orario
+        self.squadra = squadra
+        self.punteggio = punteggio
+
+    def applica(self):
+        self.squadra.bonus_manuale += self.punteggio
+
+    def annulla(self):
+        self.squadra.bonus_manuale -= self.punteggio
+
+
+def calcola_classifica(gara, orario=None):
+    """
+    Calcola classifica, punteggi dei problemi e punteggi di ogni cella della gara
+    all'orario indicato (di default, l'orario corrente).
+    """
+    stato = StatoGara.from_gara(gara)
+    stato.time = orario if orario is not None else timezone.now()
+    return stato.to_dict()
+
+
+def calcola_timeline_classifica(gara):
+    """
+    Posizioni e punteggi di tutte le squadre dopo ogni consegna, nell'ordine in cui le consegne vengono
+    processate da client.js. Come in get_classifica_posizioni di client.js, le liste sono indicizzate
+    dal numero della squadra meno uno.
+    """
+    stato = StatoGara.from_gara(gara)
+    res = {"consegne": [], "posizioni": [], "punteggi": []}
+    if stato.inizio is None:
+        return res
+    num_squadre = max(stato.squadre, default=0)
+    for consegna in stato.avanza_per_consegna():
+        posizioni = [None] * num_squadre
+        punteggi = [None] * num_squadre
+        for (posizione, (s, pts)) in enumerate(stato.classifica, start=1):
+            posizioni[s.id - 1] = posizione
+            punteggi[s.id - 1] = pts
+        res["consegne"].append(consegna.id)
+        res["posizioni"].append(posizioni)
+        res["punteggi"].append(punteggi)
+    return res
+
+
+#
+# Stato di gara in cache, aggiornato incrementalmente all'inserimento di nuovi eventi
+#
+
+def _chiave_cache(gara_pk):
+    return "engine:classifica:{}".format(gara_pk)
+
+
+def _costruisci_stato_gara(gara, versione):
+    stato = StatoGara.from_gara(gara)
+    stato.time = timezone.now()
+    stato.compatta()
+    cache.set(_chiave_cache(gara.pk), (versione, stato), None)
+    return stato
+
+
+def _chiave_lock(gara_pk):
+    return "engine:classifica:lock:{}".format(gara_pk)
+
+
+def _stato_completo(gara, stato):
+    """
+    Controlla che lo stato contenga tutti gli eventi della gara. Gli eventi vengono aggiunti in ordine di
+    identificativo, ma le transazioni possono essere confermate in un ordine diverso: un evento con
+    identificativo minore di ultimo_evento può diventare visibile dopo, e va quindi cercato confrontando
+    il numero di eventi. Le gare archiviate non ricevono nuovi eventi.
+    """
+    return stato.inizio is None or gara.archiviata or stato.num_eventi == gara.eventi.count()
+
+
+def _aggiungi_eventi(gara, versione, stato):
+    # Aggiunge allo stato gli eventi successivi ad ultimo_evento, ricalcolandolo da zero se non basta
+    eventi = gara.get_eventi_successivi(stato.ultimo_evento)
+    if not stato.accetta_consegne(eventi.get('consegne', [])):
+        return _costruisci_stato_gara(gara, versione)
+    for evento in eventi.get('jolly', []):
+        stato.add_jolly(evento)
+    for evento in eventi.get('bonus', []):
+        stato.add_bonus(evento)
+    for evento in eventi.get('consegne', []):
+        stato.add_consegna(evento)
+    if not _stato_completo(gara, stato):
+        return _costruisci_stato_gara(gara, versione)
+    stato.time = max(timezone.now(), stato.time)
+    stato.compatta()
+    cache.set(_chiave_cache(gara.pk), (versione, stato), None)
+    return stato
+
+
+def get_stato_gara(gara):
+    """
+    Restituisce lo stato della gara all'ultimo aggiornamento, leggendolo dalla cache se la versione dei dati
+    di gara è invariata, e ricalcolandolo da zero altrimenti. Se nel frattempo sono stati inseriti eventi
+    che lo stato in cache non contiene, vengono aggiunti prima di restituirlo.
+    """
+    versione = gara.get_last_update()
+    dati = cache.get(_chiave_cache(gara.pk))
+    if dati is None or dati[0] != versione:
+        return _costruisci_stato_gara(gara, versione)
+    stato = dati[1]
+    if _stato_completo(gara, stato):
+        return stato
+    return _aggiungi_eventi(gara, versione, stato)
+
+
+def aggiorna_stato_gara(gara):
+    """
+    Aggiunge allo stato in cache gli eventi inseriti dopo l'ultimo aggiornamento; va chiamata dopo il commit
+    della transazione che li ha inseriti. Gli aggiornamenti della stessa gara sono serializzati da un lock
+    in cache: se il lock è occupato l'aggiornamento viene saltato, e gli eventi mancanti vengono aggiunti
+    da get_stato_gara alla prossima richiesta.
+    """
+    if not cache.add(_chiave_lock(gara.pk), True, 30):
+        return
+    try:
+        dati = cache.get(_chiave_cache(gara.pk))
+        if dati is None:
+            # Verrà calcolato alla prima richiesta
+            return
+        versione, stato = dati
+        if versione != gara.get_last_update() or stato.inizio is None:
+            invalida_stato_gara(gara.pk)
+            return
+        _aggiungi_eventi(gara, versione, stato)
+    finally:
+        cache.delete(_chiave_lock(gara.pk))
+
+
+def invalida_stato_gara(gara_pk):
+    """Elimina lo stato in cache, in modo che venga ricalcolato alla prossima richiesta"""
+    cache.delete(_chiave_cache(gara_pk))
+
+
+def get_classifica_corrente(gara):
+    """
+    Come calcola_classifica all'orario corrente, ma partendo dallo stato in cache: il costo è
+    proporzionale al numero di squadre e di problemi, e non al numero di eventi.
+    È servita da StatusClassificaView, per chi ha bisogno della sola classifica corrente.
+    """
+    stato = get_stato_gara(gara)
+    if stato.inizio is not None:
+        stato.time = max(timezone.now(), stato.time)
+    return stato.to_dict()
+
+
+def get_timeline_classifica(gara):
+    """
+    Come calcola_timeline_classifica, ma ricalcolata solo quando i dati di gara cambiano. Come per lo stato completo
+    in StatusView, oltre al token di notifica viene confrontata la versione dei dati letta dal database
+    (vedi Gara.con_numero_eventi), che è la stessa anche per i processi che non condividono la cache.
+    """
+    num_eventi = gara.num_eventi if hasattr(gara, 'num_eventi') else gara.eventi.count()
+    versione = (get_notifica(gara.pk), gara.ultima_modifica, num_eventi)
+    chiave = "engine:timeline:{}".format(gara.pk)
+    dati = cache.get(chiave)
+    if dati is not None and dati[0] == versione:
+        return dati[1]
+    timeline = calcola_timeline_classifica(gara)
+    cache.set(chiave, (versione, timeline), None)
+    return timeline
+
+
+#
+# Notifiche per i client in attesa di aggiornamenti (long polling)
+#
+# Il token viene cambiato ad ogni modifica dei dati di gara. Perché le notifiche raggiungano tutti i processi
+# del server è necessaria una cache condivisa: con una cache locale al processo le richieste in attesa
+# vengono comunque soddisfatte alla scadenza dell'attesa. Per questo il long polling va abilitato
+# esplicitamente, vedi LONG_POLLING nelle impostazioni.
+#
+
+def _chiave_notifica(gara_pk):
+    return "engine:notifica:{}".format(gara_pk)
+
+
+def get_notifica(gara_pk):
+    """Restituisce il token che identifica l'ultima modifica nota dei dati di gara"""
+    return cache.get_or_set(_chiave_notifica(gara_pk), uuid.uuid4().hex, None)
+
+
+def notifica_aggiornamento(gara_pk):
+    """Cambia il token della gara, risvegliando le richieste in attesa"""
+    cache.set(_chiave_notifica(gara_pk), uuid.uuid4().hex, None)
+
+
+def attendi_notifica(gara_pk, notifica, attesa_massima, intervallo=0.5):
+    """
+    Attende finché il token della gara è uguale a quello fornito, per al più attesa_massima secondi.
+    Restituisce il token corrente.
+    """
+    scadenza = time.monotonic() + attesa_massima
+    corrente = get_notifica(gara_pk)
+    while corrente == notifica and time.monotonic() < scadenza:
+        time.sleep(intervallo)
+        corrente = get_notifica(gara_pk)
+    return corrente
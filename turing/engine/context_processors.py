@@ -1,31 +1,52 @@
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from django.conf import settings
+from django.core.cache import cache
 
 from engine.models import Gara
 
 
+CHIAVE_CACHE_GARE = "engine:gare"
+# Le gare create o modificate da altri processi (ad esempio journal_reader --upload) compaiono entro questo tempo
+DURATA_CACHE_GARE = 60
+
+
+def invalida_gare():
+    cache.delete(CHIAVE_CACHE_GARE)
+
+
 def get_gare():
-    gare = Gara.objects.filter(inizio__isnull=False).order_by("-inizio", "-id")
+    """
+    Restituisce le gare attive, in archivio e da iniziare. L'elenco delle gare viene letto dalla cache,
+    che è invalidata ad ogni modifica di una gara, mentre la suddivisione tra gare attive e in archivio
+    dipende dall'orario ed è calcolata ad ogni chiamata.
+    """
+    gare = cache.get(CHIAVE_CACHE_GARE)
+    if gare is None:
+        gare = (list(Gara.objects.filter(inizio__isnull=False).order_by("-inizio", "-id")),
+                list(Gara.objects.filter(inizio__isnull=True).order_by("-id")))
+        cache.set(CHIAVE_CACHE_GARE, gare, DURATA_CACHE_GARE)
+    iniziate, da_iniziare = gare
     loraesatta = timezone.now()
     attive = []
     archivio = []
-    for g in gare:
+    for g in iniziate:
         if g.sospensione is not None:
             attive.append(g)
         elif g.get_ora_fine() < loraesatta:
             archivio.append(g)
         else:
             attive.append(g)
-    da_iniziare = Gara.objects.filter(inizio__isnull=True).order_by("-id")
     return attive, archivio, da_iniziare
 
 
 def gare(request):
-    attive, archivio, da_iniziare = get_gare()
+    # Le gare vengono lette solo se il template le usa (ad esempio non nelle pagine di una gara)
+    elenco = SimpleLazyObject(get_gare)
     return {
-        "gare_attive": attive,
-        "gare_archivio": archivio,
-        "gare_da_iniziare": da_iniziare
+        "gare_attive": SimpleLazyObject(lambda: elenco[0]),
+        "gare_archivio": SimpleLazyObject(lambda: elenco[1]),
+        "gare_da_iniziare": SimpleLazyObject(lambda: elenco[2])
     }
 
 
@@ -0,0 +1,27 @@
+from django.utils import timezone
+
+from datetime import timedelta
+import random
+
+
+def crea_dati_gara_sintetica(squadre, problemi, eventi, seed=0):
+    """
+    Dati di una gara sintetica nel formato di Gara.create_from_dict, iniziata un'ora fa,
+    con le consegne distribuite uniformemente nell'ultima ora.
+    """
+    rng = random.Random(seed)
+    inizio = timezone.now() - timedelta(hours=1)
+    soluzioni = [{"problema": p, "nome": f"Problema {p}", "risposta": p, "punteggio": 20} for p in range(1, problemi + 1)]
+    lista_squadre = [{"num": s, "nome": f"Squadra {s}", "ospite": False} for s in range(1, squadre + 1)]
+    lista_eventi = []
+    for i in range(eventi):
+        problema = rng.randint(1, problemi)
+        lista_eventi.append({
+            "subclass": "Consegna",
+            "orario": (inizio + timedelta(seconds=3600 * i / eventi)).isoformat(),
+            "squadra_id": rng.randint(1, squadre),
+            "problema": problema,
+            "risposta": problema if rng.random() < 0.7 else 0,
+        })
+    return {"nome": "Benchmark", "inizio": inizio.isoformat(), "durata": 120, "soluzioni": soluzioni,
+            "squadre": lista_squadre, "eventi": lista_eventi}
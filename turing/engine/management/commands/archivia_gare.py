@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from engine.models import Gara
+
+from datetime import timedelta
+
+
+class Command(BaseCommand):
+    help = ("Moves the events of finished races, with their history, out of the event tables into a compressed "
+            "per-race archive. Archived races can still be viewed and downloaded")
+
+    def add_arguments(self, parser):
+        parser.add_argument("gara_id", type=int, nargs="*", help="Races to archive (default: every finished race)")
+        parser.add_argument("--giorni", type=int, default=7,
+                            help="Only archive races that finished at least this many days ago")
+        parser.add_argument("--dry-run", action="store_true", help="Only list the races that would be archived")
+
+    def handle(self, *args, **options):
+        if options["giorni"] < 0:
+            raise CommandError("The number of days cannot be negative")
+        gare = Gara.objects.filter(archiviata=False, inizio__isnull=False, sospensione__isnull=True).order_by("pk")
+        if options["gara_id"]:
+            gare = gare.filter(pk__in=options["gara_id"])
+            if len(gare) != len(set(options["gara_id"])):
+                raise CommandError("Some of the races do not exist, are already archived or have not finished")
+        limite = timezone.now() - timedelta(days=options["giorni"])
+        for gara in gare:
+            if gara.get_ora_fine() > limite:
+                if options["gara_id"]:
+                    self.stdout.write(f"Race {gara.pk} ({gara.nome}) finished less than {options['giorni']} days ago, skipped")
+                continue
+            if options["dry_run"]:
+                self.stdout.write(f"Race {gara.pk} ({gara.nome}): {gara.eventi.count()} events would be archived")
+            else:
+                self.stdout.write(f"Race {gara.pk} ({gara.nome}): {gara.archivia()} events archived")
@@ -0,0 +1,102 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from engine.classifica import notifica_aggiornamento
+from engine.models import Gara, Consegna, User
+from engine.views import StatusView
+from engine.management.commands._gara_sintetica import crea_dati_gara_sintetica
+
+import re
+import statistics
+import time
+
+
+class Command(BaseCommand):
+    help = ("Loads a synthetic race in a transaction that is rolled back, and reports timings and query plans "
+            "of the queries run by StatusView, QueryView and InserimentoView")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--squadre", type=int, default=40)
+        parser.add_argument("--problemi", type=int, default=20)
+        parser.add_argument("--eventi", type=int, default=2000)
+        parser.add_argument("--ripetizioni", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--no-explain", action="store_true", help="Do not print the query plans")
+
+    def explain(self, sql):
+        if connection.vendor == "sqlite":
+            prefisso = "EXPLAIN QUERY PLAN "
+        elif connection.vendor == "postgresql":
+            prefisso = "EXPLAIN "
+        else:
+            return ["(query plans are not supported for {})".format(connection.vendor)]
+        with connection.cursor() as cursor:
+            cursor.execute(prefisso + sql)
+            return [" ".join(str(x) for x in riga) for riga in cursor.fetchall()]
+
+    def misura(self, descrizione, funzione, ripetizioni, explain):
+        tempi = []
+        for _ in range(ripetizioni):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                funzione()
+                tempi.append(time.perf_counter() - start)
+        self.stdout.write(f"== {descrizione}: {len(queries)} queries, "
+                          f"median {statistics.median(tempi) * 1000:.2f} ms, min {min(tempi) * 1000:.2f} ms")
+        if not explain:
+            return
+        # Le query che differiscono solo per i valori dei parametri vengono riportate una volta sola
+        viste = {}
+        for q in queries.captured_queries:
+            forma = re.sub(r"\b\d+\b|'[^']*'", "?", q["sql"])
+            if forma in viste:
+                viste[forma][1] += 1
+            else:
+                viste[forma] = [q["sql"], 1]
+        for (sql, volte) in viste.values():
+            self.stdout.write(f"  [{volte}x] {sql}")
+            if sql.lstrip().upper().startswith("SELECT"):
+                for riga in self.explain(sql):
+                    self.stdout.write(f"      {riga}")
+
+    def handle(self, *args, **options):
+        if options["ripetizioni"] < 1:
+            raise CommandError("At least one repetition is needed")
+        dati = crea_dati_gara_sintetica(options["squadre"], options["problemi"], options["eventi"], options["seed"])
+        explain = not options["no_explain"]
+        self.stdout.write(f"Database: {connection.vendor}, {options['eventi']} events")
+        with transaction.atomic():
+            admin = User.objects.create_user("benchmark-admin")
+            gara = Gara.create_from_dict(dati)
+            gara.admin = admin
+            gara.save()
+            squadra = gara.squadre.get(num=1)
+            ultimo = gara.eventi.order_by("-pk").values_list("pk", flat=True).first()
+            status = StatusView(kwargs={"pk": gara.pk})
+
+            def status_completo():
+                # Forza la ricostruzione dello snapshot
+                notifica_aggiornamento(gara.pk)
+                status.get_dati_completi(gara, None)
+
+            def inserimento():
+                Consegna(gara=gara, squadra=squadra, problema=1, risposta=1, creatore=admin).maybe_save()
+
+            self.misura("StatusView, full status", status_completo, options["ripetizioni"], explain)
+            self.misura("StatusView, incremental update", lambda: gara.get_eventi_successivi(ultimo - 10),
+                        options["ripetizioni"], explain)
+            # Una richiesta di aggiornamento completa: la gara, letta insieme al numero di eventi, e gli eventi
+            poll = RequestFactory().get("/", {"last_evento_id": ultimo - 10})
+            self.misura("StatusView, incremental poll", lambda: StatusView.as_view()(poll, pk=gara.pk),
+                        options["ripetizioni"], explain)
+            self.misura("QueryView, all events", lambda: gara.get_all_eventi(admin, None, None, None, None),
+                        options["ripetizioni"], explain)
+            self.misura("QueryView, first page", lambda: gara.get_all_eventi(admin, None, None, None, None, limit=201),
+                        options["ripetizioni"], explain)
+            self.misura("QueryView, events of a team", lambda: gara.get_all_eventi(admin, None, "1", None, None),
+                        options["ripetizioni"], explain)
+            self.misura("InserimentoView, recent events", lambda: gara.get_eventi_recenti(admin, 20),
+                        options["ripetizioni"], explain)
+            self.misura("InserimentoView, answer submission", inserimento, options["ripetizioni"], explain)
+            transaction.set_rollback(True)
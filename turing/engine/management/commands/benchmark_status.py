@@ -0,0 +1,99 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.http import JsonResponse
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from engine.classifica import notifica_aggiornamento
+from engine.models import Gara, Consegna, Jolly, Bonus, Soluzione
+from engine.views import StatusView
+from engine.management.commands._gara_sintetica import crea_dati_gara_sintetica
+
+import statistics
+import time
+
+
+def status_precedente(gara, user):
+    """
+    Stato completo costruito come prima della cache e delle query ottimizzate: ultima modifica letta dagli storici,
+    correttezza delle consegne calcolata in Python, un modello istanziato per ogni evento. Serve solo da riferimento.
+    """
+    lu = gara.history.latest().history_date
+    for modello in (Jolly, Consegna, Bonus, Soluzione):
+        obj = modello.history.filter(gara=gara).exclude(history_type='+').order_by('-history_date').first()
+        if obj is not None:
+            lu = max(lu, obj.history_date)
+    resp = {}
+    resp['last_update'] = lu
+    resp['nome'] = gara.nome
+    resp['inizio'] = gara.inizio
+    resp['squadre'] = {s.num: {"nome": s.nome, "ospite": s.ospite} for s in gara.squadre.all()}
+    resp['n_prob'] = gara.num_problemi
+    resp['problemi'] = {s.problema: {"nome": s.nome, "punteggio": s.punteggio} for s in gara.soluzioni.all()}
+    resp['fixed_bonus'] = gara.fixed_bonus_array
+    resp['super_mega_bonus'] = gara.super_mega_bonus_array
+    resp['n_blocco'] = gara.n_blocco
+    resp['k_blocco'] = gara.k_blocco
+    resp['punteggio_iniziale_squadre'] = gara.punteggio_iniziale_squadre
+    resp['jolly_enabled'] = gara.jolly
+    resp['consegnatore_per'] = list(gara.squadre.filter(consegnatore=user).values_list("num", flat=True)) if user.is_authenticated else []
+    resp['fine'] = gara.get_ora_fine()
+    resp['tempo_blocco'] = gara.get_ora_blocco()
+    sol = {s.problema: s.risposta for s in gara.soluzioni.all()}
+    resp['consegne'] = [{'id': c.pk, 'squadra': c.squadra.num, 'ospite': c.squadra.ospite, 'orario': c.orario,
+                         'problema': c.problema, 'giusta': c.risposta == sol[c.problema]}
+                        for c in Consegna.objects.filter(gara=gara).select_related('squadra').order_by('orario')]
+    resp['jolly'] = [{'id': c.pk, 'squadra': c.squadra.num, 'problema': c.problema}
+                     for c in Jolly.objects.filter(gara=gara).select_related('squadra').order_by('orario')]
+    resp['bonus'] = [{'id': c.pk, 'squadra': c.squadra.num, 'punteggio': c.punteggio, 'orario': c.orario}
+                     for c in Bonus.objects.filter(gara=gara).select_related('squadra').order_by('orario')]
+    return JsonResponse(resp)
+
+
+class Command(BaseCommand):
+    help = ("Measures the full status load of a synthetic race, with the previous implementation and with the current "
+            "one. The race is created in a transaction that is rolled back")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--squadre", type=int, default=40)
+        parser.add_argument("--problemi", type=int, default=20)
+        parser.add_argument("--eventi", type=int, default=2000)
+        parser.add_argument("--ripetizioni", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def misura(self, view, gara, ripetizioni, prima=None):
+        tempi = []
+        for _ in range(ripetizioni):
+            if prima is not None:
+                prima()
+            request = RequestFactory().get(f"/engine/status/{gara.pk}")
+            request.user = AnonymousUser()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                view(request, pk=gara.pk)
+                tempi.append(time.perf_counter() - start)
+        return len(queries), tempi
+
+    def report(self, descrizione, num_queries, tempi, riferimento=None):
+        riga = (f"{descrizione}: {num_queries} queries, "
+                f"median {statistics.median(tempi) * 1000:.2f} ms, "
+                f"min {min(tempi) * 1000:.2f} ms")
+        if riferimento is not None:
+            riga += f", {statistics.median(riferimento) / statistics.median(tempi):.1f}x faster than the previous one"
+        self.stdout.write(riga)
+
+    def handle(self, *args, **options):
+        dati = crea_dati_gara_sintetica(options["squadre"], options["problemi"], options["eventi"], options["seed"])
+        view = StatusView.as_view()
+        with transaction.atomic():
+            gara = Gara.create_from_dict(dati)
+            precedente = self.misura(lambda request, pk: status_precedente(Gara.objects.get(pk=pk), request.user),
+                                     gara, options["ripetizioni"])
+            # Cambiando il token di notifica lo snapshot serializzato viene ricostruito ad ogni richiesta
+            freddo = self.misura(view, gara, options["ripetizioni"], prima=lambda: notifica_aggiornamento(gara.pk))
+            caldo = self.misura(view, gara, options["ripetizioni"])
+            transaction.set_rollback(True)
+
+        self.report(f"Full status of a race with {options['eventi']} events, previous implementation", *precedente)
+        self.report(f"Full status of a race with {options['eventi']} events, rebuilt", *freddo, precedente[1])
+        self.report(f"Full status of a race with {options['eventi']} events, cached", *caldo, precedente[1])
@@ -1,13 +1,20 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError, PermissionDenied
 from django.core.validators import MaxValueValidator
 from django.utils import timezone, dateparse
+from django.utils.functional import cached_property
 from django.contrib.auth.models import AbstractUser
 from simple_history.models import HistoricalRecords
+from simple_history.utils import bulk_create_with_history
 
 from datetime import timedelta, date, time
+import base64
 import json
+import textwrap
 import uuid
+import zlib
 from dateutil.parser import parse
 
 import logging
@@ -61,14 +68,29 @@ class User(AbstractUser):
     )
     gender = models.CharField(max_length=1, choices=GENDERS, default='N', verbose_name='Genere')
 
+    def get_permessi(self, gara):
+        """
+        Restituisce il ruolo dell'utente nella gara, memorizzato sull'istanza dell'utente:
+        nelle view l'utente viene caricato ad ogni richiesta, quindi il ruolo è letto al più una volta per richiesta.
+        Le modifiche ai ruoli fatte attraverso questa istanza lo invalidano (vedi invalida_permessi).
+        """
+        permessi = self.__dict__.setdefault('_permessi', {})
+        if gara.pk not in permessi:
+            permessi[gara.pk] = PermessiGara(self, gara)
+        return permessi[gara.pk]
+
+    def invalida_permessi(self):
+        """Dimentica i ruoli memorizzati, che verranno riletti alla prossima richiesta"""
+        self.__dict__.pop('_permessi', None)
+
     def can_administrate(self, gara):
-        return gara.admin == self
+        return gara.admin_id is not None and gara.admin_id == self.pk
 
     def is_inseritore(self, gara):
-        return self in gara.inseritori.all()
+        return self.get_permessi(gara).inseritore
 
     def is_consegnatore(self, gara):
-        return Squadra.objects.filter(gara=gara, consegnatore=self).exists()
+        return self.get_permessi(gara).consegnatore
 
     def can_insert_gara(self, gara):
         """Controlla che l'utente sia un admin, un inseritore o un consegnatore"""
@@ -76,15 +98,40 @@ class User(AbstractUser):
 
     def can_insert_squadra(self, squadra):
         """Controlla che l'utente sia un admin, un inseritore o un consegnatore"""
-        return self.can_administrate(squadra.gara) or self.is_inseritore(squadra.gara) or squadra.consegnatore == self
+        return self.can_administrate(squadra.gara) or self.is_inseritore(squadra.gara) or squadra.consegnatore_id == self.pk
 
     def can_edit_or_delete(self, evento):
         """Controlla che l'utente sia admin, o un inseritore proprietario dell'evento."""
-        return self.can_administrate(evento.gara) or (self.is_inseritore(evento.gara) and evento.creatore == self)
+        return self.can_administrate(evento.gara) or (self.is_inseritore(evento.gara) and evento.creatore_id == self.pk)
 
     def can_create_gara(self):
         return self.has_perm("engine.change_gara")
 
+class PermessiGara:
+    """
+    Ruolo di un utente in una gara. Essere inseritore e consegnatore vengono letti insieme,
+    con una sola query, solo quando servono (l'amministratore è un campo della gara).
+    """
+    def __init__(self, user, gara):
+        self.user = user
+        self.gara = gara
+
+    @cached_property
+    def _ruoli(self):
+        return Gara.objects.filter(pk=self.gara.pk).annotate(
+            inseritore=Exists(Gara.inseritori.through.objects.filter(gara=OuterRef('pk'), user=self.user.pk)),
+            consegnatore=Exists(Squadra.objects.filter(gara=OuterRef('pk'), consegnatore=self.user.pk)),
+        ).values_list('inseritore', 'consegnatore').get()
+
+    @property
+    def inseritore(self):
+        return self._ruoli[0]
+
+    @property
+    def consegnatore(self):
+        return self._ruoli[1]
+
+
 class Gara(models.Model):
     """
     Modello che descrive una gara
@@ -92,6 +139,8 @@ class Gara(models.Model):
     nome = models.CharField(max_length=200, help_text="Nome della gara")
     inizio = models.DateTimeField(blank=True, null=True)
     sospensione = models.DateTimeField(blank=True, null=True)
+    # Sospensioni concluse, come coppie di orari ISO [inizio, fine] in ordine cronologico (vedi get_orario_di_gara)
+    sospensioni = models.JSONField(default=list, blank=True, editable=False)
     durata = models.DurationField(default=timedelta(hours=2), help_text="Durata nel formato hh:mm:ss")
     n_blocco = models.PositiveSmallIntegerField(blank=True, default=2, null=True,  # Il valore NULL non fa bloccare mai il punteggio
                                                 verbose_name="Parametro N",
@@ -117,7 +166,11 @@ class Gara(models.Model):
     jolly = models.BooleanField(default=True,
                                 verbose_name="Jolly",
                                 help_text="Possibilità di inserire un jolly")
-    history = HistoricalRecords()
+    # Gli eventi delle gare archiviate sono in ArchivioGara, e non più nelle tabelle degli eventi (vedi archivia)
+    archiviata = models.BooleanField(default=False, editable=False)
+    # Aggiornata ad ogni modifica sostanziale dei dati di gara, vedi get_last_update
+    ultima_modifica = models.DateTimeField(default=timezone.now, editable=False)
+    history = HistoricalRecords(excluded_fields=['ultima_modifica'])
 
     #
     # Permessi
@@ -170,43 +223,88 @@ class Gara(models.Model):
     def finished(self):
         return (self.inizio is not None) and (self.sospensione is None) and (timezone.now() > self.get_ora_fine())
 
-    def get_all_eventi(self, user, id_evento, num_squadra, problema, risposta):
-        """Restituisce tutti gli eventi all'amministratore."""
-        qs = self.eventi.all().select_related("consegna__squadra", "jolly__squadra", "bonus__squadra")
+    def get_sospensioni(self):
+        """Intervalli (inizio, fine) delle sospensioni concluse"""
+        return [(dateparse.parse_datetime(inizio), dateparse.parse_datetime(fine)) for (inizio, fine) in self.sospensioni]
 
-        if user.can_administrate(self):
+    def riprendi(self, loraesatta):
+        """
+        Conclude la sospensione in corso. L'inizio della gara viene spostato in avanti della durata della sospensione,
+        mentre gli eventi mantengono l'orario in cui sono stati inseriti: il loro orario di gara è calcolato
+        da get_orario_di_gara, senza riscrivere la tabella degli eventi.
+        """
+        if self.sospensione is None:
+            return
+        self.inizio += loraesatta - self.sospensione
+        self.sospensioni = self.sospensioni + [[self.sospensione.isoformat(), loraesatta.isoformat()]]
+        self.sospensione = None
 
-            res = [x.as_child() for x in qs]
-            for x in res:
-                x.timestamp = strfdelta(x.orario - self.inizio, "%H:%M:%S")
-                if hasattr(x, "problema") and hasattr(x, "risposta"):
-                    x.giusta = (x.risposta == self.soluzioni.get(problema=x.problema).risposta)
-                else:
-                    x.giusta = None
-            if id_evento:
-                res = [x for x in res if x.pk == int(id_evento)]
-            if num_squadra:
-                res = [x for x in res if x.squadra.num == int(num_squadra)]
-            if problema:
-                if problema == "B":
-                    res = [x for x in res if isinstance(x, Bonus)]
-                else:
-                    assert problema.isdigit()
-                    res = [x for x in res if hasattr(x, "problema") and x.problema == int(problema)]
-            if risposta:
-                if risposta == "J":
-                    res = [x for x in res if isinstance(x, Jolly)]
-                else:
-                    if risposta == "G":
-                        res = [x for x in res if hasattr(x, "risposta") and x.giusta]
-                    elif risposta == "S":
-                        res = [x for x in res if hasattr(x, "risposta") and not x.giusta]
-                    else:
-                        assert risposta.isdigit()
-                        res = [x for x in res if hasattr(x, "risposta") and x.risposta == int(risposta)]
+    def get_orario_di_gara(self, orario, sospensioni=None):
+        """
+        Orario di un evento nella scala dei tempi della gara, in cui l'inizio è spostato in avanti della durata
+        delle sospensioni: gli eventi inseriti prima della fine di una sospensione vengono spostati allo stesso modo,
+        così che il tempo di gara trascorso sia quello effettivo. sospensioni è il risultato di get_sospensioni.
+        """
+        if sospensioni is None:
+            sospensioni = self.get_sospensioni()
+        return orario + sum((fine - inizio for (inizio, fine) in sospensioni if orario < fine), timedelta())
 
-            return res
-        raise PermissionDenied("L'utente non può chiedere gli eventi della gara.")
+    def get_all_eventi(self, user, id_evento, num_squadra, problema, risposta, dopo=None, limit=None):
+        """
+        Restituisce all'amministratore gli eventi che soddisfano i filtri, nell'ordinamento di default.
+        I filtri e la correttezza delle consegne vengono calcolati dal database. Per la paginazione,
+        dopo è l'identificativo dell'ultimo evento della pagina precedente e limit il numero massimo di eventi.
+        """
+        if not user.can_administrate(self):
+            raise PermissionDenied("L'utente non può chiedere gli eventi della gara.")
+
+        giusta = Exists(Soluzione.objects.filter(
+            gara=OuterRef('gara'), problema=OuterRef('consegna__problema'), risposta=OuterRef('consegna__risposta')))
+        qs = self.eventi.select_related("consegna__squadra", "jolly__squadra", "bonus__squadra", "creatore").annotate(
+            giusta=giusta,
+            num_squadra=Coalesce('consegna__squadra__num', 'jolly__squadra__num', 'bonus__squadra__num'),
+            num_problema=Coalesce('consegna__problema', 'jolly__problema'),
+        )
+
+        if id_evento:
+            qs = qs.filter(pk=int(id_evento))
+        if num_squadra:
+            qs = qs.filter(num_squadra=int(num_squadra))
+        if problema:
+            if problema == "B":
+                qs = qs.filter(subclass="Bonus")
+            else:
+                assert problema.isdigit()
+                qs = qs.filter(num_problema=int(problema))
+        if risposta:
+            if risposta == "J":
+                qs = qs.filter(subclass="Jolly")
+            elif risposta == "G":
+                qs = qs.filter(subclass="Consegna", giusta=True)
+            elif risposta == "S":
+                qs = qs.filter(subclass="Consegna", giusta=False)
+            else:
+                assert risposta.isdigit()
+                qs = qs.filter(consegna__risposta=int(risposta))
+        if dopo:
+            # Paginazione per chiave, coerente con l'ordinamento per orario e pk decrescenti.
+            # Un cursore non numerico, o di un evento che non esiste più, non restituisce eventi
+            if not str(dopo).isdigit():
+                return []
+            orario = Subquery(self.eventi.filter(pk=int(dopo)).values('orario')[:1])
+            qs = qs.filter(models.Q(orario__lt=orario) | models.Q(orario=orario, pk__lt=int(dopo)))
+        if limit is not None:
+            qs = qs[:limit]
+
+        res = []
+        sospensioni = self.get_sospensioni()
+        for e in qs:
+            x = e.as_child()
+            x.creatore = e.creatore
+            x.timestamp = strfdelta(self.get_orario_di_gara(x.orario, sospensioni) - self.inizio, "%H:%M:%S")
+            x.giusta = e.giusta if e.subclass == "Consegna" else None
+            res.append(x)
+        return res
 
     def get_eventi_recenti(self, user, limit):
         """Restituisce gli eventi visualizzabili dall'utente."""
@@ -215,7 +313,7 @@ class Gara(models.Model):
         if user.can_administrate(self):
             return [(True, x.as_child()) for x in qs[:limit]]
         if user.is_inseritore(self):
-            return [(x.creatore == user, x.as_child()) for x in qs[:limit]]
+            return [(x.creatore_id == user.pk, x.as_child()) for x in qs[:limit]]
         if user.is_consegnatore(self):
             return [(False, x.as_child()) for x in qs.filter(creatore=user)[:limit]]
         raise PermissionDenied("L'utente non può chiedere gli eventi della gara.")
@@ -225,12 +323,10 @@ class Gara(models.Model):
         qs = self.squadre.all()
         if user.can_administrate(self) or user.is_inseritore(self):
             return qs
+        elif user.is_consegnatore(self):
+            return qs.filter(consegnatore=user)
         else:
-            qs = qs.filter(consegnatore=user)
-            if qs.exists():
-                return qs
-            else:
-                raise PermissionDenied("L'utente non può consegnare per nessuna squadra.")
+            raise PermissionDenied("L'utente non può consegnare per nessuna squadra.")
 
     def get_soluzioni(self):
         sol = {}
@@ -245,49 +341,134 @@ class Gara(models.Model):
         return problems
 
     def get_consegne(self, last=None):
-        sol = self.get_soluzioni()
-        res = []
-        qs = Consegna.objects.filter(gara=self).select_related('squadra')
+        # La correttezza viene calcolata dal database, senza istanziare consegne e soluzioni
+        if self.archiviata:
+            return self.get_eventi_archiviati(last)['consegne']
+        giusta = Exists(Soluzione.objects.filter(gara=OuterRef('gara'), problema=OuterRef('problema'), risposta=OuterRef('risposta')))
+        qs = Consegna.objects.filter(gara=self)
         if last is not None:
             qs = qs.filter(pk__gt=last)
-
-        # TODO: ottimizzare questa cosa, magari in una query
-        for c in qs.order_by('orario'):
-            tmp = {}
-            tmp['id'] = c.pk
-            tmp['squadra'] = c.squadra.num
-            tmp['ospite'] = c.squadra.ospite
-            tmp['orario'] = c.orario
-            tmp['problema'] = c.problema
-            tmp['giusta'] = (c.risposta == sol[c.problema])
-            res.append(tmp)
-        return res
+        qs = qs.annotate(giusta=giusta).order_by('orario', 'pk').values_list(
+            'pk', 'squadra__num', 'squadra__ospite', 'orario', 'problema', 'giusta')
+        sospensioni = self.get_sospensioni()
+        return [{'id': pk, 'squadra': squadra, 'ospite': ospite, 'orario': self.get_orario_di_gara(orario, sospensioni), 'problema': problema, 'giusta': giusta}
+                for (pk, squadra, ospite, orario, problema, giusta) in qs]
 
     def get_jolly(self, last=None):
-        res = []
-        qs = Jolly.objects.filter(gara=self).select_related('squadra')
+        if self.archiviata:
+            return self.get_eventi_archiviati(last)['jolly']
+        qs = Jolly.objects.filter(gara=self)
         if last is not None:
             qs = qs.filter(pk__gt=last)
-        for c in qs.order_by('orario'):
-            tmp = {}
-            tmp["id"] = c.pk
-            tmp["squadra"] = c.squadra.num
-            tmp["problema"] = c.problema
-            res.append(tmp)
-        return res
+        qs = qs.order_by('orario', 'pk').values_list('pk', 'squadra__num', 'problema')
+        return [{'id': pk, 'squadra': squadra, 'problema': problema} for (pk, squadra, problema) in qs]
 
     def get_bonus(self, last=None):
-        res = []
-        qs = Bonus.objects.filter(gara=self).select_related('squadra')
+        if self.archiviata:
+            return self.get_eventi_archiviati(last)['bonus']
+        qs = Bonus.objects.filter(gara=self)
         if last is not None:
             qs = qs.filter(pk__gt=last)
-        for c in qs.order_by('orario'):
-            tmp = {}
-            tmp["id"] = c.pk
-            tmp["squadra"] = c.squadra.num
-            tmp["punteggio"] = c.punteggio
-            tmp["orario"] = c.orario
-            res.append(tmp)
+        qs = qs.order_by('orario', 'pk').values_list('pk', 'squadra__num', 'punteggio', 'orario')
+        sospensioni = self.get_sospensioni()
+        return [{'id': pk, 'squadra': squadra, 'punteggio': punteggio, 'orario': self.get_orario_di_gara(orario, sospensioni)}
+                for (pk, squadra, punteggio, orario) in qs]
+
+    def get_eventi_successivi(self, last):
+        """
+        Restituisce consegne, jolly e bonus con identificativo maggiore di last, nello stesso formato
+        di get_consegne, get_jolly e get_bonus, con una sola query sulla tabella degli eventi.
+        Gli identificativi degli eventi sono condivisi tra tutti i tipi di evento, quindi last_evento_id
+        (il massimo identificativo restituito) è un cursore valido per la richiesta successiva.
+        Le liste vuote vengono omesse, per avere una risposta compatta.
+        """
+        if self.archiviata:
+            res = self.get_eventi_archiviati(int(last))
+        else:
+            giusta = Exists(Soluzione.objects.filter(
+                gara=OuterRef('gara'), problema=OuterRef('consegna__problema'), risposta=OuterRef('consegna__risposta')))
+            qs = self.eventi.filter(pk__gt=last).annotate(
+                giusta=giusta,
+                num_squadra=Coalesce('consegna__squadra__num', 'jolly__squadra__num', 'bonus__squadra__num'),
+            ).order_by('orario', 'pk').values_list(
+                'pk', 'subclass', 'orario', 'num_squadra', 'consegna__squadra__ospite', 'consegna__problema',
+                'jolly__problema', 'bonus__punteggio', 'giusta')
+
+            res = {'consegne': [], 'jolly': [], 'bonus': []}
+            sospensioni = self.get_sospensioni()
+            for (pk, subclass, orario, squadra, ospite, problema, problema_jolly, punteggio, giusta) in qs:
+                orario = self.get_orario_di_gara(orario, sospensioni)
+                if subclass == "Consegna":
+                    res['consegne'].append({'id': pk, 'squadra': squadra, 'ospite': ospite, 'orario': orario, 'problema': problema, 'giusta': giusta})
+                elif subclass == "Jolly":
+                    res['jolly'].append({'id': pk, 'squadra': squadra, 'problema': problema_jolly})
+                elif subclass == "Bonus":
+                    res['bonus'].append({'id': pk, 'squadra': squadra, 'punteggio': punteggio, 'orario': orario})
+        last_evento_id = max([int(last)] + [e['id'] for eventi in res.values() for e in eventi])
+        res = {k: v for (k, v) in res.items() if len(v) > 0}
+        res['last_evento_id'] = last_evento_id
+        return res
+
+    def get_eventi_archiviati(self, last=None):
+        """
+        Consegne, jolly e bonus di una gara archiviata con identificativo maggiore di last,
+        nello stesso formato di get_consegne, get_jolly e get_bonus.
+        """
+        soluzioni = self.get_soluzioni()
+        ospiti = dict(self.squadre.values_list('num', 'ospite'))
+        sospensioni = self.get_sospensioni()
+        res = {'consegne': [], 'jolly': [], 'bonus': []}
+        for (pk, subclass, orario, squadra, problema, risposta, punteggio, _) in self.archivio.get_eventi():
+            if last is not None and pk <= last:
+                continue
+            orario = self.get_orario_di_gara(orario, sospensioni)
+            if subclass == "Consegna":
+                res['consegne'].append({'id': pk, 'squadra': squadra, 'ospite': ospiti[squadra], 'orario': orario, 'problema': problema,
+                                        'giusta': soluzioni.get(problema) == risposta})
+            elif subclass == "Jolly":
+                res['jolly'].append({'id': pk, 'squadra': squadra, 'problema': problema})
+            elif subclass == "Bonus":
+                res['bonus'].append({'id': pk, 'squadra': squadra, 'punteggio': punteggio, 'orario': orario})
+        return res
+
+    def eventi_in_colonne(self, eventi):
+        """
+        Converte consegne, jolly e bonus (nel formato di get_consegne, get_jolly e get_bonus) in un formato compatto
+        a colonne: per ogni tipo di evento un dizionario di liste parallele, con gli orari espressi in millisecondi
+        dall'inizio della gara e la correttezza delle consegne codificata in base64 come insieme di bit.
+        Le chiavi diverse da consegne, jolly e bonus vengono restituite invariate.
+        """
+        def millisecondi(orario):
+            # Gli orari vengono troncati al millisecondo, come nella serializzazione JSON
+            tronca = lambda t: t.replace(microsecond=t.microsecond // 1000 * 1000)
+            return (tronca(orario) - tronca(self.inizio)) // timedelta(milliseconds=1)
+
+        res = dict(eventi)
+        if 'consegne' in eventi:
+            giuste = bytearray((len(eventi['consegne']) + 7) // 8)
+            for (i, c) in enumerate(eventi['consegne']):
+                if c['giusta']:
+                    giuste[i // 8] |= 1 << (i % 8)
+            res['consegne'] = {
+                'id': [c['id'] for c in eventi['consegne']],
+                'squadra': [c['squadra'] for c in eventi['consegne']],
+                'problema': [c['problema'] for c in eventi['consegne']],
+                'orario': [millisecondi(c['orario']) for c in eventi['consegne']],
+                'giusta': base64.b64encode(giuste).decode(),
+            }
+        if 'jolly' in eventi:
+            res['jolly'] = {
+                'id': [j['id'] for j in eventi['jolly']],
+                'squadra': [j['squadra'] for j in eventi['jolly']],
+                'problema': [j['problema'] for j in eventi['jolly']],
+            }
+        if 'bonus' in eventi:
+            res['bonus'] = {
+                'id': [b['id'] for b in eventi['bonus']],
+                'squadra': [b['squadra'] for b in eventi['bonus']],
+                'punteggio': [b['punteggio'] for b in eventi['bonus']],
+                'orario': [millisecondi(b['orario']) for b in eventi['bonus']],
+            }
         return res
 
     def get_squadre(self):
@@ -299,42 +480,33 @@ class Gara(models.Model):
     def get_squadre_order(self):
         return self.squadre.all().order_by('num')
 
+    def save(self, *args, **kwargs):
+        self.ultima_modifica = timezone.now()
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def con_numero_eventi():
+        """
+        Gare con il numero dei loro eventi, letto nella stessa query. Insieme a ultima_modifica identifica
+        la versione dei dati di gara: ogni modifica la aggiorna, tranne l'inserimento di un evento che ne cambia il numero.
+        """
+        num_eventi = Evento.objects.filter(gara=OuterRef('pk')).order_by().values('gara').annotate(n=Count('pk')).values('n')[:1]
+        return Gara.objects.annotate(num_eventi=Coalesce(Subquery(num_eventi), 0))
+
+    @staticmethod
+    def segna_modifica(gara_pk):
+        """Registra una modifica sostanziale ai dati della gara, senza caricarla né salvarla"""
+        Gara.objects.filter(pk=gara_pk).update(ultima_modifica=timezone.now())
+
     def get_last_update(self):
         """
-        Metodo per vedere qual è stata l'ultima modifica sostanziale
-        Restituisce il più recente tra:
+        Metodo per vedere qual è stata l'ultima modifica sostanziale, cioè la più recente tra:
         - Ultima modifica di gara
-        - Ultima modifica o eliminazione di un jolly
-        - Ultima modifica o eliminazione di una consegna
-        - Ultima modifica o eliminazione di un bonus
-        - Ultima modifica di un problema
-        """
-        lu = self.history.latest().history_date
-        try:
-            obj = Jolly.history.filter(gara=self).exclude(history_type='+').latest()
-            lu = max(lu, obj.history_date)
-        except:
-            pass
-
-        try:
-            obj = Consegna.history.filter(gara=self).exclude(history_type='+').latest()
-            lu = max(lu, obj.history_date)
-        except:
-            pass
-
-        try:
-            obj = Bonus.history.filter(gara=self).exclude(history_type='+').latest()
-            lu = max(lu, obj.history_date)
-        except:
-            pass
-
-        try:
-            obj = Soluzione.history.filter(gara=self).exclude(history_type='+').latest()
-            lu = max(lu, obj.history_date)
-        except:
-            pass
-        return lu
-
+        - Ultima modifica o eliminazione di un jolly, di una consegna o di un bonus
+        - Ultima modifica o eliminazione di un problema o di una squadra
+        L'orario viene letto dal database, perché l'istanza potrebbe non essere aggiornata.
+        """
+        return Gara.objects.filter(pk=self.pk).values_list('ultima_modifica', flat=True).get()
 
     @staticmethod
     def serialize(obj):
@@ -357,46 +529,124 @@ class Gara(models.Model):
     def dump_to_json(self):
         return json.dumps(self, default=self.serialize, indent=4)
 
+    def dump_to_json_chunks(self, chunk_size=500):
+        """
+        Restituisce a pezzi lo stesso testo di dump_to_json, leggendo gli eventi dal database a blocchi
+        di chunk_size, senza costruire in memoria la lista completa degli eventi.
+        """
+        testa, coda = json.dumps(self.to_dict(eventi=False), default=self.serialize, indent=4).split('"eventi": null')
+        yield testa + '"eventi": ['
+        vuota = True
+        blocco = []
+        for e in self.get_eventi_dict(chunk_size=chunk_size):
+            # Stessa indentazione di un elemento della lista all'interno del dizionario della gara
+            blocco.append(textwrap.indent(json.dumps(e, indent=4), " " * 8))
+            if len(blocco) == chunk_size:
+                yield ("\n" if vuota else ",\n") + ",\n".join(blocco)
+                vuota = False
+                blocco = []
+        if len(blocco) > 0:
+            yield ("\n" if vuota else ",\n") + ",\n".join(blocco)
+            vuota = False
+        yield ("]" if vuota else "\n    ]") + coda
+
     # Loads current_game from json
     @classmethod
     def create_from_dict(cls, data):
-        this = cls()
-        this.save()
-        for k in {'nome', 'n_blocco', 'k_blocco', 'punteggio_iniziale_squadre', 'num_problemi', 'fixed_bonus', 'super_mega_bonus', 'jolly'}:
-            if k in data:
-                setattr(this, k, data[k])
-
-        if "inizio" in data and data["inizio"] is not None:
-            this.inizio = parse(data['inizio'])
-        this.durata = timedelta(minutes=data['durata'])
-        this.durata_blocco = timedelta(minutes=data.get('durata_blocco', 20))
-        this.num_problemi = len(data['soluzioni'])
-        this.save()
-
-        for squadra in data['squadre']:
-            Squadra(gara=this, **squadra).save()
-
-        for soluzione in data['soluzioni']:
-            Soluzione(gara=this, **soluzione).save()
-
-        if 'eventi' in data:
-            for evento in data['eventi']:
-                evento_copy = dict(evento)
-                evento_copy['orario'] = parse(evento['orario'])
-                if 'squadra_id' in evento:
-                    evento_copy['squadra'] = Squadra.objects.get(gara=this, num=evento['squadra_id'])
-                    del evento_copy['squadra_id']
-
-                [subclass] = [x for x in Evento.__subclasses__() if x.__name__ == evento['subclass']]
-                obj = subclass(gara=this, **evento_copy)
-                obj.save()
-                obj.orario = evento_copy['orario']
-                obj.save()
-                assert obj.orario == evento_copy['orario'], "Orario dell'evento non caricato correttamente"
-
+        with transaction.atomic():
+            this = cls()
+            this.save()
+            for k in {'nome', 'n_blocco', 'k_blocco', 'punteggio_iniziale_squadre', 'num_problemi', 'fixed_bonus', 'super_mega_bonus', 'jolly'}:
+                if k in data:
+                    setattr(this, k, data[k])
+
+            if "inizio" in data and data["inizio"] is not None:
+                this.inizio = parse(data['inizio'])
+            this.durata = timedelta(minutes=data['durata'])
+            this.durata_blocco = timedelta(minutes=data.get('durata_blocco', 20))
+            this.num_problemi = len(data['soluzioni'])
+
+            Squadra.objects.bulk_create([Squadra(gara=this, **squadra) for squadra in data['squadre']])
+            bulk_create_with_history([Soluzione(gara=this, **soluzione) for soluzione in data['soluzioni']], Soluzione)
+            if 'eventi' in data:
+                this.importa_eventi(data['eventi'])
+
+            # Gli inserimenti in blocco non inviano segnali: il salvataggio finale della gara
+            # invalida la classifica in cache e segna la modifica
+            this.save()
         return this
 
-    def to_dict(self):
+    def importa_eventi(self, eventi):
+        """
+        Inserisce in blocco gli eventi nel formato di to_dict, nell'ordine dato e con il proprio orario,
+        insieme alle corrispondenti righe dello storico.
+        """
+        num_to_pk = dict(self.squadre.values_list('num', 'pk'))
+        sottoclassi = {x.__name__: x for x in Evento.__subclasses__()}
+        oggetti = []
+        for evento in eventi:
+            evento_copy = dict(evento)
+            # Gli orari sono normalmente in formato ISO, che viene letto molto più velocemente
+            evento_copy['orario'] = dateparse.parse_datetime(evento['orario']) or parse(evento['orario'])
+            if 'squadra_id' in evento:
+                evento_copy['squadra_id'] = num_to_pk[evento['squadra_id']]
+            obj = sottoclassi[evento['subclass']](gara=self, **evento_copy)
+            obj.fill_subclass()
+            oggetti.append(obj)
+
+        # bulk_create non gestisce l'ereditarietà multi-tabella: le tabelle degli eventi
+        # e delle sottoclassi vengono scritte come in Model.save_base con raw=True
+        campi = [f for f in Evento._meta.local_concrete_fields if not f.primary_key]
+        blocco = max(connection.ops.bulk_batch_size(campi, oggetti), 1) if connection.features.can_return_rows_from_bulk_insert else 1
+        for i in range(0, len(oggetti), blocco):
+            parte = oggetti[i:i + blocco]
+            righe = Evento._base_manager._insert(parte, fields=campi, returning_fields=[Evento._meta.pk], raw=True)
+            for (obj, (pk,)) in zip(parte, righe):
+                obj.id = obj.evento_ptr_id = pk
+        for sottoclasse in sottoclassi.values():
+            oggetti_sottoclasse = [x for x in oggetti if isinstance(x, sottoclasse)]
+            campi = sottoclasse._meta.local_concrete_fields
+            blocco = max(connection.ops.bulk_batch_size(campi, oggetti_sottoclasse), 1)
+            for i in range(0, len(oggetti_sottoclasse), blocco):
+                sottoclasse._base_manager._insert(oggetti_sottoclasse[i:i + blocco], fields=campi, raw=True)
+            sottoclasse.history.bulk_history_create(oggetti_sottoclasse)
+
+    def get_eventi_dict(self, chunk_size=None):
+        """
+        Eventi della gara nel formato di Evento.to_dict, ordinati per orario, tipo, squadra e problema.
+        Gli eventi vengono letti con una sola query; se chunk_size è indicato, vengono restituiti
+        man mano che sono letti dal database, a blocchi di chunk_size righe.
+        """
+        # A parità di chiave gli eventi restano nell'ordinamento di default, cioè per identificativo decrescente
+        if self.archiviata:
+            archiviati = sorted(self.archivio.get_eventi(), key=lambda e: (e[2], e[1], e[3], e[4] or 0, -e[0]))
+            qs = [(subclass, orario, squadra, problema, risposta, punteggio)
+                  for (_, subclass, orario, squadra, problema, risposta, punteggio, _) in archiviati]
+            chunk_size = None
+        else:
+            qs = self.eventi.annotate(
+                num_squadra=Coalesce('consegna__squadra__num', 'jolly__squadra__num', 'bonus__squadra__num'),
+                num_problema=Coalesce('consegna__problema', 'jolly__problema'),
+            ).order_by('orario', 'subclass', 'num_squadra', 'num_problema', '-pk').values_list(
+                'subclass', 'orario', 'num_squadra', 'num_problema', 'consegna__risposta', 'bonus__punteggio')
+
+        def eventi(righe):
+            sospensioni = self.get_sospensioni()
+            for (subclass, orario, squadra, problema, risposta, punteggio) in righe:
+                e = {'subclass': subclass, 'orario': self.get_orario_di_gara(orario, sospensioni).isoformat(), 'squadra_id': squadra}
+                if subclass == "Consegna":
+                    e.update({'problema': problema, 'risposta': risposta})
+                elif subclass == "Jolly":
+                    e['problema'] = problema
+                elif subclass == "Bonus":
+                    e['punteggio'] = punteggio
+                yield e
+
+        if chunk_size is None:
+            return list(eventi(qs))
+        return eventi(qs.iterator(chunk_size=chunk_size))
+
+    def to_dict(self, eventi=True):
         d = {}
         for k in {'nome', 'n_blocco', 'k_blocco', 'punteggio_iniziale_squadre', 'num_problemi', 'jolly'}:
             d[k] = getattr(self, k)
@@ -413,15 +663,74 @@ class Gara(models.Model):
             d[k] = int(getattr(self, k).seconds / 60)
 
         d.update({
-            # Non si può usare order_by perché la classe padre Evento contiene solo orario e subclass
-            # 'eventi': [e.to_dict() for e in self.eventi.all().order_by('orario', 'subclass', 'squadra_id', 'problema')],
-            'eventi': list(sorted([e.to_dict() for e in self.eventi.all()], key=lambda e: (
-                e["orario"], e["subclass"], e["squadra_id"], e["problema"] if "problema" in e else None))),
+            # Con eventi=False la chiave resta al suo posto, vedi dump_to_json_chunks
+            'eventi': self.get_eventi_dict() if eventi else None,
             'soluzioni': [s.to_dict() for s in self.soluzioni.all().order_by('problema')],
             'squadre': [s.to_dict() for s in self.squadre.all().order_by('num')],
         })
         return d
 
+    def archivia(self):
+        """
+        Sposta gli eventi della gara e il loro storico in un ArchivioGara, eliminandoli dalle tabelle degli eventi.
+        Le eliminazioni non passano dai modelli, così che non vengano aggiunte righe allo storico.
+        Restituisce il numero di eventi archiviati.
+        """
+        sottoclassi = Evento.__subclasses__()
+        with transaction.atomic():
+            eventi = self.eventi.annotate(
+                num_squadra=Coalesce('consegna__squadra__num', 'jolly__squadra__num', 'bonus__squadra__num'),
+                num_problema=Coalesce('consegna__problema', 'jolly__problema'),
+            ).order_by('orario', 'pk').values_list(
+                'pk', 'subclass', 'orario', 'num_squadra', 'num_problema', 'consegna__risposta', 'bonus__punteggio', 'creatore')
+            dati = {
+                'eventi': list(eventi),
+                'storico': {m.__name__: list(m.history.filter(gara=self).order_by('history_id').values()) for m in [Evento] + sottoclassi},
+            }
+            # serialize mantiene i microsecondi degli orari, che DjangoJSONEncoder troncherebbe
+            ArchivioGara.objects.create(gara=self, dati=zlib.compress(json.dumps(dati, default=self.serialize).encode()))
+            for m in sottoclassi + [Evento]:
+                m._base_manager.filter(gara=self)._raw_delete(m._base_manager.db)
+                m.history.filter(gara=self)._raw_delete(m.history.db)
+            self.archiviata = True
+            self.save()
+        return len(dati['eventi'])
+
+
+class ArchivioGara(models.Model):
+    """
+    Eventi e storico di una gara archiviata, in un unico JSON compresso (vedi Gara.archivia):
+    le tabelle degli eventi, lette durante le gare in corso, contengono solo le gare non archiviate.
+    """
+    gara = models.OneToOneField(Gara, on_delete=models.CASCADE, primary_key=True, related_name='archivio')
+    data = models.DateTimeField(auto_now_add=True)
+    dati = models.BinaryField()
+
+    class Meta:
+        verbose_name_plural = "archivi gare"
+
+    def __str__(self):
+        return str(self.gara)
+
+    @cached_property
+    def _dati(self):
+        return json.loads(zlib.decompress(self.dati))
+
+    @cached_property
+    def _eventi(self):
+        return [(pk, subclass, dateparse.parse_datetime(orario), *resto) for (pk, subclass, orario, *resto) in self._dati['eventi']]
+
+    def get_eventi(self):
+        """
+        Eventi archiviati come tuple (id, subclass, orario, num_squadra, problema, risposta, punteggio, creatore_id),
+        ordinati per orario e identificativo. L'orario è quello di inserimento, come nella tabella degli eventi.
+        """
+        return self._eventi
+
+    def get_storico(self):
+        """Righe archiviate dello storico degli eventi, per modello, nel formato di values()"""
+        return self._dati['storico']
+
 
 class Squadra(models.Model):
     """
@@ -437,6 +746,15 @@ class Squadra(models.Model):
         verbose_name_plural = "squadre"
         unique_together = ('gara', 'num')
         ordering = ['-gara']
+        indexes = [
+            # Squadre di cui un utente è consegnatore (StatusView, InserimentoView)
+            models.Index(fields=['gara', 'consegnatore'], name='squadra_gara_consegnatore_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Gara.segna_modifica(self.gara_id)
 
     def get_id_nome(self):
         return "{0:02d} - {1}".format(self.num, self.nome)
@@ -468,6 +786,11 @@ class Soluzione(models.Model):
         unique_together = ('gara', 'problema',)
         ordering = ("gara", "problema",)
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Gara.segna_modifica(self.gara_id)
+
     def __str__(self):
         return "Soluzione del problema {} della gara {} (Risposta {}, punti {})".format(self.problema, self.gara, self.risposta, self.punteggio)
 
@@ -509,7 +832,8 @@ class Evento(KnowsChild):
     Modello che rappresenta un generico evento durante la gara.
     """
 
-    orario = models.DateTimeField(auto_now_add=True)
+    # Orario dell'inserimento, a meno che non sia indicato esplicitamente alla creazione (vedi save)
+    orario = models.DateTimeField(blank=True, editable=False)
     gara = models.ForeignKey(Gara, on_delete=models.CASCADE, related_name='eventi')
     creatore = models.ForeignKey(User, null=True, on_delete=models.CASCADE)
     history = HistoricalRecords(inherit=True)
@@ -517,6 +841,25 @@ class Evento(KnowsChild):
     class Meta:
         verbose_name_plural = "eventi"
         ordering = ['-orario', '-pk']
+        indexes = [
+            # Eventi di una gara nell'ordinamento di default (e, scorrendo l'indice al contrario, in ordine cronologico)
+            models.Index(fields=['gara', '-orario', '-id'], name='evento_gara_orario_idx'),
+            # Eventi di una gara successivi ad un cursore (aggiornamenti incrementali)
+            models.Index(fields=['gara', 'id'], name='evento_gara_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            # Come auto_now_add, ma un orario già assegnato (ad esempio importando una gara)
+            # viene mantenuto, così che l'evento sia scritto una volta sola
+            if self.orario is None:
+                self.orario = timezone.now()
+            # I nuovi eventi vengono trasmessi in modo incrementale, senza segnare una modifica
+            super().save(*args, **kwargs)
+            return
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Gara.segna_modifica(self.gara_id)
 
     def __str__(self):
         if self.pk is not None:
@@ -549,7 +892,7 @@ class Evento(KnowsChild):
         - la squadra sta partecipando alla gara
         - il problema sta nella gara
         """
-        if self.squadra.gara != self.gara:
+        if self.squadra.gara_id != self.gara_id:
             raise ValidationError("Questa squadra non sta partecipando alla gara!")
 
         if self.problema > self.gara.num_problemi:
@@ -561,6 +904,8 @@ class Evento(KnowsChild):
         e che la squadra stia partecipando alla gara
         """
         loraesatta = timezone.now()
+        if self.gara.archiviata:
+            return (False, "Gara archiviata")
         if self.gara.inizio is None:
             return (False, "Gara non ancora iniziata")
         if self.gara.sospensione is not None:
@@ -568,7 +913,7 @@ class Evento(KnowsChild):
         if loraesatta < self.gara.inizio:
             return (False, "Non puoi consegnare con un orario precedente all'inizio della gara")
         if loraesatta > self.gara.get_ora_fine():
-            if self.creatore == self.squadra.consegnatore:
+            if self.creatore_id == self.squadra.consegnatore_id:
                 return (False, "Non puoi consegnare dopo la fine della gara")
 
         return (True, "Inserimento avvenuto")
@@ -583,8 +928,12 @@ class Consegna(Evento):
     risposta = models.PositiveSmallIntegerField(validators=[MaxValueValidator(9999)])
 
     class Meta(Evento.Meta):
-        # Eredita il Meta dell'evento generico
+        # Eredita il Meta dell'evento generico, tranne gli indici che sono definiti sulla tabella degli eventi
         verbose_name_plural = "consegne"
+        indexes = [
+            # Consegne di una squadra ad un problema (validazione dei jolly)
+            models.Index(fields=['squadra', 'problema'], name='consegna_squadra_problema_idx'),
+        ]
 
     def __str__(self):
         return "Risposta {} al problema {} della squadra {} nella gara {} @ {}".format(
@@ -599,8 +948,7 @@ class Consegna(Evento):
         if res[0]:
             self.save()
 
-            sol = self.gara.soluzioni.get(problema=self.problema)
-            if sol.risposta == self.risposta:
+            if self.gara.soluzioni.filter(problema=self.problema, risposta=self.risposta).exists():
                 frase = "La risposta che hai consegnato è esatta!"
             else:
                 frase = "La risposta che hai consegnato è errata."
@@ -618,8 +966,9 @@ class Jolly(Evento):
     problema = models.PositiveSmallIntegerField()
 
     class Meta(Evento.Meta):
-        # Eredita il Meta dell'evento generico
+        # Eredita il Meta dell'evento generico, tranne gli indici che sono definiti sulla tabella degli eventi
         verbose_name_plural = "jolly"
+        indexes = []
 
     def __str__(self):
         return "Jolly sul problema {} della squadra {} nella gara {} @ {}".format(self.problema, self.squadra, self.gara, self.orario.astimezone(TIME_ZONE_SETTING))
@@ -638,22 +987,18 @@ class Jolly(Evento):
 
         loraesatta = timezone.now()
         if loraesatta > self.gara.inizio+timedelta(minutes=10):
-            if self.creatore == self.squadra.consegnatore:
+            if self.creatore_id == self.squadra.consegnatore_id:
                 return (False, "Non puoi inserire un jolly dopo 10 minuti")
 
-        qs = self.gara.eventi.all()
-        events = [x.as_child() for x in qs]
-
-        jolly = [x for x in events if isinstance(x, Jolly) and x.pk != self.pk]
-        jolly = [x.as_child() for x in jolly if x.squadra.num == self.squadra.num]
+        # Query filtrate sulla squadra, il cui costo non dipende dal numero di eventi della gara
+        jolly = list(Jolly.objects.filter(gara=self.gara, squadra_id=self.squadra_id).exclude(pk=self.pk))
         if len(jolly) > 0:
             return (False, f"È già stato inserito un jolly per la squadra: {jolly}")
 
         if not self.creatore.can_administrate(self.gara):
-            sol = self.gara.soluzioni.get(problema=self.problema)
-            consegne = [x for x in events if isinstance(x, Consegna)]
-            consegne = [x for x in consegne if x.squadra.num == self.squadra.num and x.problema == self.problema]
-            consegne_esatte = [x for x in consegne if x.risposta == sol.risposta]
+            soluzione = Soluzione.objects.filter(gara=self.gara, problema=self.problema).values('risposta')[:1]
+            consegne_esatte = list(Consegna.objects.filter(
+                gara=self.gara, squadra_id=self.squadra_id, problema=self.problema, risposta=Subquery(soluzione)))
             if len(consegne_esatte) > 0:
                 return (False, f"Solo l'amministratore può inserire il jolly ad una risposta a cui la squadra ha già risposto correttamente: {consegne_esatte}")
 
@@ -671,8 +1016,9 @@ class Bonus(Evento):
     punteggio = models.SmallIntegerField()
 
     class Meta(Evento.Meta):
-        # Eredita il Meta dell'evento generico
+        # Eredita il Meta dell'evento generico, tranne gli indici che sono definiti sulla tabella degli eventi
         verbose_name_plural = "bonus"
+        indexes = []
 
     def __str__(self):
         return "Bonus di {} punti alla squadra {} nella gara {} @ {}".format(self.punteggio, self.squadra, self.gara, self.orario.astimezone(TIME_ZONE_SETTING))
@@ -685,7 +1031,7 @@ class Bonus(Evento):
         Validazione dell'oggetto: accettiamo la consegna solo se:
         - la squadra sta partecipando alla gara
         """
-        if self.squadra.gara != self.gara:
+        if self.squadra.gara_id != self.gara_id:
             raise ValidationError("Questa squadra non sta partecipando alla gara!")
 
     def maybe_save(self):
@@ -0,0 +1,85 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from engine.models import Gara, Squadra, Soluzione, Consegna, Jolly, Bonus
+from engine.classifica import aggiorna_stato_gara, invalida_stato_gara, notifica_aggiornamento
+from engine.context_processors import invalida_gare
+
+
+def notifica_modifica(gara_pk):
+    """
+    Cambia subito il token di notifica della gara, e di nuovo al commit della transazione, quando le modifiche
+    sono visibili a tutte le connessioni: uno snapshot costruito prima del commit non viene riutilizzato.
+    """
+    if transaction.get_connection().in_atomic_block:
+        notifica_aggiornamento(gara_pk)
+    transaction.on_commit(lambda: notifica_aggiornamento(gara_pk))
+
+
+@receiver(post_save, sender=Consegna)
+@receiver(post_save, sender=Jolly)
+@receiver(post_save, sender=Bonus)
+def evento_salvato(sender, instance, created, raw=False, **kwargs):
+    """Un nuovo evento viene aggiunto alla classifica in cache, la modifica di un evento la invalida"""
+    if raw:
+        return
+    if created:
+        # Lo stato va aggiornato quando il nuovo evento è visibile anche alle altre connessioni
+        gara = instance.gara
+        transaction.on_commit(lambda: aggiorna_stato_gara(gara))
+    else:
+        invalida_stato_gara(instance.gara_id)
+    notifica_modifica(instance.gara_id)
+
+
+@receiver(post_delete, sender=Consegna)
+@receiver(post_delete, sender=Jolly)
+@receiver(post_delete, sender=Bonus)
+@receiver(post_delete, sender=Squadra)
+@receiver(post_delete, sender=Soluzione)
+def dati_gara_eliminati(sender, instance, origin=None, **kwargs):
+    """Le eliminazioni di eventi, squadre o soluzioni sono modifiche sostanziali che richiedono un ricalcolo completo"""
+    if isinstance(origin, Gara):
+        # La gara stessa sta per essere eliminata
+        return
+    Gara.segna_modifica(instance.gara_id)
+    invalida_stato_gara(instance.gara_id)
+    notifica_modifica(instance.gara_id)
+
+
+@receiver(post_save, sender=Squadra)
+@receiver(post_save, sender=Soluzione)
+def dati_gara_modificati(sender, instance, **kwargs):
+    """Modifiche a squadre o soluzioni richiedono un ricalcolo completo"""
+    invalida_stato_gara(instance.gara_id)
+    notifica_modifica(instance.gara_id)
+
+
+@receiver(post_save, sender=Gara)
+@receiver(post_delete, sender=Gara)
+def gara_modificata(sender, instance, **kwargs):
+    """Modifiche ai parametri di gara (compresi inizio, sospensione e ripresa) richiedono un ricalcolo completo"""
+    invalida_stato_gara(instance.pk)
+    # Come per le notifiche, l'elenco letto prima del commit non deve restare in cache
+    invalida_gare()
+    transaction.on_commit(invalida_gare)
+    notifica_modifica(instance.pk)
+
+
+@receiver(post_save, sender=Squadra)
+@receiver(post_delete, sender=Squadra)
+def consegnatore_modificato(sender, instance, raw=False, **kwargs):
+    """
+    I ruoli memorizzati sull'utente consegnatore della squadra vanno riletti. Le altre istanze
+    dello stesso utente vengono ricaricate alla richiesta successiva.
+    """
+    if not raw and Squadra.consegnatore.is_cached(instance) and instance.consegnatore is not None:
+        instance.consegnatore.invalida_permessi()
+
+
+@receiver(m2m_changed, sender=Gara.inseritori.through)
+def inseritori_modificati(sender, instance, action, reverse, **kwargs):
+    """Come per i consegnatori, se gli inseritori vengono modificati a partire dall'utente i suoi ruoli vanno riletti"""
+    if reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        instance.invalida_permessi()
@@ -1,3 +1,6 @@
+// Indirizzo di questo file, per eseguirlo anche come Web Worker (vedi MotoreClassifica)
+var URL_CLIENT_JS = (typeof document !== "undefined" && document.currentScript) ? document.currentScript.src : null;
+
 function bestCopy(src) {
     return Object.assign({}, src);
 }
@@ -8,6 +11,43 @@ function increaseSlider(slider, step) {
 }
 
 
+function decodifica_colonne(data, inizio) {
+    // Converte consegne, jolly e bonus dal formato compatto a colonne (vedi Gara.eventi_in_colonne sul server)
+    // in liste di oggetti, con gli orari in millisecondi dall'inizio convertiti in orari assoluti
+    var inizio_ms = new Date(inizio).getTime();
+    if (data.consegne !== undefined && !Array.isArray(data.consegne)) {
+        var c = data.consegne;
+        var giuste = atob(c.giusta);
+        data.consegne = c.id.map((id, i) => ({
+            id: id,
+            squadra: c.squadra[i],
+            problema: c.problema[i],
+            orario: inizio_ms + c.orario[i],
+            giusta: ((giuste.charCodeAt(i >> 3) >> (i & 7)) & 1) == 1
+        }));
+    }
+    if (data.jolly !== undefined && !Array.isArray(data.jolly)) {
+        var j = data.jolly;
+        data.jolly = j.id.map((id, i) => ({id: id, squadra: j.squadra[i], problema: j.problema[i]}));
+    }
+    if (data.bonus !== undefined && !Array.isArray(data.bonus)) {
+        var b = data.bonus;
+        data.bonus = b.id.map((id, i) => ({id: id, squadra: b.squadra[i], punteggio: b.punteggio[i], orario: inizio_ms + b.orario[i]}));
+    }
+    return data;
+}
+
+function conta_eventi(data) {
+    // Numero di consegne, jolly e bonus contenuti nei dati, sia nel formato a liste che in quello a colonne
+    var n = 0;
+    for (var k of ["consegne", "jolly", "bonus"]) {
+        if (data[k] !== undefined && data[k] !== null)
+            n += Array.isArray(data[k]) ? data[k].length : data[k].id.length;
+    }
+    return n;
+}
+
+
 class Gara {
     constructor(data, client) {
         // Costruisce la gara a partire dai dati forniti dal server
@@ -37,6 +77,8 @@ class Gara {
                 return n_prob * penalita_errore;
         }
         this._scadenza_jolly = 12 * 60 * 1000; // misurato in millisecondi
+        this._problemi_invalidati = new Set(); // Problemi i cui punti base sono cambiati, vedi propaga_invalidazioni
+        this._tempo_invalidazioni = this._time; // Tempo della gara a cui sono stati validati i punteggi in cache
 
         this.problemi = {};
         for (var i in data.problemi)
@@ -49,12 +91,15 @@ class Gara {
         if (data.inizio == null) return;
 
         this.last_update = new Date(data.last_update);
-        this.last_consegna_id = 0;
-        this.last_jolly_id = 0;
-        this.last_bonus_id = 0;
+        this.last_evento_id = data.last_evento_id; // Cursore per l'aggiornamento incrementale degli eventi
         this._time = this.inizio; // Parte a calcolare dall'inizio della gara
         this.fine = new Date(data.fine);
         this.tempo_blocco = new Date(data.tempo_blocco);
+        this._inizio_ms = this.inizio.getTime();
+        this._soglia_blocco_ms = this.tempo_blocco.getTime();
+        this._scadenza_jolly_ms = this.scadenza_jolly.getTime();
+        this._chiave_tempo = this.chiave_tempo(this._time);
+        this._tempo_invalidazioni = this._time;
         this.en_plein = 0;
 
         for (var i in data.jolly) {
@@ -62,19 +107,31 @@ class Gara {
             this.add_jolly(data.jolly[i])
         }
 
-        this.futuro_bonus = [];
-        this.passato_bonus = [];
+        // Consegne e bonus in ordine cronologico: gli eventi prima del cursore sono quelli già avvenuti
+        // al tempo corrente della gara, quindi spostarsi nel tempo costa quanto gli eventi attraversati
+        this.bonus = [];
+        this.bonus_cursore = 0;
         for (var i in data.bonus) {
             this.add_bonus(data.bonus[i])
         }
 
-        this.futuro_consegne = [];
-        this.passato_consegne = [];
+        this.consegne = [];
+        this.consegne_cursore = 0;
         for (var i in data.consegne) {
             this.add_consegna(data.consegne[i]);
         }
-        this.futuro_consegne_posizioni = [];
-        this.passato_consegne_posizioni = [];
+        // Posizioni in classifica dopo ogni consegna, calcolate la prima volta che la consegna viene applicata
+        this.consegne_posizioni = [];
+    }
+
+    imposta_timeline(timeline) {
+        // Usa le posizioni in classifica dopo ogni consegna calcolate dal server, per non dover
+        // riordinare la classifica ad ogni consegna quando ci si sposta nel tempo
+        if (this.consegne_cursore > 0 || timeline.consegne.length != this.consegne.length) return;
+        for (var i = 0; i < timeline.consegne.length; i++) {
+            if (timeline.consegne[i] != this.consegne[i].id) return;
+        }
+        this.consegne_posizioni = timeline.posizioni.slice();
     }
 
     add_jolly(event) {
@@ -82,17 +139,17 @@ class Gara {
         var prob = event.problema
         this.squadre[sq_idx].jolly = this.squadre[sq_idx].risposte[prob];
         this.squadre[sq_idx].jolly.is_jolly = true;
-        this.last_jolly_id = event.id;
+        // Il jolly cambia il punteggio di tutte le risposte della squadra
+        for (var i in this.squadre[sq_idx].risposte)
+            this.squadre[sq_idx].risposte[i].invalida();
     }
 
     add_consegna(event) {
-        this.futuro_consegne.push(new Consegna(this, event));
-        this.last_consegna_id = event.id;
+        this.consegne.push(new Consegna(this, event));
     }
 
     add_bonus(event) {
-        this.futuro_bonus.push(new Bonus(this, event));
-        this.last_bonus_id = event.id;
+        this.bonus.push(new Bonus(this, event));
     }
 
     get time() {
@@ -101,68 +158,88 @@ class Gara {
 
     set time(value) {
         var nel_futuro = (value >= this.time); // necessario memorizzare perchè this.update_events cambia internamente il valore a this.time
-        console.log("updating consegne");
-        this.update_events(value, nel_futuro, this.futuro_consegne, this.passato_consegne, this.futuro_consegne_posizioni, this.passato_consegne_posizioni);
-        console.log("updating bonus");
-        this.update_events(value, nel_futuro, this.futuro_bonus, this.passato_bonus, null, null);
+        this.update_events(value, nel_futuro);
         // Finalmente, setta il tempo della gara
         this._time = value;
     }
 
-    update_events(new_time, nel_futuro, futuro, passato, futuro_posizioni, passato_posizioni) {
-        // Si sposta al tempo specificato, calcolando gli eventi (consegne e bonus) in mezzo
-        if (nel_futuro) {
-            // Stiamo andando in avanti
-            console.log(futuro.length, passato.length, "futuro");
-            if (futuro.length > 0) console.log(futuro[0].orario, new_time, "futuro");
-            while (futuro.length > 0 && futuro[0].orario <= new_time) {
-                // Processa eventi, finché il prossimo non è troppo avanti
-                var e = futuro[0];
-                this._time = e.orario // Porta la gara all'ora della consegna
-
-                if (e instanceof Consegna) {
-                    e.squadra.risposte[e.problema.id].consegna(e.giusta);
-                } else if (e instanceof Bonus) {
-                    e.squadra.aggiungi_bonus_manuale(e.punteggio)
-                }
+    chiave_tempo(t) {
+        // I punteggi dipendono dal tempo solo attraverso i minuti trascorsi fino al blocco dei punteggi
+        // dei problemi e attraverso la scadenza dei jolly: finché la chiave non cambia, restano validi
+        var ms = t.getTime();
+        var minuti = Math.floor((Math.min(ms, this._soglia_blocco_ms) - this._inizio_ms) / 60000);
+        return 2 * minuti + (ms < this._scadenza_jolly_ms ? 0 : 1);
+    }
 
-                passato.push(e);
-                futuro.shift();
+    propaga_invalidazioni() {
+        // Invalida i punti base dei problemi se il tempo della gara è cambiato, e le risposte ai problemi
+        // i cui punti base sono cambiati. Viene chiamata solo quando si leggono i punteggi, così che
+        // spostarsi nel tempo attraverso molti eventi non abbia costi aggiuntivi
+        if (this._time !== this._tempo_invalidazioni) {
+            this._tempo_invalidazioni = this._time;
+            var chiave = this.chiave_tempo(this._time);
+            if (chiave != this._chiave_tempo) {
+                this._chiave_tempo = chiave;
+                for (var i in this.problemi)
+                    this.problemi[i].invalida();
+            }
+        }
+        if (this._problemi_invalidati.size == 0) return;
+        for (var problema of this._problemi_invalidati) {
+            for (var i = 0; i < problema.risposte.length; i++)
+                problema.risposte[i].invalida();
+        }
+        this._problemi_invalidati.clear();
+    }
 
-                if (passato_posizioni !== null && futuro_posizioni !== null) {
-                    var classifica_e;
-                    if (futuro_posizioni.length > 0) {
-                        classifica_e = futuro_posizioni.shift();
-                    } else {
-                        classifica_e = this.get_classifica_posizioni(this.classifica);
+    precede(a, b) {
+        // Ordine in cui vengono processati consegne e bonus: per orario, e a parità di orario per identificativo,
+        // come nella timeline delle posizioni calcolata dal server (vedi StatoGara.avanza_per_consegna)
+        return a.orario < b.orario || (a.orario.getTime() == b.orario.getTime() && a.id < b.id);
+    }
+
+    update_events(new_time, nel_futuro) {
+        // Si sposta al tempo specificato, applicando o annullando una alla volta le consegne e i bonus in mezzo,
+        // così che le posizioni in classifica dopo ogni consegna non dipendano dai tempi attraversati
+        if (nel_futuro) {
+            // Stiamo andando in avanti
+            while (true) {
+                var c = this.consegne[this.consegne_cursore];
+                var b = this.bonus[this.bonus_cursore];
+                if (c !== undefined && c.orario > new_time) c = undefined;
+                if (b !== undefined && b.orario > new_time) b = undefined;
+                if (c === undefined && b === undefined) break;
+
+                if (b === undefined || (c !== undefined && this.precede(c, b))) {
+                    this._time = c.orario // Porta la gara all'ora della consegna
+                    c.squadra.risposte[c.problema.id].consegna(c.giusta);
+                    if (this.consegne_posizioni[this.consegne_cursore] === undefined) {
+                        this.consegne_posizioni[this.consegne_cursore] = this.get_classifica_posizioni(this.classifica);
                     }
-                    passato_posizioni.push(classifica_e);
+                    this.consegne_cursore++;
+                } else {
+                    this._time = b.orario // Porta la gara all'ora del bonus
+                    b.squadra.aggiungi_bonus_manuale(b.punteggio)
+                    this.bonus_cursore++;
                 }
             }
         } else {
-            // Stiamo tornando indietro
-            console.log(futuro.length, passato.length, "passato");
-            if (passato.length > 0) console.log(passato[passato.length - 1].orario, new_time, "passato");
-            while (passato.length > 0 && passato[passato.length - 1].orario > new_time) {
-                var e = passato[passato.length - 1];
-                this._time = e.orario // Porta la gara all'ora della consegna
-
-                if (e instanceof Consegna) {
-                    e.squadra.risposte[e.problema.id].undo_consegna(e.giusta);
-                } else if (e instanceof Bonus) {
-                    e.squadra.rimuovi_bonus_manuale(e.punteggio)
-                }
-
-                passato.pop();
-                futuro.unshift(e);
-
-                if (passato_posizioni !== null && futuro_posizioni !== null) {
-                    if (passato_posizioni.length > 0) {
-                        classifica_e = passato_posizioni.pop();
-                    } else {
-                        classifica_e = this.get_classifica_posizioni(this.classifica);
-                    }
-                    futuro_posizioni.unshift(classifica_e);
+            // Stiamo tornando indietro, annullando per primo l'evento processato per ultimo
+            while (true) {
+                var c = this.consegne[this.consegne_cursore - 1];
+                var b = this.bonus[this.bonus_cursore - 1];
+                if (c !== undefined && c.orario <= new_time) c = undefined;
+                if (b !== undefined && b.orario <= new_time) b = undefined;
+                if (c === undefined && b === undefined) break;
+
+                if (b === undefined || (c !== undefined && this.precede(b, c))) {
+                    this._time = c.orario // Porta la gara all'ora della consegna
+                    c.squadra.risposte[c.problema.id].undo_consegna(c.giusta);
+                    this.consegne_cursore--;
+                } else {
+                    this._time = b.orario // Porta la gara all'ora del bonus
+                    b.squadra.rimuovi_bonus_manuale(b.punteggio)
+                    this.bonus_cursore--;
                 }
             }
         }
@@ -179,7 +256,6 @@ class Gara {
         if (value == null)
             value = this.client.timer.now();
         this.time = new Date(value);
-        console.log("progress at time", this.time);
     }
 
     get soglia_blocco() {
@@ -198,41 +274,35 @@ class Gara {
         return this.super_mega_bonus[this.en_plein] || 0;
     }
 
+    chiave_spareggio(squadra) {
+        // Chiave per lo spareggio tra squadre a pari punteggio totale, calcolata una volta per squadra:
+        // punteggio del problema jolly, punteggi dei singoli problemi in ordine decrescente, ID della squadra
+        var jolly = 0;
+        if (this.jolly_enabled) {
+            jolly = (squadra.jolly != null) ? squadra.jolly.punteggio : squadra.risposte[1].punteggio;
+        }
+        var punteggi = [];
+        for (var i in squadra.risposte)
+            punteggi.push(squadra.risposte[i].punteggio);
+        punteggi.sort((x, y) => y - x);
+        return {jolly: jolly, punteggi: punteggi, id: parseInt(squadra.id)};
+    }
+
     custom_sort(a, b) {
-        // Confronto rispetto al punteggio totale
-        if (a.pts < b.pts) return 1
-        if (a.pts > b.pts) return -1;
+        // Confronta le chiavi di spareggio di due squadre a pari punteggio totale
 
         // In caso di parità tra due squadre prevale quella che ha totalizzato più punti (compresi bonus e penalizzazioni) nel suo problema jolly.
-        if (this.jolly_enabled) {
-            if (a.squadra.jolly != null) {
-                var jolly_a = a.squadra.jolly;
-            } else {
-                var jolly_a = a.squadra.risposte[1];
-            }
-            if (b.squadra.jolly != null) {
-                var jolly_b = b.squadra.jolly;
-            } else {
-                var jolly_b = b.squadra.risposte[1];
-            }
-            var jolly_diff = jolly_b.punteggio - jolly_a.punteggio;
-            if (jolly_diff != 0) return jolly_diff;
-        }
+        if (a.jolly != b.jolly) return b.jolly - a.jolly;
 
         // In caso di ulteriore parità, prevale la squadra che ha ottenuto il maggior punteggio per un singolo problema (compresi bonus e penalizzazioni).
         // In caso di ulteriore parità, si guarda il secondo maggior punteggio, e così via.
-        var pba = Object.entries(a.squadra.risposte).map(x => x[1].punteggio).sort().reverse();
-        var pbb = Object.entries(b.squadra.risposte).map(x => x[1].punteggio).sort().reverse();
-        for (var i = 0; i < pba.length; i++) {
-            var va = pba[i];
-            var vb = pbb[i];
-            if (va < vb) return 1;
-            if (va > vb) return -1;
+        for (var i = 0; i < a.punteggi.length; i++) {
+            if (a.punteggi[i] != b.punteggi[i]) return b.punteggi[i] - a.punteggi[i];
         }
 
         // Infine, in caso di parità in tutti i punteggi, si procederà ad un sorteggio.
         // Il sorteggio qui è simulato con un ordinamento stabile rispetto all'ID della squadra, che è stato assegnato in un sorteggio precedente.
-        return a.squadra.id - b.squadra.id;
+        return a.id - b.id;
     }
 
     get classifica() {
@@ -243,8 +313,19 @@ class Gara {
                 pts: this.squadre[i].punteggio
             })
         }
-        // Ordina secondo il regolamento
-        ret.sort(this.custom_sort.bind(this));
+        // Ordina secondo il regolamento: prima rispetto al punteggio totale, poi, solo tra le squadre
+        // a pari punteggio, rispetto alle chiavi di spareggio
+        ret.sort((a, b) => b.pts - a.pts);
+        for (var i = 0; i < ret.length; ) {
+            var j = i + 1;
+            while (j < ret.length && ret[j].pts == ret[i].pts) j++;
+            if (j - i > 1) {
+                var pari = ret.slice(i, j).map(x => ({x: x, chiave: this.chiave_spareggio(x.squadra)}));
+                pari.sort((a, b) => this.custom_sort(a.chiave, b.chiave));
+                for (var k = i; k < j; k++) ret[k] = pari[k - i].x;
+            }
+            i = j;
+        }
         return ret
     }
 
@@ -269,6 +350,64 @@ class Gara {
         return ret
     }
 
+    istantanea(blink) {
+        // Stato della gara al tempo corrente, con i soli dati necessari a disegnare le classifiche.
+        // Contiene solo valori semplici, così che possa essere inviato da un Web Worker al thread principale;
+        // le squadre in classifica sono gli stessi oggetti di squadre, e postMessage ne preserva l'identità
+        if (this.inizio == null) return {inizio: null};
+        var squadre = {};
+        for (var i in this.squadre) {
+            var sq = this.squadre[i];
+            var risposte = {};
+            for (var j in sq.risposte) {
+                var r = sq.risposte[j];
+                risposte[j] = {
+                    risolto: r.risolto,
+                    errori: r.errori,
+                    is_jolly: r.is_jolly,
+                    punteggio: r.punteggio,
+                    punteggio_per_premio: r.punteggio_per_premio
+                };
+            }
+            squadre[i] = {
+                id: sq.id,
+                nome: sq.nome,
+                ospite: sq.ospite,
+                punteggio: sq.punteggio,
+                bonus: sq.bonus_manuale + sq._en_plein_bonus,
+                risposte: risposte
+            };
+        }
+        var ordine = this.classifica;
+        var classifica = ordine.map(x => ({squadra: squadre[x.squadra.id], pts: x.pts}));
+        var problemi = this.punti_problemi;
+        for (var k in problemi) {
+            var problema = this.problemi[problemi[k].id];
+            problemi[k].nome = problema.nome;
+            problemi[k].bloccato = problema.bloccato;
+            problemi[k].giuste = problema._risposte_corrette;
+        }
+        // Le ultime consegne, da far lampeggiare, e le posizioni in classifica prima di esse e prima dell'ultima
+        var cursore = this.consegne_cursore;
+        var recenti = [];
+        for (var k = cursore - Math.min(blink, cursore); k < cursore; k++)
+            recenti.push({squadra: this.consegne[k].squadra.id, problema: this.consegne[k].problema.id});
+        return {
+            inizio: this.inizio.getTime(),
+            fine: this.fine.getTime(),
+            time: this.time.getTime(),
+            n_prob: this.n_prob,
+            squadre: squadre,
+            classifica: classifica,
+            posizioni: this.get_classifica_posizioni(ordine),
+            problemi: problemi,
+            consegne_cursore: cursore,
+            recenti: recenti,
+            posizioni_recenti: (recenti.length > 0) ? this.consegne_posizioni[cursore - recenti.length - 1] : null,
+            posizioni_precedenti: (cursore > 1) ? this.consegne_posizioni[cursore - 2] : null
+        };
+    }
+
 }
 
 class Problema {
@@ -281,11 +420,20 @@ class Problema {
         this.lock_time = (gara.n_blocco == 0) ? gara.inizio : null; // Tempo a cui il problema si è bloccato
         this._risposte_corrette = 0; // Contatore del numero di risposte corrette
         this._risposte_sbagliate = 0; // Contatore delle risposte sbagliate prima della prima soluzione
+        this.risposte = []; // Risposte delle squadre al problema, il cui punteggio dipende dai punti base
+        this._punti_base = null; // Punti base in cache, vedi invalida
+    }
+
+    invalida() {
+        // I punti base sono cambiati: vanno ricalcolati, insieme al punteggio delle risposte al problema
+        this._punti_base = null;
+        this.gara._problemi_invalidati.add(this);
     }
 
     // Segnala al problema una nuova risposta, per adeguare il suo valore
     // NON deve essere chiamata dalla risposta di una squadra ospite
     aggiungi_risposta(giusta) {
+        this.invalida();
         if (giusta) {
             this._risposte_corrette += 1;
             if (this._risposte_corrette == this.gara.n_blocco && this.gara.time <= this.gara.soglia_blocco) {
@@ -300,6 +448,7 @@ class Problema {
 
     rimuovi_risposta(giusta) {
         // Annulla l'effetto di aggiungi_risposta
+        this.invalida();
         if (giusta) {
             this._risposte_corrette -= 1;
             if (this._risposte_corrette == this.gara.n_blocco - 1 && this.gara.time <= this.gara.soglia_blocco) {
@@ -318,6 +467,13 @@ class Problema {
 
     get punti_base() {
         // Restituisce il valore base del problema
+        this.gara.propaga_invalidazioni();
+        if (this._punti_base === null)
+            this._punti_base = this.calcola_punti_base();
+        return this._punti_base;
+    }
+
+    calcola_punti_base() {
         if (this.lock_time != null)
             var t = this.lock_time;
         else if (this.gara.time > this.gara.soglia_blocco)
@@ -346,6 +502,14 @@ class Risposta {
         this.errori = 0;
         this._is_jolly = false
         this._bonus = 0;
+        this._punteggio = null; // Punteggio in cache, vedi invalida
+        problema.risposte.push(this);
+    }
+
+    invalida() {
+        // Il punteggio della risposta, e quindi quello della squadra, va ricalcolato
+        this._punteggio = null;
+        this.squadra._punteggio = null;
     }
 
     get is_jolly() {
@@ -364,6 +528,7 @@ class Risposta {
     }
 
     consegna(giusta) {
+        this.invalida();
         if (giusta) {
             this.risolto += 1;
             if (this.risolto == 1) {
@@ -384,6 +549,7 @@ class Risposta {
 
     undo_consegna(giusta) {
         // Annulla una consegna al tempo corrente
+        this.invalida();
         if (giusta) {
             this.risolto -= 1;
             if (this.risolto == 0) {
@@ -402,6 +568,13 @@ class Risposta {
     }
 
     get punteggio() {
+        this.gara.propaga_invalidazioni();
+        if (this._punteggio === null)
+            this._punteggio = this.calcola_punteggio();
+        return this._punteggio;
+    }
+
+    calcola_punteggio() {
         var pts = 0;
         if (this.risolto) {
             pts += this.problema.punti_base + this._bonus;
@@ -440,6 +613,7 @@ class Squadra {
         this.bonus_manuale = 0;
         this._risposte_corrette = 0;
         this._en_plein_bonus = 0;
+        this._punteggio = null; // Punteggio in cache, annullato dalle risposte e dai bonus della squadra
     }
 
     aggiungi_risposta(giusta) {
@@ -470,13 +644,22 @@ class Squadra {
 
     aggiungi_bonus_manuale(punteggio) {
         this.bonus_manuale += punteggio;
+        this._punteggio = null;
     }
 
     rimuovi_bonus_manuale(punteggio) {
         this.bonus_manuale -= punteggio;
+        this._punteggio = null;
     }
 
     get punteggio() {
+        this.gara.propaga_invalidazioni();
+        if (this._punteggio === null)
+            this._punteggio = this.calcola_punteggio();
+        return this._punteggio;
+    }
+
+    calcola_punteggio() {
         // Calcola il punteggio della squadra
         var pts = this.gara.calcola_punteggio_tempo_iniziale(this.gara.n_prob, this.gara.penalita_errore, this.gara.punteggio_iniziale_squadre);
         pts += this._en_plein_bonus;
@@ -499,6 +682,7 @@ class Consegna {
         this.squadra = gara.squadre[data.squadra];
         this.problema = gara.problemi[data.problema];
         this.giusta = data.giusta;
+        this.id = data.id;
     }
 }
 
@@ -512,17 +696,134 @@ class Bonus {
             this.orario = new Date(gara.fine);
         this.squadra = gara.squadre[data.squadra];
         this.punteggio = data.punteggio;
+        this.id = data.id;
+    }
+}
+
+class TabellaHTML {
+    // Tiene i riferimenti agli elementi delle tabelle e l'ultimo contenuto scritto in ciascuno, così che
+    // ad ogni aggiornamento vengano scritti nel DOM solo gli elementi il cui contenuto o le cui classi
+    // sono cambiati. Le scritture vengono accumulate e fatte tutte insieme da applica()
+    constructor() {
+        this._elementi = new Map();
+        this._modificati = new Set();
+    }
+
+    _elemento(id) {
+        var e = this._elementi.get(id);
+        if (e === undefined) {
+            // Come con jQuery, gli elementi che non esistono vengono ignorati
+            e = {el: document.getElementById(id), html: null, html_scritto: null, classi: {}, classi_scritte: {}};
+            this._elementi.set(id, e);
+        }
+        return e;
+    }
+
+    html(id, testo) {
+        var e = this._elemento(id);
+        e.html = testo;
+        if (testo !== e.html_scritto) this._modificati.add(e);
+    }
+
+    classe(id, nome, attiva) {
+        var e = this._elemento(id);
+        attiva = Boolean(attiva);
+        e.classi[nome] = attiva;
+        if (!(nome in e.classi_scritte))
+            e.classi_scritte[nome] = (e.el !== null && e.el.classList.contains(nome));
+        if (attiva !== e.classi_scritte[nome]) this._modificati.add(e);
+    }
+
+    applica() {
+        // Scrive nel DOM le differenze rispetto all'ultima chiamata
+        for (var e of this._modificati) {
+            if (e.el === null) continue;
+            if (e.html !== null && e.html !== e.html_scritto) {
+                e.el.innerHTML = e.html;
+                e.html_scritto = e.html;
+            }
+            for (var nome in e.classi) {
+                if (e.classi[nome] !== e.classi_scritte[nome]) {
+                    e.el.classList.toggle(nome, e.classi[nome]);
+                    e.classi_scritte[nome] = e.classi[nome];
+                }
+            }
+        }
+        this._modificati.clear();
+    }
+}
+
+class MotoreClassifica {
+    // Tiene il modello della gara per ClassificaClient: riceve i dati del server e gli spostamenti nel tempo,
+    // e risponde ad ogni messaggio con l'istantanea da disegnare. Gira in un Web Worker, così che ricalcolare
+    // la gara non blocchi la pagina, oppure nel thread principale se i Web Worker non sono disponibili
+    constructor() {
+        this.gara = undefined;
+        this.blink = 0;
+    }
+
+    ricevi(messaggio) {
+        switch (messaggio.tipo) {
+            case "carica":
+                var data = messaggio.data;
+                if (data.inizio != null)
+                    decodifica_colonne(data, data.inizio);
+                this.gara = new Gara(data, null);
+                if (messaggio.timeline !== null && this.gara.inizio != null)
+                    this.gara.imposta_timeline(messaggio.timeline);
+                this.blink = messaggio.blink;
+                break;
+            case "eventi":
+                // Nuove consegne, jolly e bonus (le liste vuote sono omesse dal server)
+                var data = decodifica_colonne(messaggio.data, this.gara.inizio);
+                for (var i in data.consegne) {
+                    this.gara.add_consegna(data.consegne[i]);
+                }
+                for (var i in data.jolly) {
+                    this.gara.add_jolly(data.jolly[i])
+                }
+                for (var i in data.bonus) {
+                    this.gara.add_bonus(data.bonus[i])
+                }
+                this.gara.last_evento_id = data.last_evento_id;
+                break;
+        }
+        if (messaggio.progress != null)
+            this.gara.progress = messaggio.progress;
+        return this.gara.istantanea(this.blink);
     }
 }
 
 class ClassificaClient {
-    constructor(url, view, timer, following = []) {
+    constructor(url, view, timer, following = [], usa_worker = true) {
         this.url = url;
         this.view = view;
         this.timer = timer;
         this.following = following;
         this.autoplay = 0;
-        this.recalculating = false;
+        this.tabella = new TabellaHTML();
+        this._disegno_richiesto = false;
+        this.stato = undefined; // Ultima istantanea ricevuta dal modello della gara
+        this.inizio = undefined; // Inizio della gara, noto dopo il primo caricamento (null se la gara non è iniziata)
+        this._caricamenti = 0; // Numero di volte che la gara è stata caricata dal server
+        this._richieste = 0; // Messaggi inviati al modello della gara in attesa di risposta
+        this._progress_in_attesa = null;
+        // Il modello della gara gira in un Web Worker quando possibile, altrimenti nel thread principale
+        this._worker = null;
+        this.motore = null;
+        if (usa_worker && typeof Worker !== "undefined" && URL_CLIENT_JS !== null) {
+            try {
+                this._worker = new Worker(URL_CLIENT_JS);
+            } catch (e) {
+                this._worker = null;
+            }
+        }
+        if (this._worker !== null) {
+            var self = this;
+            this._worker.onmessage = function(e) {self._ricevi(e.data)};
+        } else {
+            this.motore = new MotoreClassifica();
+        }
         // Impostazione specifica della classifica unica
         var urlParams = new URLSearchParams(window.location.search);
         var blink = urlParams.get("blink");
@@ -533,68 +834,150 @@ class ClassificaClient {
         this.prize = (prize && !isNaN(prize)) ? 1 : 0;
     }
 
-    init() {
+    get gara() {
+        // Il modello della gara è accessibile solo se gira nel thread principale
+        return (this.motore !== null) ? this.motore.gara : undefined;
+    }
+
+    init(url_timeline = null) {
         var self = this;
-        $.getJSON(this.url).done(function(data) {
-            self.recalculating = true;
-            self.gara = new Gara(data, self);
-            self.timer.init(self.gara.inizio.getTime());
-            self.following = data.consegnatore_per
-            self.progress = null;
-            self.recalculating = false;
+        if (url_timeline !== null) {
+            // Per la visualizzazione a posteriori scarica anche le posizioni precalcolate dal server
+            return $.when($.getJSON(this.url, {formato: "colonne"}), $.getJSON(url_timeline)).done(function(status, timeline) {
+                self._carica(status[0], timeline[0]);
+            });
+        }
+        return $.getJSON(this.url, {formato: "colonne"}).done(function(data) {
+            self._carica(data, null);
+        });
+    }
+
+    _carica(data, timeline) {
+        // Il thread principale tiene solo i dati necessari a scaricare i nuovi eventi: la gara viene
+        // ricalcolata dal modello, che risponde con l'istantanea da disegnare
+        this._caricamenti += 1;
+        this.inizio = (data.inizio != null) ? new Date(data.inizio) : null;
+        this.last_update = new Date(data.last_update);
+        this.last_evento_id = data.last_evento_id;
+        this.num_eventi = conta_eventi(data); // Eventi ricevuti, per accorgersi di quelli saltati dal cursore
+        if (this.inizio != null)
+            this.timer.init(this.inizio.getTime());
+        this.following = data.consegnatore_per
+        this.notifica = data.notifica;
+        this._invia({
+            tipo: "carica",
+            data: data,
+            timeline: timeline,
+            blink: this.blink,
+            progress: (this.inizio != null) ? this.timer.now() : null
         });
     }
 
+    _invia(messaggio) {
+        // Invia un messaggio al modello della gara, che risponde in _ricevi
+        this._richieste += 1;
+        if (this._worker !== null)
+            this._worker.postMessage(messaggio);
+        else
+            this._ricevi(this.motore.ricevi(messaggio));
+    }
+
+    _ricevi(stato) {
+        this._richieste -= 1;
+        this.stato = stato;
+        if (this._richieste == 0 && this._progress_in_attesa !== null) {
+            var progress = this._progress_in_attesa;
+            this._progress_in_attesa = null;
+            this._invia({tipo: "progress", progress: progress});
+        }
+        if (stato.inizio != null)
+            this._aggiornaHTML();
+    }
+
     update(progress = null) {
-        var self = this;
-        if (this.recalculating) return;
-        if (this.gara.inizio == null) {
+        // Ricalcola periodicamente i punteggi; i nuovi eventi vengono ricevuti da ascolta()
+        if (this.inizio === undefined) return;
+        if (this.inizio == null) {
             this.init();
             return
         }
-        var last_consegna_id_before = this.gara.last_consegna_id;
-        var last_jolly_id_before = this.gara.last_jolly_id;
-        var last_bonus_id_before = this.gara.last_bonus_id;
-        console.log("Last consegna ID is", last_consegna_id_before, "- last jolly ID is", last_jolly_id_before, "- last bonus ID is", last_bonus_id_before);
+        this.progress = progress;
+    }
+
+    ascolta() {
+        // Resta in attesa di nuovi eventi: con il long polling il server risponde appena i dati di gara cambiano,
+        // altrimenti la richiesta viene ripetuta ad intervalli regolari
+        var self = this;
+        if (this.inizio == null) {
+            setTimeout(function() {self.ascolta()}, 1000);
+            return;
+        }
+        var caricamento = this._caricamenti;
         $.getJSON(this.url, {
-            last_consegna_id: last_consegna_id_before,
-            last_jolly_id: last_jolly_id_before,
-            last_bonus_id: last_bonus_id_before
+            last_evento_id: this.last_evento_id,
+            notifica: this.notifica,
+            formato: "colonne"
         }).done(function(data) {
+            // La gara è stata ricaricata mentre la richiesta era in attesa
+            if (self._caricamenti !== caricamento) {
+                self.ascolta();
+                return;
+            }
             var new_lu = new Date(data.last_update);
-            if (new_lu > self.gara.last_update) {
+            if (new_lu > self.last_update) {
                 // C'è stata una modifica grossa, serve un ricalcolo totale
-                self.init();
+                self.init().always(function() {self.ascolta()});
                 return;
             }
-            // Evitiamo di riconteggiare alcuni eventi già arrivati; succede se la rete sta laggando
-            if (self.gara.last_consegna_id > last_consegna_id_before || self.gara.last_jolly_id > last_jolly_id_before || self.gara.last_bonus_id > last_bonus_id_before) return;
-
-            // Aggiungiamo le nuove consegne e jolly
-            for (var i in data.consegne) {
-                self.gara.add_consegna(data.consegne[i]);
-            }
-            for (var i in data.jolly) {
-                self.gara.add_jolly(data.jolly[i])
-            }
-            for (var i in data.bonus) {
-                self.gara.add_bonus(data.bonus[i])
+            self.num_eventi += conta_eventi(data);
+            if (data.num_eventi !== undefined && self.num_eventi < data.num_eventi) {
+                // Un evento precedente al cursore è diventato visibile dopo quelli successivi
+                self.init().always(function() {self.ascolta()});
+                return;
             }
-            self.progress = progress;
+            self.last_evento_id = data.last_evento_id;
+            self.notifica = data.notifica;
+            // Il modello aggiunge i nuovi eventi e ricalcola i punteggi al tempo corrente
+            if (data.consegne || data.jolly || data.bonus)
+                self._invia({tipo: "eventi", data: data, progress: self.timer.now()});
+            // Senza long polling il server risponde subito, e indica quanto attendere prima della richiesta successiva
+            if (data.attesa)
+                setTimeout(function() {self.ascolta()}, data.attesa * 1000);
+            else
+                self.ascolta();
+        }).fail(function() {
+            setTimeout(function() {self.ascolta()}, 5000);
         });
     }
 
     get progress() {
-        return this.gara.progress;
+        return (this.stato !== undefined && this.stato.inizio != null) ? this.stato.time : undefined;
     }
 
     set progress(value) {
-        // Porta la gara al punto specificato, e aggiorna l'HTML
-        this.gara.progress = value;
-        this._aggiornaHTML();
+        // Porta la gara al punto specificato; l'HTML viene aggiornato quando il modello risponde.
+        // Se il modello sta ancora elaborando, viene inviato solo l'ultimo punto richiesto
+        if (this.inizio == null) return;
+        if (value == null)
+            value = this.timer.now();
+        if (this._richieste > 0)
+            this._progress_in_attesa = value;
+        else
+            this._invia({tipo: "progress", progress: value});
     }
 
     _aggiornaHTML() {
+        // Ridisegna al prossimo frame: più aggiornamenti nello stesso frame vengono disegnati una volta sola
+        if (this._disegno_richiesto) return;
+        this._disegno_richiesto = true;
+        var self = this;
+        requestAnimationFrame(function() {
+            self._disegno_richiesto = false;
+            self._disegna();
+        });
+    }
+
+    _disegna() {
         this._stampaOrologio();
         switch (this.view) {
             case 'squadre':
@@ -613,32 +996,33 @@ class ClassificaClient {
                 this._mostraScorrimento();
                 break;
         }
+        this.tabella.applica();
         document.dispatchEvent(new Event('updated'));
     }
 
     _stampaOrologio() {
-        if (this.gara.inizio != null) {
-            var inizio = new Date(this.gara.inizio);
-            var fine = new Date(this.gara.fine);
+        if (this.stato.inizio != null) {
+            var inizio = new Date(this.stato.inizio);
+            var fine = new Date(this.stato.fine);
             var durata = fine - inizio;
-            var t_trascorso = Math.min(this.gara.time - inizio, durata); // Se la gara è finita, restituisce la durata
+            var t_trascorso = Math.min(this.stato.time - inizio, durata); // Se la gara è finita, restituisce la durata
             var res = new Date(t_trascorso).toISOString().substr(11, 8);
             $("#orologio").text(res);
         }
     }
 
     _mostraClassifica() {
-        var classifica = this.gara.classifica;
-        var classifica_posizioni = this.gara.get_classifica_posizioni(classifica);
+        var classifica = this.stato.classifica;
+        var classifica_posizioni = this.stato.posizioni;
         var max = classifica.length > 0 ? classifica[0].pts : 0;
-        max = Math.max(max, this.gara.n_prob * 10 * 4);
+        max = Math.max(max, this.stato.n_prob * 10 * 4);
 
         var sq, pts;
         for (var i in classifica) {
             var sq = classifica[i].squadra;
             var pts = classifica[i].pts;
             var pos = classifica_posizioni[sq.id - 1];
-            var elapsed = (this.gara.time - this.gara.inizio) / 1000;
+            var elapsed = (this.stato.time - this.stato.inizio) / 1000;
             $("#team-" + sq.id).css('width', Math.round(pts / max * 1000) / 10 + '%');
             $("#label-pos-" + sq.id).text(pos + "°");
             $("#label-points-" + sq.id).text(pts);
@@ -651,14 +1035,14 @@ class ClassificaClient {
     }
 
     _mostraPuntiProblemi() {
-        var punti_problemi = this.gara.punti_problemi
+        var punti_problemi = this.stato.problemi
         var max = Math.max(...punti_problemi.map((x) => x.base + x.bonus), 80) // Restituisce il max tra 80 e le somme tra base e bonus
         for (var k in punti_problemi) {
             var id = punti_problemi[k].id
-            $("#label-" + id).text((id) + " - " + this.gara.problemi[id].nome);
+            $("#label-" + id).text((id) + " - " + punti_problemi[k].nome);
             $("#punti-" + id).css('width', Math.round(punti_problemi[k].base * 100. / max) + '%');
             $("#label-punti-" + id).text(punti_problemi[k].base);
-            if (this.gara.problemi[id].bloccato) {
+            if (punti_problemi[k].bloccato) {
                 $("#punti-" + id).removeClass("progress-bar-light");
                 $("#punti-" + id).addClass("progress-bar-dark");
             } else {
@@ -672,22 +1056,23 @@ class ClassificaClient {
     }
 
     _mostraStatoProblemi() {
-        for (var i in this.gara.squadre) {
-            var sq = this.gara.squadre[i];
+        var tabella = this.tabella;
+        for (var i in this.stato.squadre) {
+            var sq = this.stato.squadre[i];
             for (var j in sq.risposte) {
                 var r = sq.risposte[j];
+                var id = "cell-" + i + "-" + j;
                 var text = "";
-                $("#cell-" + i + "-" + j).removeClass("wrong-answer right-answer")
+                tabella.classe(id, "right-answer", r.risolto > 0);
+                tabella.classe(id, "wrong-answer", !r.risolto && r.errori > 0);
 
                 if (r.risolto) {
-                    $("#cell-" + i + "-" + j).addClass("right-answer");
                     if (r.errori) {
                         text += '<b>-' + r.errori + '</b>';
                     } else {
                         text += '<b>0</b>';
                     }
                 } else if (r.errori) {
-                    $("#cell-" + i + "-" + j).addClass("wrong-answer");
                     text += '<b>-' + r.errori + '</b>';
                 }
 
@@ -695,51 +1080,42 @@ class ClassificaClient {
                     text += ClassificaClient.stella_jolly;
                 }
 
-                $("#cell-" + i + "-" + j).html(text);
+                tabella.html(id, text);
             }
         }
 
         for (const sq_id of this.following) {
-            $("#riga-" + sq_id).addClass("following");
+            tabella.classe("riga-" + sq_id, "following", true);
         }
     }
 
     _mostraUnica() {
-        var punti_problemi = this.gara.punti_problemi
+        var tabella = this.tabella;
+        var punti_problemi = this.stato.problemi
         for (var i in punti_problemi) {
             var text = ""
             var problema = (parseInt(i) + 1)
             text += "#" + ("0" + problema).slice(-2) + "\n" + punti_problemi[i].base + "+" + punti_problemi[i].bonus
-            $("#pr-" + problema).html(text)
+            tabella.html("pr-" + problema, text)
             var id = punti_problemi[i].id;
-            $("#giuste-" + problema).html(this.gara.problemi[id]._risposte_corrette);
-            if (this.gara.problemi[id].bloccato) {
-                $("#giuste-" + problema).removeClass("progress-bar-light");
-                $("#giuste-" + problema).removeClass("progress-bar-zero");
-                $("#giuste-" + problema).addClass("progress-bar-dark");
-            } else if (this.gara.problemi[id]._risposte_corrette === 0) {
-                $("#giuste-" + problema).removeClass("progress-bar-light");
-                $("#giuste-" + problema).removeClass("progress-bar-dark");
-                $("#giuste-" + problema).addClass("progress-bar-zero");
-            } else {
-                // almeno una risposta corretta, ma non ancora bloccato
-                $("#giuste-" + problema).removeClass("progress-bar-dark");
-                $("#giuste-" + problema).removeClass("progress-bar-zero");
-                $("#giuste-" + problema).addClass("progress-bar-light");
-            }
+            var giuste = punti_problemi[i].giuste;
+            var bloccato = punti_problemi[i].bloccato;
+            tabella.html("giuste-" + problema, "" + giuste);
+            tabella.classe("giuste-" + problema, "progress-bar-dark", bloccato);
+            tabella.classe("giuste-" + problema, "progress-bar-zero", !bloccato && giuste === 0);
+            // almeno una risposta corretta, ma non ancora bloccato
+            tabella.classe("giuste-" + problema, "progress-bar-light", !bloccato && giuste !== 0);
         }
         // Chiama l'implementazione comune
-        var classifica = this.gara.classifica;
-        var classifica_posizioni = this.gara.get_classifica_posizioni(classifica);
+        var classifica = this.stato.classifica;
+        var classifica_posizioni = this.stato.posizioni;
         this._mostraUnicaOScorrimento(classifica, classifica_posizioni, false, this.prize > 0);
         // Aggiungi lampeggio alla risposta
-        var passato_length = this.gara.passato_consegne.length;
-        var oldest_blink = Math.min(this.blink, passato_length);
-        for (var i = passato_length - oldest_blink; i < passato_length; i++) {
-            var e = this.gara.passato_consegne[i];
-            var sq = e.squadra;
-            var r = e.problema;
-            $("#cell-" + classifica_posizioni[sq.id - 1] + "-" + r.id).addClass("blink");
+        var passato_length = this.stato.consegne_cursore;
+        var oldest_blink = this.stato.recenti.length;
+        for (var i = 0; i < oldest_blink; i++) {
+            var e = this.stato.recenti[i];
+            tabella.classe("cell-" + classifica_posizioni[e.squadra - 1] + "-" + e.problema, "blink", true);
         }
         // Aggiungi frecce per il cambiamento di posizione in classifica
         if (this.blink > 0) {
@@ -751,7 +1127,7 @@ class ClassificaClient {
             $("#freccia-foot").show();
         }
         if (oldest_blink > 0) {
-            var classifica_posizioni_oldest_blink = this.gara.passato_consegne_posizioni[passato_length - oldest_blink - 1];
+            var classifica_posizioni_oldest_blink = this.stato.posizioni_recenti;
             for (var i in classifica) {
                 var sq = classifica[i].squadra;
                 var riga = parseInt(i) + 1;
@@ -764,15 +1140,14 @@ class ClassificaClient {
                 } else {
                     freccia = ClassificaClient.uguale;
                 }
-                $("#freccia-" + riga).html(freccia);
+                tabella.html("freccia-" + riga, freccia);
             }
         } else {
             $("#freccia-" + riga).html();
         }
         // Abilita l'animazione in position_warn_overlay se la squadra è entrata nelle prime posizioni
-        console.log("Position warn is", this.position_warn, "and passato length is", passato_length);
         if (this.position_warn > 0 && passato_length > 1) {
-            var classifica_posizioni_consegna_precedente = this.gara.passato_consegne_posizioni[(passato_length - 1) - 1];
+            var classifica_posizioni_consegna_precedente = this.stato.posizioni_precedenti;
             for (var i in classifica) {
                 var sq = classifica[i].squadra;
                 if (classifica_posizioni[sq.id - 1] <= this.position_warn) {
@@ -789,11 +1164,13 @@ class ClassificaClient {
         // Aggiungi bordo per la risposta che vincerebbe il premio
         if (this.prize > 0) {
             // Pulisci le precedenti classi CSS
+            var classi_premio = ["prize", "prize-dashed", "prize-solid", "prize-gold", "prize-silver", "prize-bronze"];
             for (var i in classifica) {
                 var sq = classifica[parseInt(i)].squadra;
                 var riga = parseInt(i) + 1;
                 for (var j in sq.risposte) {
-                    $("#cell-" + riga + "-" + j).removeClass("prize prize-dashed prize-solid prize-gold prize-silver prize-bronze");
+                    for (var c = 0; c < classi_premio.length; c++)
+                        tabella.classe("cell-" + riga + "-" + j, classi_premio[c], false);
                 }
             }
 
@@ -824,44 +1201,43 @@ class ClassificaClient {
                 var group = scoreMap.get(s);
                 var medal = medalClass[sidx];
                 var modifier = group.length > 1 ? "prize-dashed" : "prize-solid";
-                var cls = "prize " + medal + " " + modifier;
                 for (var k = 0; k < group.length; k++) {
                     var cell = group[k];
-                    $("#cell-" + cell.riga + "-" + cell.colonna).addClass(cls);
+                    var id = "cell-" + cell.riga + "-" + cell.colonna;
+                    tabella.classe(id, "prize", true);
+                    tabella.classe(id, medal, true);
+                    tabella.classe(id, modifier, true);
                 }
             }
         }
     }
 
     _mostraScorrimento() {
-        var classifica = this.gara.classifica;
-        var classifica_posizioni = this.gara.get_classifica_posizioni(classifica);
+        var classifica = this.stato.classifica;
+        var classifica_posizioni = this.stato.posizioni;
         this._mostraUnicaOScorrimento(classifica, classifica_posizioni, true, false);
     }
 
     _mostraUnicaOScorrimento(classifica, classifica_posizioni, reverse, mostra_punteggio_per_premio) {
+        var tabella = this.tabella;
         var length = classifica.length;
         for (var i in classifica) {
             var sq = classifica[reverse ? length - 1 - parseInt(i) : parseInt(i)].squadra;
             var riga = parseInt(i) + 1;
-            if (sq.ospite) $("#riga-" + riga).addClass("text-muted");
-            else $("#riga-" + riga).removeClass("text-muted");
-            $("#pos-" + riga).html(classifica_posizioni[sq.id - 1] + "° ");
-            $("#nome-" + riga).html(sq.nome);
-            $("#num-" + riga).html(sq.id);
+            tabella.classe("riga-" + riga, "text-muted", sq.ospite);
+            tabella.html("pos-" + riga, classifica_posizioni[sq.id - 1] + "° ");
+            tabella.html("nome-" + riga, sq.nome);
+            tabella.html("num-" + riga, "" + sq.id);
             if (!mostra_punteggio_per_premio) {
-                $("#punt-" + riga).html("" + sq.punteggio);
+                tabella.html("punt-" + riga, "" + sq.punteggio);
             }
             for (var j in sq.risposte) {
                 var r = sq.risposte[j];
+                var id = "cell-" + riga + "-" + j;
                 var text = "";
-                $("#cell-" + riga + "-" + j).removeClass("wrong-answer right-answer blink")
-
-                if (r.risolto) {
-                    $("#cell-" + riga + "-" + j).addClass("right-answer");
-                } else if (r.errori) {
-                    $("#cell-" + riga + "-" + j).addClass("wrong-answer");
-                }
+                tabella.classe(id, "right-answer", r.risolto > 0);
+                tabella.classe(id, "wrong-answer", !r.risolto && r.errori > 0);
+                tabella.classe(id, "blink", false);
                 if (r.risolto || r.errori) {
                     text += '<span class="punteggio_unica"><b>';
                     if (mostra_punteggio_per_premio) {
@@ -876,13 +1252,12 @@ class ClassificaClient {
                     text += ClassificaClient.stella_jolly;
                 }
 
-                $("#cell-" + riga + "-" + j).html(text);
+                tabella.html(id, text);
             }
-            if (sq.bonus_manuale + sq._en_plein_bonus != 0) $("#cell-" + riga + "-bonus").html("<span><b>" + (sq.bonus_manuale + sq._en_plein_bonus) + "</b></span>");
-            else $("#cell-" + riga + "-bonus").html("");
+            if (sq.bonus != 0) tabella.html("cell-" + riga + "-bonus", "<span><b>" + sq.bonus + "</b></span>");
+            else tabella.html("cell-" + riga + "-bonus", "");
 
-            if (this.following.includes(sq.id)) $("#riga-" + riga).addClass("following");
-            else $("#riga-" + riga).removeClass("following");
+            tabella.classe("riga-" + riga, "following", this.following.includes(sq.id));
         }
     }
 
@@ -917,3 +1292,11 @@ ClassificaClient.freccia_giu = `<span class="arrow-fa-stack">
 ClassificaClient.uguale = `<span class="arrow-fa-stack">
     <i class="fas fa-equals" style="color:#212529"></i>
 </span>`;
+
+if (typeof WorkerGlobalScope !== "undefined" && self instanceof WorkerGlobalScope) {
+    // Eseguito come Web Worker da ClassificaClient: tiene il modello della gara e risponde con le istantanee
+    var motore = new MotoreClassifica();
+    self.onmessage = function(e) {
+        self.postMessage(motore.ricevi(e.data));
+    };
+}
@@ -1,10 +1,19 @@
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
 from django.contrib.auth.models import Permission
-from django.utils import timezone
+from django.utils import timezone, dateparse
 from django.db.models import F
 from django.urls import reverse
+from django.core.serializers.json import DjangoJSONEncoder
 from django.test import Client, TestCase
-
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+import base64
+import gzip
+from io import StringIO
 import os
 import time as t
 import json
@@ -14,8 +23,12 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 import random
+from unittest import mock
 
-from engine.models import Gara, Squadra, Soluzione, Consegna, Jolly, User, Bonus
+from engine.models import Gara, Squadra, Soluzione, Evento, Consegna, Jolly, User, Bonus, ArchivioGara
+from engine.classifica import StatoGara, calcola_classifica, get_classifica_corrente
+from engine.views import StatusView, QueryView
+from engine.checks import controlla_long_polling
 # Create your tests here.
 
 
@@ -112,6 +125,8 @@ class LiveTests(StaticLiveServerTestCase, TuringTests):
 
     def setUp(self):
         super(LiveTests, self).setUp()
+        # Il database viene ripristinato tra un test e l'altro, la cache no
+        cache.clear()
         chrome_service = webdriver.ChromeService(executable_path="/usr/bin/chromedriver")
         chrome_options = webdriver.ChromeOptions()
         chrome_options.add_argument('--no-sandbox')
@@ -775,6 +790,8 @@ class HtmlTests(StaticLiveServerTestCase, TuringTests):
 
     def setUp(self):
         super(HtmlTests, self).setUp()
+        # Il database viene ripristinato tra un test e l'altro, la cache no
+        cache.clear()
         chrome_service = webdriver.ChromeService(executable_path="/usr/bin/chromedriver")
         chrome_options = webdriver.ChromeOptions()
         chrome_options.add_argument('--no-sandbox')
@@ -1112,9 +1129,14 @@ class HtmlTests(StaticLiveServerTestCase, TuringTests):
         self.assertGreaterEqual(
             (nuovo_orario_inizio - orario_inizio).total_seconds(), sleep_before_race_resume)
 
-        nuovo_orario_jolly = Jolly.objects.filter(gara=gara).first().orario
-        nuovo_orario_bonus = Bonus.objects.filter(gara=gara).first().orario
-        nuovo_orario_consegna = Consegna.objects.filter(gara=gara).first().orario
+        # Gli eventi mantengono l'orario di inserimento, mentre l'orario di gara tiene conto della sospensione
+        self.assertEqual(Jolly.objects.filter(gara=gara).first().orario, orario_jolly)
+        self.assertEqual(Bonus.objects.filter(gara=gara).first().orario, orario_bonus)
+        self.assertEqual(Consegna.objects.filter(gara=gara).first().orario, orario_consegna)
+        self.assertEqual(len(gara.get_sospensioni()), 1)
+        nuovo_orario_jolly = gara.get_orario_di_gara(orario_jolly)
+        nuovo_orario_bonus = gara.get_bonus()[0]["orario"]
+        nuovo_orario_consegna = gara.get_consegne()[0]["orario"]
 
         self.assertEqual(
             (nuovo_orario_jolly - orario_jolly).total_seconds(),
@@ -1170,6 +1192,8 @@ class HtmlTests(StaticLiveServerTestCase, TuringTests):
 class MyTestCase(TestCase):
     def setUp(self):
         super().setUp()
+        # Il database viene ripristinato tra un test e l'altro, la cache no
+        cache.clear()
         # Crea un utente di test
         self.user = User.objects.create_user('test', 't@e.st', 'test')
         self.c = Client()
@@ -1242,6 +1266,297 @@ class ValidationTests(MyTestCase, TuringTests):
         self.go_to_minute(-5)
         self.view_helper(200, 200, messages_post=[{"tag": "warning", "message": "Non puoi consegnare con un orario precedente all'inizio della gara"}])
 
+    def test_inserimento_query_costanti(self):
+        self.crea_gara(10, [1, 2, 3, 4, 5])
+        self.gara.inseritori.add(self.user)
+        self.url = reverse('engine:inserimento', kwargs={'pk': self.gara.pk})
+
+        def query_inserimento(data):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.c.post(self.url, data)
+            self.assertEqual(response.status_code, 302)
+            return len(queries)
+
+        def query_pagina():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.c.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        def query_inserimenti():
+            squadre = {s.num: s.pk for s in self.gara.squadre.all()}
+            return (
+                query_inserimento({'squadra': squadre[1], 'problema': 2, 'risposta': 2}),
+                query_inserimento({'squadra': squadre[2], 'problema': 3, 'jolly': True}),
+                query_inserimento({'squadra': squadre[3], 'risposta': 10, 'bonus': True}),
+                query_pagina(),
+            )
+
+        piccola = query_inserimenti()
+        for i in range(200):
+            self.consegna(i % 10 + 1, i % 5 + 1, i % 6)
+        Jolly.objects.filter(gara=self.gara).delete()
+        grande = query_inserimenti()
+        self.assertEqual(piccola, grande)
+        self.assertEqual(grande, (9, 10, 8, 11))
+
+    def test_query_eventi(self):
+        self.crea_gara(4, [1, 2, 3])
+        self.gara.admin = self.user
+        self.gara.save()
+        c1 = self.consegna(1, 1, 1)
+        c2 = self.consegna(2, 1, 5)
+        j = self.put_jolly(2, 2)
+        c3 = self.consegna(1, 2, 2)
+        b = self.put_bonus(3, 7)
+
+        def pk(problema=None, risposta=None, num_squadra=None, id_evento=None):
+            return [e.pk for e in self.gara.get_all_eventi(self.user, id_evento, num_squadra, problema, risposta)]
+
+        self.assertEqual(pk(), [b.pk, c3.pk, j.pk, c2.pk, c1.pk])
+        self.assertEqual(pk(num_squadra="1"), [c3.pk, c1.pk])
+        self.assertEqual(pk(num_squadra="2", problema="2"), [j.pk])
+        self.assertEqual(pk(problema="B"), [b.pk])
+        self.assertEqual(pk(risposta="J"), [j.pk])
+        self.assertEqual(pk(risposta="G"), [c3.pk, c1.pk])
+        self.assertEqual(pk(risposta="S"), [c2.pk])
+        self.assertEqual(pk(risposta="5"), [c2.pk])
+        self.assertEqual(pk(id_evento=str(j.pk)), [j.pk])
+        self.assertEqual([e.pk for e in self.gara.get_all_eventi(self.user, None, None, None, None, dopo=str(j.pk))], [c2.pk, c1.pk])
+        self.assertEqual(self.gara.get_all_eventi(self.user, None, None, None, None, dopo="x"), [])
+        self.assertEqual(self.gara.get_all_eventi(self.user, None, None, None, None, dopo=str(b.pk + 100)), [])
+        eventi = {e.pk: e for e in self.gara.get_all_eventi(self.user, None, None, None, None)}
+        self.assertEqual([eventi[x].giusta for x in (c1.pk, c2.pk, j.pk, b.pk)], [True, False, None, None])
+
+        # La pagina viene costruita con un numero di query che non dipende dal numero di eventi
+        url = reverse('engine:query', kwargs={'pk': self.gara.pk})
+        with mock.patch.object(QueryView, 'eventi_per_pagina', 2):
+            response = self.c.get(url)
+            self.assertEqual([e.pk for e in response.context['eventi']], [b.pk, c3.pk])
+            response = self.c.get(url + '?' + response.context['pagina_successiva'])
+            self.assertEqual([e.pk for e in response.context['eventi']], [j.pk, c2.pk])
+            response = self.c.get(url + '?' + response.context['pagina_successiva'])
+            self.assertEqual([e.pk for e in response.context['eventi']], [c1.pk])
+            self.assertIsNone(response.context['pagina_successiva'])
+            with CaptureQueriesContext(connection) as piccola:
+                self.c.get(url + '?num_squadra=1')
+            for i in range(20):
+                self.consegna(1, i % 3 + 1, i)
+            with CaptureQueriesContext(connection) as grande:
+                self.c.get(url + '?num_squadra=1')
+            self.assertEqual(len(piccola), len(grande))
+
+    def test_importazione_gara(self):
+        self.crea_gara(4, [1, 2, 3])
+        self.consegna(1, 1, 1)
+        self.put_jolly(2, 2)
+        self.consegna(2, 2, 5)
+        self.put_bonus(3, 7)
+        self.go_to_minute(30)
+        dati = json.loads(self.gara.dump_to_json())
+
+        def importa(dati):
+            with CaptureQueriesContext(connection) as queries:
+                gara = Gara.create_from_dict(dati)
+            return (gara, len(queries))
+
+        (gara, piccola) = importa(dati)
+        self.assertEqual(gara.to_dict(), dati)
+        self.assertEqual(list(gara.eventi.order_by('pk').values_list('subclass', flat=True)), ["Consegna", "Jolly", "Consegna", "Bonus"])
+        # Una riga dello storico per evento, con l'orario originale
+        for evento in gara.eventi.all():
+            storico = evento.as_child().history.all()
+            self.assertEqual([(h.history_type, h.orario) for h in storico], [("+", evento.orario)])
+
+        # Il numero di query non dipende dal numero di eventi (finché sono inseriti in un solo blocco)
+        dati['eventi'] = dati['eventi'] * 20
+        (gara, grande) = importa(dati)
+        self.assertEqual(gara.eventi.count(), 80)
+        self.assertEqual(piccola, grande)
+
+    def test_sospensioni(self):
+        self.crea_gara(3, [1, 2, 3], admin=self.user)
+        self.go_to_minute(10)
+        prima = self.consegna(1, 1, 1)
+        bonus = self.put_bonus(2, 5)
+        ora = timezone.now()
+        classifica_prima = calcola_classifica(self.gara, ora)
+        pausa = timedelta(minutes=7)
+        with mock.patch("django.utils.timezone.now", return_value=ora):
+            self.c.post(reverse('engine:gara-pause', kwargs={'pk': self.gara.pk}))
+        with mock.patch("django.utils.timezone.now", return_value=ora + pausa):
+            with CaptureQueriesContext(connection) as queries:
+                self.c.post(reverse('engine:gara-resume', kwargs={'pk': self.gara.pk}))
+        # La ripresa non riscrive gli eventi
+        self.assertFalse(any("engine_evento" in q["sql"] for q in queries.captured_queries if q["sql"].startswith("UPDATE")))
+
+        gara = Gara.objects.get(pk=self.gara.pk)
+        self.assertIsNone(gara.sospensione)
+        self.assertEqual(gara.inizio, self.gara.inizio + pausa)
+        self.assertEqual(gara.get_sospensioni(), [(ora, ora + pausa)])
+        prima.refresh_from_db()
+        self.assertEqual(gara.get_consegne()[0]["orario"], prima.orario + pausa)
+        self.assertEqual(gara.get_bonus()[0]["orario"], bonus.orario + pausa)
+        self.assertEqual(gara.to_dict()["eventi"][0]["orario"], (prima.orario + pausa).isoformat())
+
+        # Il tempo di gara trascorso non include la sospensione
+        classifica_dopo = calcola_classifica(gara, ora + pausa)
+        self.assertEqual(classifica_dopo["squadre"], classifica_prima["squadre"])
+        self.assertEqual(classifica_dopo["problemi"], classifica_prima["problemi"])
+        dopo = Consegna(gara=gara, squadra=gara.squadre.get(num=3), problema=2, risposta=2, orario=ora + pausa + timedelta(minutes=1))
+        dopo.save()
+        self.assertEqual(gara.get_consegne()[-1]["orario"], dopo.orario)
+        self.assertEqual(gara.get_eventi_successivi(bonus.pk)["consegne"][0]["orario"], dopo.orario)
+
+        # L'esportazione riporta gli orari di gara, quindi la gara importata non ha sospensioni
+        importata = Gara.create_from_dict(gara.to_dict())
+        self.assertEqual(importata.get_sospensioni(), [])
+        self.assertEqual([c["orario"] for c in importata.get_consegne()], [c["orario"] for c in gara.get_consegne()])
+
+    def test_orario_esplicito(self):
+        self.crea_gara(2, [1, 2])
+        squadra = self.gara.squadre.get(num=1)
+        orario = self.gara.inizio + timedelta(minutes=3)
+        with CaptureQueriesContext(connection) as queries:
+            consegna = Consegna(gara=self.gara, squadra=squadra, problema=1, risposta=1, orario=orario)
+            consegna.save()
+        self.assertEqual(len([q for q in queries.captured_queries if q["sql"].startswith("INSERT")]), 3)
+        consegna.refresh_from_db()
+        self.assertEqual(consegna.orario, orario)
+        self.assertEqual([h.orario for h in consegna.history.all()], [orario])
+        # Senza un orario esplicito viene usato quello dell'inserimento
+        prima = timezone.now()
+        jolly = self.put_jolly(1, 2)
+        self.assertTrue(prima <= jolly.orario <= timezone.now())
+
+    def test_eventi_dict(self):
+        self.crea_gara(4, [1, 2, 3])
+        self.consegna(1, 1, 1)
+        self.put_jolly(2, 2)
+        self.consegna(2, 2, 5)
+        self.consegna(2, 2, 7)
+        self.put_bonus(3, 7)
+        self.put_bonus(3, -2)
+        # Eventi con la stessa chiave di ordinamento
+        self.gara.eventi.update(orario=self.gara.inizio)
+
+        atteso = list(sorted([e.to_dict() for e in self.gara.eventi.all()], key=lambda e: (
+            e["orario"], e["subclass"], e["squadra_id"], e["problema"] if "problema" in e else None)))
+        with self.assertNumQueries(1):
+            eventi = self.gara.get_eventi_dict()
+        self.assertEqual(json.dumps(eventi), json.dumps(atteso))
+
+    def test_elenco_gare(self):
+        self.crea_gara(2, [1, 2])
+        url = reverse('engine:index')
+
+        def elenchi():
+            response = self.c.get(url)
+            return [[g.pk for g in response.context[k]] for k in ("gare_attive", "gare_archivio", "gare_da_iniziare")]
+
+        self.assertEqual(elenchi(), [[self.gara.pk], [], []])
+        # L'elenco in cache non richiede query, ma la suddivisione dipende dall'orario
+        with CaptureQueriesContext(connection) as queries:
+            self.c.get(url)
+        self.assertFalse(any("engine_gara" in q["sql"] for q in queries.captured_queries))
+        with mock.patch("django.utils.timezone.now", return_value=timezone.now() + timedelta(days=1)):
+            self.assertEqual(elenchi(), [[], [self.gara.pk], []])
+        # La cache viene invalidata quando una gara viene creata, modificata o eliminata
+        futura = Gara.objects.create(nome="Futura")
+        self.assertEqual(elenchi(), [[self.gara.pk], [], [futura.pk]])
+        self.gara.sospensione = timezone.now()
+        self.gara.save()
+        with mock.patch("django.utils.timezone.now", return_value=timezone.now() + timedelta(days=1)):
+            self.assertEqual(elenchi(), [[self.gara.pk], [], [futura.pk]])
+        futura.delete()
+        self.assertEqual(elenchi(), [[self.gara.pk], [], []])
+
+        # Le pagine che non mostrano l'elenco non leggono le gare
+        self.gara.inseritori.add(self.user)
+        url_inserimento = reverse('engine:inserimento', kwargs={'pk': self.gara.pk})
+        cache.clear()
+        self.c.get(url_inserimento)
+        self.assertIsNone(cache.get("engine:gare"))
+
+    def test_download_gara(self):
+        self.crea_gara(4, [1, 2, 3])
+        for i in range(7):
+            self.consegna(i % 4 + 1, i % 3 + 1, i)
+        self.put_jolly(2, 2)
+        self.put_bonus(3, 7)
+        atteso = self.gara.dump_to_json()
+        for chunk_size in (1, 3, 9, 500):
+            self.assertEqual("".join(self.gara.dump_to_json_chunks(chunk_size=chunk_size)), atteso)
+
+        url = reverse('engine:gara-download', kwargs={'pk': self.gara.pk})
+        response = self.c.get(url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b"".join(response.streaming_content).decode(), atteso)
+        response = self.c.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)).decode(), atteso)
+
+        self.gara.eventi.all().delete()
+        self.assertEqual("".join(self.gara.dump_to_json_chunks()), self.gara.dump_to_json())
+
+    def test_archiviazione(self):
+        self.crea_gara(4, [1, 2, 3], admin=self.user)
+        for i in range(7):
+            self.consegna(i % 4 + 1, i % 3 + 1, i)
+        self.put_jolly(2, 2)
+        self.put_bonus(3, 7)
+        self.go_to_minute(130)
+        in_corso = Gara.objects.get(pk=self.gara.pk)
+        self.crea_gara(2, [1])
+        self.consegna(1, 1, 1)
+        gara_in_corso, self.gara = self.gara, in_corso
+
+        status = reverse('engine:status', kwargs={'pk': self.gara.pk})
+        primo = self.gara.eventi.order_by('pk').first().pk
+        atteso = {
+            'json': self.gara.dump_to_json(),
+            'status': self.c.get(status).json(),
+            'incrementale': self.gara.get_eventi_successivi(primo),
+            'classifica': calcola_classifica(self.gara)["squadre"],
+        }
+        storico = self.gara.eventi.count()
+
+        out = StringIO()
+        call_command("archivia_gare", "--giorni", "0", stdout=out)
+        self.assertIn("9 events archived", out.getvalue())
+        self.assertFalse(Gara.objects.get(pk=gara_in_corso.pk).archiviata)
+        self.assertTrue(gara_in_corso.eventi.exists())
+
+        gara = Gara.objects.get(pk=self.gara.pk)
+        self.assertTrue(gara.archiviata)
+        self.assertFalse(Evento.objects.filter(gara=gara).exists())
+        for modello in (Evento, Consegna, Jolly, Bonus):
+            self.assertFalse(modello.history.filter(gara=gara).exists())
+        self.assertEqual(sum(len(righe) for righe in gara.archivio.get_storico().values()), storico)
+
+        # La gara archiviata resta consultabile come prima
+        self.assertEqual(gara.dump_to_json(), atteso['json'])
+        self.assertEqual("".join(gara.dump_to_json_chunks(chunk_size=2)), atteso['json'])
+        response = self.c.get(reverse('engine:gara-download', kwargs={'pk': gara.pk}))
+        self.assertEqual(b"".join(response.streaming_content).decode(), atteso['json'])
+        dati = self.c.get(status).json()
+        for k in ('consegne', 'jolly', 'bonus', 'last_evento_id'):
+            self.assertEqual(dati[k], atteso['status'][k])
+        self.assertEqual(gara.get_eventi_successivi(primo), atteso['incrementale'])
+        self.assertEqual(calcola_classifica(gara)["squadre"], atteso['classifica'])
+
+        # Non si possono aggiungere eventi, né archiviarla di nuovo
+        consegna = Consegna(gara=gara, squadra=gara.squadre.get(num=1), problema=1, risposta=1, creatore=self.user)
+        self.assertEqual(consegna.maybe_save(), (False, "Gara archiviata"))
+        with self.assertRaises(CommandError):
+            call_command("archivia_gare", str(gara.pk), stdout=out)
+
+        # Il reset elimina anche l'archivio
+        self.c.post(reverse('engine:gara-reset', kwargs={'pk': gara.pk}))
+        gara = Gara.objects.get(pk=gara.pk)
+        self.assertFalse(gara.archiviata)
+        self.assertFalse(ArchivioGara.objects.filter(gara=gara).exists())
+
     def test_inserimento_durante_sospensione_gara(self):
         self.crea_gara(5, [0,0,0])
         self.url = reverse('engine:inserimento', kwargs={'pk': self.gara.pk})
@@ -1441,6 +1756,18 @@ class PermissionTests(MyTestCase, TuringTests):
         self.view_helper(403, 403)
         self.assertEqual(gara.nome, 'GaraTest')
 
+    def test_benchmark_classifica_permission(self):
+        self.crea_gara(2, [0, 0, 0])
+        self.url = reverse('engine:classifica-benchmark', kwargs={'pk': self.gara.pk})
+        self.gara.inseritori.add(self.user)
+        self.view_helper(403)
+
+        self.gara.admin = self.user
+        self.gara.save()
+        response = self.view_helper(200)
+        self.assertContains(response, reverse('engine:status-timeline', kwargs={'pk': self.gara.pk}))
+        self.assertEqual(self.c.get(self.url, {'ripetizioni': '2'}).context['ripetizioni'], 2)
+
     def test_reset_gara(self):
         self.crea_gara(2, [0, 0, 0])
         gara = self.gara
@@ -1679,6 +2006,48 @@ class PermissionTests(MyTestCase, TuringTests):
         self.assertTrue(self.gara.eventi.exists())
         self.assertEqual(self.gara.get_jolly(), [{'id': 1, 'squadra': 1, 'problema': 2}])
 
+    def test_permessi_una_query(self):
+        self.crea_gara(5, [0,0,0])
+        s1 = self.gara.squadre.get(num=1)
+        s1.consegnatore = self.user
+        s1.save()
+
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(user.can_insert_gara(self.gara))
+            self.assertTrue(user.is_consegnatore(self.gara))
+            self.assertFalse(user.is_inseritore(self.gara))
+            self.assertFalse(user.can_administrate(self.gara))
+            self.assertTrue(user.can_insert_squadra(s1))
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.gara.get_squadre_inseribili(user)), [s1])
+
+        # Il ruolo è memorizzato sull'istanza dell'utente, e viene riletto se cambia attraverso questa istanza
+        with self.assertNumQueries(0):
+            self.assertTrue(user.is_consegnatore(self.gara))
+        user.gara_set.add(self.gara)
+        self.assertTrue(user.is_inseritore(self.gara))
+        user.gara_set.remove(self.gara)
+        self.assertFalse(user.is_inseritore(self.gara))
+        user.gara_set.add(self.gara)
+        self.assertTrue(user.is_inseritore(self.gara))
+        user.gara_set.clear()
+        self.assertFalse(user.is_inseritore(self.gara))
+
+        u2 = User.objects.get(pk=User.objects.create_user('test2', 't2@e.st', 'test2').pk)
+        self.assertFalse(u2.is_consegnatore(self.gara))
+        s2 = self.gara.squadre.get(num=2)
+        s2.consegnatore = u2
+        s2.save()
+        self.assertTrue(u2.is_consegnatore(self.gara))
+        self.assertTrue(u2.can_insert_squadra(s2))
+        s2.delete()
+        self.assertFalse(u2.is_consegnatore(self.gara))
+
+        # Un'altra istanza dello stesso utente, come quella di una richiesta successiva, legge il ruolo aggiornato
+        self.gara.inseritori.add(self.user)
+        self.assertTrue(User.objects.get(pk=self.user.pk).is_inseritore(self.gara))
+
     def test_filtered_eventi(self):
         self.crea_gara(5, [0,0,0])
         self.url = reverse('engine:inserimento', kwargs={'pk': self.gara.pk})
@@ -1814,3 +2183,458 @@ class PermissionTests(MyTestCase, TuringTests):
         # cannot compare IDs reliably with postgres
         jolly[0]['id'] = -1
         self.assertEqual(jolly, [{'id': -1, 'squadra': 1, 'problema': 1}])
+
+
+class ClassificaTests(MyTestCase, TuringTests):
+    '''Esegue dei test sul calcolo della classifica lato server'''
+
+    def punti_squadre(self, orario=None):
+        res = calcola_classifica(self.gara, orario)
+        return {s["num"]: s["punteggio"] for s in res["squadre"]}
+
+    def punti_problemi(self, orario=None):
+        res = calcola_classifica(self.gara, orario)
+        return {p["problema"]: (p["base"], p["bonus"]) for p in res["problemi"]}
+
+    def test_initial_score(self):
+        self.crea_gara(5, [0, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(self.punti_squadre()[1], 70)
+
+    def test_gara_non_iniziata(self):
+        self.crea_gara(5, [0, 0, 0], iniziata=False)
+        self.assertEqual(self.punti_squadre(), {i: 30 for i in range(1, 6)})
+        self.assertEqual(self.punti_problemi(), {i: (20, 20) for i in range(1, 4)})
+
+    def test_derivata(self):
+        self.crea_gara(5, [42, 9999, 0, 0, 0])
+        self.consegna(1, 2, 9999)
+        self.assertEqual(self.punti_squadre()[1], 90)
+
+        self.go_to_minute(30)
+        self.assertEqual(self.punti_squadre()[1], 120)
+
+    def test_n_blocco(self):
+        self.crea_gara(5, [0, 0, 0])
+        self.consegna(1, 1, 0)
+        self.go_to_minute(30)
+        self.assertEqual(self.punti_problemi()[1], (50, 15))
+
+        self.consegna(2, 1, 0)
+        self.go_to_minute(60)
+        self.assertEqual(self.punti_problemi()[1], (50, 10))
+
+    def test_k_blocco(self):
+        self.crea_gara(5, [42, 9999, 0, 0, 0])
+        for i in range(6):
+            self.consegna(2, 2, 76)
+        self.consegna(1, 2, 9999)
+        punti = self.punti_squadre()
+        self.assertEqual(punti[2], -10)
+        self.assertEqual(punti[1], 100)
+
+    def test_en_plein(self):
+        self.crea_gara(20, [0, 0, 0, 0, 0])
+        for i in range(5):
+            self.consegna(1, i+1, 0)
+            self.consegna(2, i+1, 0)
+        punti = self.punti_squadre()
+        self.assertEqual(punti[1], 50 + 40*5 + 100)
+        self.assertEqual(punti[2], 50 + 35*5 + 60)
+
+    def test_jolly_e_bonus(self):
+        self.crea_gara(3, [0, 0, 0])
+        self.put_jolly(1, 2)
+        self.consegna(1, 2, 0)
+        self.consegna(2, 2, 0)
+        self.put_bonus(3, 15)
+        self.go_to_minute(15)
+        res = calcola_classifica(self.gara)
+        squadre = {s["num"]: s for s in res["squadre"]}
+        self.assertEqual(squadre[1]["punteggio"], 30 + 2*(20 + 20))
+        self.assertTrue(squadre[1]["risposte"][2]["jolly"])
+        self.assertEqual(squadre[2]["punteggio"], 30 + 20 + 15)
+        self.assertTrue(squadre[2]["risposte"][1]["jolly"])
+        self.assertEqual(squadre[3]["punteggio"], 30 + 15)
+        self.assertEqual(squadre[3]["bonus"], 15)
+        self.assertEqual([s["num"] for s in res["squadre"]], [1, 2, 3])
+        self.assertEqual([s["posizione"] for s in res["squadre"]], [1, 2, 3])
+
+    def test_spareggio(self):
+        self.crea_gara(3, [1, 2], jolly=False)
+        # Stesso punteggio totale: la squadra 2 ha il miglior punteggio su un singolo problema (-10 contro -20),
+        # anche se in ordine lessicografico "-20" verrebbe prima di "-10"
+        for (squadra, errori) in ((1, (2, 3)), (2, (1, 4))):
+            for (problema, n) in enumerate(errori, start=1):
+                for _ in range(n):
+                    self.consegna(squadra, problema, 0)
+        res = calcola_classifica(self.gara)
+        self.assertEqual([s["punteggio"] for s in res["squadre"]], [20, -30, -30])
+        self.assertEqual([s["num"] for s in res["squadre"]], [3, 2, 1])
+
+    def test_avanti_e_indietro(self):
+        self.crea_gara(5, [0, 0, 0])
+        self.consegna(1, 1, 0)
+        self.go_to_minute(30)
+        self.consegna(2, 1, 1)
+        self.go_to_minute(60)
+        stato = StatoGara.from_gara(self.gara)
+        stato.time = self.gara.inizio + timedelta(minutes=45)
+        dopo = stato.to_dict()
+        stato.time = self.gara.inizio + timedelta(minutes=10)
+        prima = stato.to_dict()
+        stato.time = self.gara.inizio + timedelta(minutes=45)
+        self.assertEqual(stato.to_dict(), dopo)
+        self.assertEqual(prima, calcola_classifica(self.gara, self.gara.inizio + timedelta(minutes=10)))
+        self.assertEqual(dopo, calcola_classifica(self.gara, self.gara.inizio + timedelta(minutes=45)))
+
+    def check_classifica_corrente(self):
+        '''Controlla che la classifica in cache coincida con quella ricalcolata da zero'''
+        corrente = get_classifica_corrente(self.gara)
+        self.assertEqual(corrente["squadre"], calcola_classifica(self.gara, corrente["orario"])["squadre"])
+        return corrente
+
+    def test_classifica_in_cache(self):
+        self.crea_gara(5, [0, 0, 0], num_ospiti=1)
+        self.check_classifica_corrente()
+
+        # Nuovi eventi: aggiornamento incrementale
+        self.consegna(1, 1, 0)
+        c = self.consegna(2, 1, 1)
+        j = self.put_jolly(3, 2)
+        self.consegna(3, 2, 0)
+        b = self.put_bonus(4, 10)
+        self.consegna(6, 3, 0)
+        self.check_classifica_corrente()
+
+        # Modifiche ed eliminazioni: ricalcolo completo
+        self.modifica(c, risposta=0)
+        self.check_classifica_corrente()
+        self.elimina(j)
+        self.check_classifica_corrente()
+        self.elimina(b)
+        self.check_classifica_corrente()
+        squadra = self.gara.squadre.get(num=6)
+        squadra.ospite = False
+        squadra.save()
+        self.check_classifica_corrente()
+        self.go_to_minute(30)
+        self.check_classifica_corrente()
+
+    def test_classifica_in_cache_commit_fuori_ordine(self):
+        self.crea_gara(5, [0, 0, 0])
+        with self.captureOnCommitCallbacks(execute=True):
+            c = self.consegna(1, 1, 0)
+        squadra = self.gara.squadre.get(num=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            Consegna(id=c.pk + 10, problema=1, squadra=squadra, risposta=0, gara=self.gara, creatore=self.user).save()
+        self.check_classifica_corrente()
+
+        # Una consegna con identificativo minore dell'ultimo processato, confermata dopo
+        with self.captureOnCommitCallbacks(execute=True):
+            Consegna(id=c.pk + 5, problema=2, squadra=squadra, risposta=0, gara=self.gara, creatore=self.user).save()
+        self.assertEqual(get_classifica_corrente(self.gara)["squadre"][0]["num"], 2)
+        self.check_classifica_corrente()
+
+        # Un evento confermato mentre un altro processo aggiorna lo stato: l'aggiornamento viene saltato,
+        # ma l'evento viene aggiunto alla richiesta successiva
+        cache.add("engine:classifica:lock:{}".format(self.gara.pk), True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.consegna(3, 3, 0)
+        cache.delete("engine:classifica:lock:{}".format(self.gara.pk))
+        self.check_classifica_corrente()
+
+    def test_status_classifica(self):
+        self.crea_gara(5, [0, 0, 0])
+        self.consegna(2, 1, 0)
+        response = self.c.get(reverse('engine:status-classifica', kwargs={'pk': self.gara.pk}))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([s["num"] for s in data["squadre"]], [2, 1, 3, 4, 5])
+        self.assertEqual(data["squadre"][0]["punteggio"], 30 + 20 + 20)
+
+    def test_timeline(self):
+        self.crea_gara(4, [1, 2, 3])
+        self.consegna(3, 1, 1)
+        self.consegna(2, 2, 0)
+        self.put_bonus(4, 100)
+        self.consegna(4, 3, 3)
+        self.consegna(1, 3, 3)
+
+        timeline = self.c.get(reverse('engine:status-timeline', kwargs={'pk': self.gara.pk})).json()
+        consegne = self.gara.get_consegne()
+        self.assertEqual(timeline['consegne'], [c['id'] for c in consegne])
+        for (i, c) in enumerate(consegne):
+            res = calcola_classifica(self.gara, c['orario'])
+            self.assertEqual(timeline['posizioni'][i], [s['posizione'] for s in sorted(res['squadre'], key=lambda s: s['num'])])
+            self.assertEqual(timeline['punteggi'][i], [s['punteggio'] for s in sorted(res['squadre'], key=lambda s: s['num'])])
+        self.assertEqual(timeline['posizioni'][0], [2, 3, 1, 4])
+        self.assertEqual(timeline['posizioni'][-1][3], 1)
+
+    def test_timeline_bonus_tra_consegne(self):
+        self.crea_gara(3, [0, 0, 0])
+
+        def evento(classe, minuto, squadra, **kwargs):
+            orario = self.gara.inizio + timedelta(minutes=minuto)
+            classe(gara=self.gara, squadra=self.gara.squadre.get(num=squadra), orario=orario, creatore=self.user, **kwargs).save()
+
+        evento(Consegna, 1, 1, problema=1, risposta=0)
+        evento(Bonus, 2, 2, punteggio=100)
+        evento(Consegna, 3, 3, problema=1, risposta=0)
+        # Stesso orario della consegna precedente, ma identificativo maggiore: viene processato dopo di essa
+        evento(Bonus, 3, 3, punteggio=200)
+        evento(Consegna, 4, 1, problema=2, risposta=0)
+
+        timeline = self.c.get(reverse('engine:status-timeline', kwargs={'pk': self.gara.pk})).json()
+        self.assertEqual([p[1] for p in timeline['punteggi']], [30, 130, 130])
+        self.assertEqual(timeline['posizioni'][1], [2, 1, 3])
+        self.assertEqual(timeline['punteggi'][1][2], timeline['punteggi'][2][2] - 200)
+        self.assertEqual(timeline['posizioni'][2][2], 1)
+
+    def test_timeline_in_cache(self):
+        self.crea_gara(3, [0, 0, 0])
+        url = reverse('engine:status-timeline', kwargs={'pk': self.gara.pk})
+        self.consegna(1, 1, 0)
+        self.assertEqual(len(self.c.get(url).json()['consegne']), 1)
+
+        # La timeline viene ricalcolata anche se la modifica è stata salvata da un processo che non condivide
+        # la cache, e quindi il token di notifica non cambia
+        with mock.patch('engine.signals.notifica_modifica'):
+            self.consegna(2, 1, 0)
+            self.assertEqual(len(self.c.get(url).json()['consegne']), 2)
+            Consegna.objects.filter(gara=self.gara).last().delete()
+            self.assertEqual(len(self.c.get(url).json()['consegne']), 1)
+
+
+class StatusTests(MyTestCase, TuringTests):
+    '''Esegue dei test sui dati restituiti per l'aggiornamento delle classifiche'''
+
+    def test_eventi_successivi(self):
+        self.crea_gara(5, [0, 0, 0], num_ospiti=1)
+        c1 = self.consegna(1, 1, 0)
+        self.put_jolly(2, 2)
+        b = self.put_bonus(3, 10)
+        self.consegna(6, 3, 1)
+
+        with self.assertNumQueries(1):
+            res = self.gara.get_eventi_successivi(0)
+        self.assertEqual(res['consegne'], self.gara.get_consegne())
+        self.assertEqual(res['jolly'], self.gara.get_jolly())
+        self.assertEqual(res['bonus'], self.gara.get_bonus())
+        self.assertEqual(res['last_evento_id'], self.gara.eventi.order_by('-pk')[0].pk)
+
+        res = self.gara.get_eventi_successivi(b.pk)
+        self.assertEqual(res['consegne'], self.gara.get_consegne(b.pk))
+        self.assertNotIn('jolly', res)
+        self.assertNotIn('bonus', res)
+
+        res = self.gara.get_eventi_successivi(res['last_evento_id'])
+        self.assertEqual(res, {'last_evento_id': res['last_evento_id']})
+
+    def test_consegne_una_query(self):
+        self.crea_gara(5, [3, 0, 7])
+        self.consegna(1, 1, 3)
+        self.consegna(2, 1, 4)
+        self.consegna(3, 3, 7)
+        self.consegna(3, 2, 1)
+
+        with self.assertNumQueries(1):
+            res = self.gara.get_consegne()
+        self.assertEqual([c['giusta'] for c in res], [True, False, True, False])
+        self.assertEqual([c['squadra'] for c in res], [1, 2, 3, 3])
+
+    def test_status_incrementale(self):
+        self.crea_gara(5, [0, 0, 0])
+        self.consegna(1, 1, 0)
+        url = reverse('engine:status', kwargs={'pk': self.gara.pk})
+        data = self.c.get(url).json()
+        self.assertEqual(len(data['consegne']), 1)
+        last_evento_id = data['last_evento_id']
+
+        data = self.c.get(url, {'last_evento_id': last_evento_id}).json()
+        self.assertEqual(set(data.keys()), {'last_update', 'notifica', 'last_evento_id', 'num_eventi'})
+        self.assertEqual(data['last_evento_id'], last_evento_id)
+        self.assertEqual(data['num_eventi'], 1)
+
+        self.put_jolly(2, 3)
+        self.consegna(2, 3, 1)
+        # Gara con il numero di eventi, ed eventi successivi al cursore
+        with self.assertNumQueries(2):
+            Client().get(url, {'last_evento_id': last_evento_id})
+        data = self.c.get(url, {'last_evento_id': last_evento_id}).json()
+        self.assertEqual(set(data.keys()), {'last_update', 'notifica', 'last_evento_id', 'num_eventi', 'consegne', 'jolly'})
+        self.assertFalse(data['consegne'][0]['giusta'])
+        self.assertGreater(data['last_evento_id'], last_evento_id)
+        self.assertEqual(data['num_eventi'], 3)
+
+        for valore in ['', 'abc', '1.5']:
+            response = self.c.get(url, {'last_evento_id': valore})
+            self.assertEqual(response.status_code, 400)
+
+    def test_status_incrementale_commit_fuori_ordine(self):
+        self.crea_gara(5, [0, 0, 0])
+        c = self.consegna(1, 1, 0)
+        url = reverse('engine:status', kwargs={'pk': self.gara.pk})
+        data = self.c.get(url).json()
+        ricevuti = len(data['consegne'])
+
+        # Una consegna con identificativo minore del cursore, confermata dopo: il cursore non la restituisce,
+        # ma il numero di eventi segnala al client che ne manca una
+        squadra = self.gara.squadre.get(num=2)
+        Consegna(id=c.pk + 10, problema=1, squadra=squadra, risposta=0, gara=self.gara, creatore=self.user).save()
+        data = self.c.get(url, {'last_evento_id': data['last_evento_id']}).json()
+        ricevuti += len(data['consegne'])
+        self.assertEqual(data['num_eventi'], ricevuti)
+        Consegna(id=c.pk + 5, problema=2, squadra=squadra, risposta=0, gara=self.gara, creatore=self.user).save()
+        data = self.c.get(url, {'last_evento_id': data['last_evento_id']}).json()
+        self.assertNotIn('consegne', data)
+        self.assertGreater(data['num_eventi'], ricevuti)
+
+    def test_status_snapshot(self):
+        self.crea_gara(5, [0, 0, 0])
+        squadra = Squadra.objects.get(gara=self.gara, num=2)
+        squadra.consegnatore = self.user
+        squadra.save()
+        self.consegna(1, 1, 0)
+        url = reverse('engine:status', kwargs={'pk': self.gara.pk})
+        anonimo = Client()
+
+        data = anonimo.get(url).json()
+        self.assertEqual(data['consegnatore_per'], [])
+        self.assertEqual(len(data['consegne']), 1)
+
+        # Lo snapshot è condiviso: per gli utenti anonimi basta leggere la versione dei dati insieme alla gara,
+        # mentre per il consegnatore servono anche sessione, utente e squadre di cui è consegnatore
+        with self.assertNumQueries(1):
+            self.assertEqual(anonimo.get(url).json(), data)
+        with self.assertNumQueries(4):
+            data_consegnatore = self.c.get(url).json()
+        self.assertEqual(data_consegnatore['consegnatore_per'], [2])
+        self.assertEqual({**data_consegnatore, 'consegnatore_per': []}, data)
+
+        # Un nuovo evento invalida lo snapshot
+        self.consegna(2, 1, 0)
+        data = anonimo.get(url).json()
+        self.assertEqual(len(data['consegne']), 2)
+        self.assertNotEqual(data['notifica'], data_consegnatore['notifica'])
+
+        # Anche se la modifica è stata salvata da un processo che non condivide la cache, e quindi il token
+        # di notifica non cambia, lo snapshot viene ricostruito
+        with mock.patch('engine.signals.notifica_modifica'):
+            self.consegna(3, 1, 0)
+            self.assertEqual(len(anonimo.get(url).json()['consegne']), 3)
+            Squadra.objects.filter(gara=self.gara, num=3).update(nome="Rinominata")
+            Gara.segna_modifica(self.gara.pk)
+            self.assertEqual(anonimo.get(url).json()['squadre']['3']['nome'], "Rinominata")
+
+    def test_status_colonne(self):
+        self.crea_gara(5, [1, 2, 3])
+        for i in range(10):
+            self.consegna(i % 5 + 1, i % 3 + 1, i % 4)
+        self.put_jolly(2, 3)
+        self.put_bonus(3, -10)
+        url = reverse('engine:status', kwargs={'pk': self.gara.pk})
+        liste = self.c.get(url).json()
+        colonne = self.c.get(url, {'formato': 'colonne'}).json()
+        self.assertEqual({k: v for (k, v) in colonne.items() if k not in ('consegne', 'jolly', 'bonus')},
+                         {k: v for (k, v) in liste.items() if k not in ('consegne', 'jolly', 'bonus')})
+
+        inizio = dateparse.parse_datetime(liste['inizio'])
+        giuste = base64.b64decode(colonne['consegne']['giusta'])
+        consegne = [{
+            'id': colonne['consegne']['id'][i],
+            'squadra': colonne['consegne']['squadra'][i],
+            'problema': colonne['consegne']['problema'][i],
+            'orario': inizio + timedelta(milliseconds=colonne['consegne']['orario'][i]),
+            'giusta': bool(giuste[i // 8] >> (i % 8) & 1),
+        } for i in range(len(colonne['consegne']['id']))]
+        self.assertEqual(consegne, [{
+            'id': c['id'], 'squadra': c['squadra'], 'problema': c['problema'],
+            'orario': dateparse.parse_datetime(c['orario']), 'giusta': c['giusta']} for c in liste['consegne']])
+        self.assertEqual(colonne['jolly'], {'id': [liste['jolly'][0]['id']], 'squadra': [2], 'problema': [3]})
+        self.assertEqual(colonne['bonus']['punteggio'], [-10])
+        self.assertEqual(inizio + timedelta(milliseconds=colonne['bonus']['orario'][0]), dateparse.parse_datetime(liste['bonus'][0]['orario']))
+
+        # Aggiornamento incrementale
+        self.consegna(1, 1, 1)
+        data = self.c.get(url, {'formato': 'colonne', 'last_evento_id': colonne['last_evento_id']}).json()
+        self.assertEqual(data['consegne']['squadra'], [1])
+        self.assertEqual(base64.b64decode(data['consegne']['giusta']), b'\x01')
+        self.assertNotIn('jolly', data)
+
+    def test_status_in_attesa(self):
+        self.crea_gara(5, [0, 0, 0])
+        url = reverse('engine:status', kwargs={'pk': self.gara.pk})
+        data = self.c.get(url).json()
+        last_evento_id, notifica = data['last_evento_id'], data['notifica']
+
+        # Senza long polling la risposta è immediata, e indica quanto attendere prima della richiesta successiva
+        inizio = t.monotonic()
+        data = self.c.get(url, {'last_evento_id': last_evento_id, 'notifica': notifica}).json()
+        self.assertLess(t.monotonic() - inizio, 0.5)
+        self.assertEqual(data['attesa'], StatusView.intervallo_aggiornamento)
+        self.assertEqual(data['notifica'], notifica)
+
+        # Senza modifiche la richiesta viene trattenuta fino alla scadenza dell'attesa
+        with mock.patch.object(StatusView, 'long_polling', True), mock.patch.object(StatusView, 'attesa_massima', 0.5):
+            inizio = t.monotonic()
+            data = self.c.get(url, {'last_evento_id': last_evento_id, 'notifica': notifica}).json()
+            self.assertGreaterEqual(t.monotonic() - inizio, 0.5)
+        self.assertEqual(data['notifica'], notifica)
+        self.assertEqual(data['attesa'], 0)
+        self.assertNotIn('consegne', data)
+
+        # Un inserimento cambia il token, e la richiesta successiva riceve subito il nuovo evento
+        self.consegna(1, 1, 0)
+        with mock.patch.object(StatusView, 'long_polling', True), mock.patch.object(StatusView, 'attesa_massima', 60):
+            inizio = t.monotonic()
+            data = self.c.get(url, {'last_evento_id': last_evento_id, 'notifica': notifica}).json()
+            self.assertLess(t.monotonic() - inizio, 30)
+        self.assertNotEqual(data['notifica'], notifica)
+        self.assertEqual(len(data['consegne']), 1)
+
+        # Anche le modifiche sostanziali cambiano il token
+        notifica = data['notifica']
+        self.gara.save()
+        data = self.c.get(url, {'last_evento_id': data['last_evento_id'], 'notifica': notifica}).json()
+        self.assertNotEqual(data['notifica'], notifica)
+        self.assertEqual(data['last_update'], DjangoJSONEncoder().default(self.gara.get_last_update()))
+
+    def test_long_polling_cache_locale(self):
+        with self.settings(LONG_POLLING=True):
+            self.assertEqual([w.id for w in controlla_long_polling(None)], ["engine.W001"])
+        with self.settings(LONG_POLLING=True, CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp'}}):
+            self.assertEqual(controlla_long_polling(None), [])
+        with self.settings(LONG_POLLING=False):
+            self.assertEqual(controlla_long_polling(None), [])
+
+    def test_last_update(self):
+        self.crea_gara(5, [0, 0, 0])
+        lu = self.gara.get_last_update()
+
+        # Gli inserimenti vengono trasmessi in modo incrementale e non sono modifiche sostanziali
+        c = self.consegna(1, 1, 0)
+        self.put_jolly(2, 2)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.gara.get_last_update(), lu)
+
+        self.modifica(c, risposta=1)
+        self.assertGreater(self.gara.get_last_update(), lu)
+        lu = self.gara.get_last_update()
+
+        self.elimina(c)
+        self.assertGreater(self.gara.get_last_update(), lu)
+        lu = self.gara.get_last_update()
+
+        sol = self.gara.soluzioni.get(problema=2)
+        sol.risposta = 42
+        sol.save()
+        self.assertGreater(self.gara.get_last_update(), lu)
+        lu = self.gara.get_last_update()
+
+        Squadra.objects.get(gara=self.gara, num=5).delete()
+        self.assertGreater(self.gara.get_last_update(), lu)
+        lu = self.gara.get_last_update()
+
+        url = reverse('engine:status', kwargs={'pk': self.gara.pk})
+        data = self.c.get(url).json()
+        self.assertEqual(data['last_update'], DjangoJSONEncoder().default(lu))
@@ -26,11 +26,14 @@ urlpatterns = [
     path('evento/<int:pk>/modifica', ModificaEventoView.as_view(), name='evento-modifica'),
     path('evento/<int:pk>/elimina', EliminaEventoView.as_view(), name='evento-elimina'),
     path('status/<int:pk>', StatusView.as_view(), name='status'),
+    path('status/<int:pk>/classifica', StatusClassificaView.as_view(), name='status-classifica'),
+    path('status/<int:pk>/timeline', StatusTimelineView.as_view(), name='status-timeline'),
     path('classifica/<int:pk>/squadre', ClassificaView.as_view(), name='classifica-squadre'),
     path('classifica/<int:pk>/problemi', PuntiProblemiView.as_view(), name='classifica-problemi'),
     path('classifica/<int:pk>/stato', StatoProblemiView.as_view(), name='classifica-stato'),
     path('classifica/<int:pk>/unica', UnicaView.as_view(), name='classifica-unica'),
     path('classifica/<int:pk>/scorrimento', ScorrimentoView.as_view(), name='classifica-scorrimento'),
+    path('classifica/<int:pk>/benchmark', ClassificaBenchmarkView.as_view(), name='classifica-benchmark'),
     path('about', AboutView.as_view(), name="about"),
     path('now', NowView.as_view(), name="now")
 ]
@@ -5,18 +5,25 @@ from django.urls import reverse
 from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib.auth.mixins import UserPassesTestMixin, LoginRequiredMixin, PermissionRequiredMixin
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.gzip import gzip_page
 from django.db import transaction
 from django.contrib.auth import login, authenticate
 from django import forms
-from django.db.models import F
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 
-from engine.models import User, Gara, Soluzione, Squadra, Evento, Consegna, Jolly, Bonus
+from engine.models import User, Gara, Soluzione, Squadra, Evento, Consegna, Jolly, Bonus, ArchivioGara
 from engine.forms import SignUpForm, RispostaFormset, SquadraFormset, InserimentoForm,\
     ModificaConsegnaForm, ModificaJollyForm, ModificaBonusForm, UploadGaraForm, QueryForm, CreaGaraForm, ModificaGaraForm
 from engine.formfields import IntegerMultiField
+from engine.classifica import get_classifica_corrente, get_timeline_classifica, get_notifica, attendi_notifica
 
+import json
+import threading
 import logging
 logger = logging.getLogger(__name__)
 
@@ -195,7 +202,10 @@ class GaraAdminView(CheckPermissionsMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['num_eventi'] = len(self.object.eventi.all())
+        if self.object.archiviata:
+            context['num_eventi'] = len(self.object.archivio.get_eventi())
+        else:
+            context['num_eventi'] = len(self.object.eventi.all())
         return context
 
     def post(self, request, *args, **kwargs):
@@ -203,6 +213,7 @@ class GaraAdminView(CheckPermissionsMixin, DetailView):
             loraesatta = timezone.now()
             gara = self.object
             gara.inizio = loraesatta
+            gara.sospensioni = []
             gara.save()
         return super().get(self, request)
 
@@ -288,14 +299,14 @@ class UploadGaraView(PermissionRequiredMixin, SuccessMessageMixin, FormView):
         return super().form_valid(form)
 
 
+@method_decorator(gzip_page, name='dispatch')
 class DownloadGaraView(DetailView):
-    """ Serializza la gara e crea un json da scaricare """
+    """ Serializza la gara e crea un json da scaricare, trasmesso man mano che gli eventi vengono letti """
     model = Gara
 
     def get(self, request, *args, **kwargs):
-        super().get(request, *args, **kwargs)
-        data = self.object.dump_to_json()
-        response = HttpResponse(data, content_type="application/json")
+        self.object = self.get_object()
+        response = StreamingHttpResponse(self.object.dump_to_json_chunks(), content_type="application/json")
         response['Content-Disposition'] = 'attachment; filename={}.json'.format(self.object.nome)
         return response
 
@@ -320,7 +331,10 @@ class GaraResetView(CheckPermissionsMixin, SuccessMessageMixin, FormView, Detail
         Consegna.history.filter(gara=gara).delete()
         Bonus.objects.filter(gara=gara).delete()
         Bonus.history.filter(gara=gara).delete()
+        ArchivioGara.objects.filter(gara=gara).delete()
+        gara.archiviata = False
         gara.inizio = None
+        gara.sospensioni = []
         gara.save()
         return super().form_valid(form)
 
@@ -375,14 +389,9 @@ class GaraResumeView(CheckPermissionsMixin, SuccessMessageMixin, FormView, Detai
         self.object = self.get_object()
         return self.request.user.can_administrate(self.object)
 
-    @transaction.atomic
     def form_valid(self, form):
         gara = self.object
-        loraesatta = timezone.now()
-        shift = loraesatta - gara.sospensione
-        gara.inizio += shift
-        gara.eventi.update(orario=F("orario") + shift)
-        gara.sospensione = None
+        gara.riprendi(timezone.now())
         gara.save()
         return super().form_valid(form)
 
@@ -403,11 +412,29 @@ class QueryView(CheckPermissionsMixin, DetailView, FormView):
         self.object = self.get_object()
         return self.request.user.can_administrate(self.object)
 
+    eventi_per_pagina = 200
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        # Un evento in più per sapere se esiste una pagina successiva
+        eventi = self.object.get_all_eventi(self.request.user, self.request.GET.get('id_evento'), self.request.GET.get('num_squadra'), self.request.GET.get('problema'), self.request.GET.get('risposta'),
+                                            dopo=self.request.GET.get('dopo'), limit=self.eventi_per_pagina + 1)
+        pagina_successiva = None
+        if len(eventi) > self.eventi_per_pagina:
+            eventi = eventi[:self.eventi_per_pagina]
+            querystring = self.request.GET.copy()
+            querystring['dopo'] = eventi[-1].pk
+            pagina_successiva = querystring.urlencode()
+        prima_pagina = None
+        if self.request.GET.get('dopo'):
+            querystring = self.request.GET.copy()
+            del querystring['dopo']
+            prima_pagina = querystring.urlencode()
         context.update({
             'squadre_inseribili': self.object.get_squadre_inseribili(self.request.user),
-            'eventi': self.object.get_all_eventi(self.request.user, self.request.GET.get('id_evento'), self.request.GET.get('num_squadra'), self.request.GET.get('problema'), self.request.GET.get('risposta'))
+            'eventi': eventi,
+            'pagina_successiva': pagina_successiva,
+            'prima_pagina': prima_pagina,
         })
         return context
 
@@ -454,7 +481,7 @@ class InserimentoView(CheckPermissionsMixin, DetailView, FormView):
         return kwargs
 
     def get_success_url(self, **kwargs):
-        return reverse("engine:inserimento", kwargs={'pk': self.get_object().pk})
+        return reverse("engine:inserimento", kwargs={'pk': self.object.pk})
 
     def form_valid(self, form, *args, **kwargs):
         consegna = form.get_instance()
@@ -467,7 +494,7 @@ class InserimentoView(CheckPermissionsMixin, DetailView, FormView):
         return super().form_valid(form)
 
     def form_invalid(self, form, *args, **kwargs):
-        messages.error(self.request, f"Inserimento non riuscito. Vedere l'elenco puntato sotto \"Gara: {self.get_object().nome} - inserimento risposte\" per maggiori dettagli sull'errore.")
+        messages.error(self.request, f"Inserimento non riuscito. Vedere l'elenco puntato sotto \"Gara: {self.object.nome} - inserimento risposte\" per maggiori dettagli sull'errore.")
         return super().form_invalid(form)
 
 
@@ -560,21 +587,86 @@ class EliminaEventoView(CheckPermissionsMixin, DeleteView):
 
 class StatusView(DetailView):
     model = Gara
+    # Se abilitato, le richieste di aggiornamento restano in attesa di nuovi eventi (vedi LONG_POLLING)
+    long_polling = settings.LONG_POLLING
+    # Durata massima (in secondi) di una richiesta in attesa di aggiornamenti
+    attesa_massima = settings.LONG_POLLING_ATTESA
+    # Senza long polling, secondi che il client attende tra una richiesta di aggiornamento e la successiva
+    intervallo_aggiornamento = 3
+    # Evita che più richieste contemporanee ricostruiscano lo stesso snapshot
+    _lock_snapshot = threading.Lock()
+
+    def get_queryset(self):
+        return Gara.con_numero_eventi()
 
     def get(self, request, *args, **kwargs):
-        gara = self.get_object()
-        resp = {}
-        resp['last_update'] = gara.get_last_update()
-
-        if "last_consegna_id" in request.GET or "last_jolly_id" in request.GET or "last_bonus_id" in request.GET:
-            assert "last_consegna_id" in request.GET
-            resp['consegne'] = gara.get_consegne(request.GET["last_consegna_id"])
-            assert "last_jolly_id" in request.GET
-            resp['jolly'] = gara.get_jolly(request.GET["last_jolly_id"])
-            assert "last_bonus_id" in request.GET
-            resp['bonus'] = gara.get_bonus(request.GET["last_bonus_id"])
+        # Il token va letto prima dei dati, in modo che una modifica successiva risvegli la prossima attesa
+        notifica = get_notifica(self.kwargs['pk'])
+        # Formato compatto a colonne per consegne, jolly e bonus (vedi Gara.eventi_in_colonne)
+        colonne = request.GET.get("formato") == "colonne"
+
+        if "last_evento_id" in request.GET:
+            try:
+                last_evento_id = int(request.GET["last_evento_id"])
+            except ValueError:
+                return JsonResponse({"errore": "last_evento_id non valido"}, status=400)
+            # Un aggiornamento costa due query: la gara, con il numero di eventi, e gli eventi successivi al cursore
+            gara = self.get_object()
+            resp = {}
+            resp['last_update'] = gara.ultima_modifica
+            resp['notifica'] = notifica
+            if "notifica" in request.GET:
+                if self.long_polling:
+                    # Long polling: la risposta viene trattenuta finché i dati di gara non cambiano
+                    resp['notifica'] = attendi_notifica(gara.pk, request.GET["notifica"], self.attesa_massima)
+                    resp['last_update'] = gara.get_last_update()
+                    resp['attesa'] = 0
+                else:
+                    resp['attesa'] = self.intervallo_aggiornamento
+            if not gara.archiviata:
+                # Le transazioni possono essere confermate in un ordine diverso da quello degli identificativi,
+                # quindi un evento precedente al cursore può diventare visibile dopo: il client confronta il
+                # numero di eventi ricevuti con questo, e se ne ha meno ricarica lo stato completo
+                resp['num_eventi'] = gara.num_eventi
+            # Aggiornamento incrementale: solo gli eventi successivi al cursore, in una sola query
+            resp.update(gara.get_eventi_successivi(last_evento_id))
+            if colonne and gara.inizio is not None:
+                resp = gara.eventi_in_colonne(resp)
             return JsonResponse(resp)
 
+        # Lo stato completo è uguale per tutti gli utenti, tranne le squadre di cui l'utente è consegnatore
+        if request.user.is_authenticated:
+            ids = list(Squadra.objects.filter(gara_id=self.kwargs['pk'], consegnatore=request.user).values_list("num", flat=True))
+        else:
+            ids = []
+        snapshot = self.get_snapshot(self.get_object(), notifica, colonne)
+        return HttpResponse(snapshot[:-1] + b', "consegnatore_per": ' + json.dumps(ids).encode() + b'}',
+                            content_type="application/json")
+
+    def get_snapshot(self, gara, notifica, colonne=False):
+        """
+        Restituisce lo stato completo della gara già serializzato, dalla cache se è stato costruito con lo stesso
+        token di notifica e la stessa versione dei dati di gara. Il token cambia solo nei processi che condividono
+        la cache con quello che ha salvato la modifica; la versione, cioè l'ultima modifica sostanziale e il numero
+        di eventi, viene letta dal database insieme alla gara (prima dei dati) ed è la stessa per tutti i processi.
+        """
+        chiave = "engine:status:{}:{}".format(gara.pk, "colonne" if colonne else "liste")
+        versione = (notifica, gara.ultima_modifica, gara.num_eventi)
+        dati = cache.get(chiave)
+        if dati is not None and dati[0] == versione:
+            return dati[1]
+        with self._lock_snapshot:
+            dati = cache.get(chiave)
+            if dati is not None and dati[0] == versione:
+                return dati[1]
+            snapshot = json.dumps(self.get_dati_completi(gara, notifica, colonne), cls=DjangoJSONEncoder).encode()
+            cache.set(chiave, (versione, snapshot), None)
+        return snapshot
+
+    def get_dati_completi(self, gara, notifica, colonne=False):
+        resp = {}
+        resp['last_update'] = gara.ultima_modifica
+        resp['notifica'] = notifica
         resp['nome'] = gara.nome
         resp['inizio'] = gara.inizio
         resp['squadre'] = gara.get_squadre()
@@ -586,14 +678,9 @@ class StatusView(DetailView):
         resp['k_blocco'] = gara.k_blocco
         resp['punteggio_iniziale_squadre'] = gara.punteggio_iniziale_squadre
         resp['jolly_enabled'] = gara.jolly
-        if request.user.is_authenticated:
-            ids = list(gara.squadre.filter(consegnatore=request.user).values_list("num", flat=True).all())
-        else:
-            ids = []
-        resp['consegnatore_per'] = ids
 
         if gara.inizio is None:
-            return JsonResponse(resp)
+            return resp
 
         resp['fine'] = gara.get_ora_fine()
         resp['tempo_blocco'] = gara.get_ora_blocco()
@@ -601,8 +688,36 @@ class StatusView(DetailView):
         resp['consegne'] = gara.get_consegne()
         resp['jolly'] = gara.get_jolly()
         resp['bonus'] = gara.get_bonus()
+        resp['last_evento_id'] = max((e['id'] for k in ('consegne', 'jolly', 'bonus') for e in resp[k]), default=0)
+        if colonne:
+            resp = gara.eventi_in_colonne(resp)
+
+        return resp
+
+
+class StatusClassificaView(DetailView):
+    """
+    Classifica all'orario corrente, calcolata sul server a partire dallo stato in cache. Le pagine delle classifiche
+    non la usano: client.js ricalcola la classifica a partire dagli eventi, perché deve poterla mostrare
+    a qualsiasi orario di gara, e scarica quindi lo stato completo (vedi StatusView).
+    """
+    model = Gara
+
+    def get(self, request, *args, **kwargs):
+        gara = self.get_object()
+        return JsonResponse(get_classifica_corrente(gara))
+
 
-        return JsonResponse(resp)
+class StatusTimelineView(DetailView):
+    """ Posizioni e punteggi delle squadre dopo ogni consegna, per la visualizzazione della gara a posteriori """
+    model = Gara
+
+    def get_queryset(self):
+        return Gara.con_numero_eventi()
+
+    def get(self, request, *args, **kwargs):
+        gara = self.get_object()
+        return JsonResponse(get_timeline_classifica(gara))
 
 
 class ClassificaBaseView(UserPassesTestMixin, DetailView):
@@ -674,6 +789,26 @@ class ClassificaBaseView(UserPassesTestMixin, DetailView):
         return context
 
 
+class ClassificaBenchmarkView(CheckPermissionsMixin, DetailView):
+    """
+    Misura nel browser il tempo per spostarsi nel tempo di una gara conclusa, come fa la barra di scorrimento
+    della visualizzazione a posteriori. Per le gare più lunghe si possono caricare i journal nella cartella data
+    di mathrace_interaction con mathrace_interaction.journal_reader.
+    """
+    model = Gara
+    template_name = "classifiche/benchmark.html"
+
+    def test_func(self):
+        self.object = self.get_object()
+        return self.request.user.can_administrate(self.object)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        ripetizioni = self.request.GET.get("ripetizioni", "")
+        context["ripetizioni"] = int(ripetizioni) if ripetizioni.isdecimal() and int(ripetizioni) > 0 else 5
+        return context
+
+
 class ClassificaView(ClassificaBaseView):
     """ Visualizzazione classifica squadre """
     model = Gara